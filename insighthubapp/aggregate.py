@@ -0,0 +1,129 @@
+import array, math
+from django.conf import settings
+
+
+# Group-by aggregation over the column store
+#
+# Rows are grouped by the chart's category column and, when one is selected,
+# its series column; the y column is folded into per-group sum / count / min /
+# max accumulators a block of rows at a time. Only the group keys and the
+# float64 y values are read, and the result is one value per (category,
+# series) pair, so the chart payload scales with the number of groups rather
+# than the number of rows. Blank keys are grouped under BLANK_LABEL.
+
+AGGREGATES = ("sum", "mean", "count", "min", "max")
+DEFAULT_AGGREGATE = "sum"
+DEFAULT_MAX_GROUPS = 1000
+BLANK_LABEL = "(blank)"
+BLOCK_ROWS = 65536    # rows read per column per step
+
+
+def max_groups():
+    return getattr(settings, "AGGREGATE_MAX_GROUPS", DEFAULT_MAX_GROUPS)
+
+
+# Running accumulators, one slot per group
+class _Accumulator:
+    def __init__(self):
+        self.sum = array.array("d")
+        self.count = array.array("q")
+        self.min = array.array("d")
+        self.max = array.array("d")
+
+    def add_group(self):
+        self.sum.append(0.0)
+        self.count.append(0)
+        self.min.append(math.inf)
+        self.max.append(-math.inf)
+
+    def add(self, group, value):
+        self.sum[group] += value
+        self.count[group] += 1
+        if value < self.min[group]:
+            self.min[group] = value
+        if value > self.max[group]:
+            self.max[group] = value
+
+    def result(self, group, agg):
+        count = self.count[group]
+        if agg == "count":
+            return count
+        if not count:
+            return None
+        if agg == "sum":
+            return self.sum[group]
+        if agg == "mean":
+            return self.sum[group] / count
+        return self.min[group] if agg == "min" else self.max[group]
+
+
+# Aggregate y per group of the key columns; returns labels (first key), series
+# (second key, or [y] without one) and a data list per series aligned to labels
+def group_by(store, keys, y, agg=DEFAULT_AGGREGATE, limit=None):
+    if agg not in AGGREGATES:
+        raise ValueError(f"Unknown aggregate {agg!r}.")
+    if not keys or len(keys) > 2:
+        raise ValueError("Group by one or two columns.")
+    for name in list(keys) + [y]:
+        if name not in store.header:
+            raise ValueError(f"Unknown column {name!r}.")
+
+    numeric = store.is_numeric(y)
+    if agg != "count" and not numeric:
+        raise ValueError(f"Column {y!r} is not numeric.")
+    limit = limit or max_groups()
+
+    groups = {}
+    labels, series = {}, {}
+    acc = _Accumulator()
+    truncated = False
+
+    for start in range(0, store.row_count, BLOCK_ROWS):
+        stop = min(start + BLOCK_ROWS, store.row_count)
+        key_cells = [[cell if cell.strip() else BLANK_LABEL for cell in store.text(name, start, stop)] for name in keys]
+        if numeric:
+            values = store.values(y, start, stop)
+        else:
+            values = [0.0 if cell.strip() else math.nan for cell in store.text(y, start, stop)]
+
+        for key, value in zip(zip(*key_cells), values):
+            group = groups.get(key)
+            if group is None:
+                if len(groups) >= limit:
+                    truncated = True
+                    continue
+                group = groups[key] = len(groups)
+                acc.add_group()
+                labels.setdefault(key[0], len(labels))
+                series.setdefault(key[1] if len(key) > 1 else y, len(series))
+            if value == value:    # NaN (blank or unparsable) rows don't count
+                acc.add(group, value)
+
+    data = [[None] * len(labels) for _ in series]
+    for key, group in groups.items():
+        s = series[key[1] if len(key) > 1 else y]
+        data[s][labels[key[0]]] = acc.result(group, agg)
+
+    return {
+        "keys": list(keys),
+        "y": y,
+        "agg": agg,
+        "labels": list(labels),
+        "series": list(series),
+        "data": data,
+        "groups": len(groups),
+        "truncated": truncated,
+        "rows": store.row_count,
+    }
+
+
+# Aggregate for a chart's axis selection, or None when no category is selected
+def chart_aggregate(store, axis, agg=DEFAULT_AGGREGATE):
+    if store is None or not store.header or not axis.get("category"):
+        return None
+    keys = [axis["category"]]
+    y = axis.get("y") or store.header[min(1, len(store.header) - 1)]
+    # A series that is the y column itself is the measured value, not a key
+    if axis.get("series") and axis["series"] not in (axis["category"], y):
+        keys.append(axis["series"])
+    return group_by(store, keys, y, agg)
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class InsighthubappConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'insighthubapp'
+
+    def ready(self):
+        from . import signals  # noqa: F401  (connects the page cache receivers)
@@ -0,0 +1,595 @@
+import array, bisect, codecs, csv, errno, hashlib, io, itertools, json, mmap, os, shutil, tempfile
+from .inference import ColumnTypeInferrer, encode_value, value_family
+
+
+# Columnar sidecar store
+#
+# Every uploaded CSV gets a "<file>.cols/" directory next to it holding one
+# set of files per column plus a small manifest:
+#   c<N>.off  uint64 end offsets of each cell inside c<N>.str
+#   c<N>.str  utf-8 cell text, back to back
+#   c<N>.f8   float64 values for int/float/bool/datetime columns (NaN for
+#             blanks, datetimes as epoch seconds)
+# Cell edits, row inserts and row deletes are appended to journal.jsonl and
+# replayed on open; compact_store() folds them back into the CSV.
+# The files are memory-mapped on read so views only touch the columns they use.
+
+STORE_VERSION = 3
+STORE_SUFFIX = ".cols"
+MANIFEST_NAME = "manifest.json"
+JOURNAL_NAME = "journal.jsonl"
+CHUNK_SIZE = 1024 * 1024    # bytes read from the CSV per step
+HEADER_CHUNK_SIZE = 64 * 1024    # bytes read per step when only the header is wanted
+FLUSH_ROWS = 65536    # rows buffered per column before appending to disk
+
+
+def store_dir_for(csv_path):
+    return f"{csv_path}{STORE_SUFFIX}"
+
+
+# Position of the last record-ending newline that is not inside quotes, or -1
+def _last_record_end(text):
+    parts = text.split('"')
+    offset = len(text)
+    for i in range(len(parts) - 1, -1, -1):
+        offset -= len(parts[i])
+        if i % 2 == 0:
+            newline = parts[i].rfind("\n")
+            if newline >= 0:
+                return offset + newline
+        offset -= 1
+    return -1
+
+
+# Incremental CSV parser: feed raw byte chunks, get back complete records.
+# A UTF-8 byte order mark at the start of the file is dropped.
+class CsvStreamParser:
+    def __init__(self):
+        self._decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+        self._pending = ""
+
+    def _parse(self, text):
+        return [row for row in csv.reader(io.StringIO(text, newline="")) if row]
+
+    def feed(self, chunk):
+        text = self._pending + self._decoder.decode(chunk)
+        end = _last_record_end(text)
+        if end < 0:
+            self._pending = text
+            return []
+        self._pending = text[end + 1:]
+        return self._parse(text[:end + 1])
+
+    def close(self):
+        text = self._pending + self._decoder.decode(b"", final=True)
+        self._pending = ""
+        return self._parse(text) if text else []
+
+
+# Buffers one column and appends it to its files every FLUSH_ROWS rows;
+# each flushed batch also goes through type inference
+class _ColumnWriter:
+    def __init__(self, directory, index):
+        self.prefix = os.path.join(directory, f"c{index}")
+        self.inferrer = ColumnTypeInferrer()
+        self.rows = 0
+        self.size = 0
+        self.kind = None
+        self._cells = []
+
+    def append(self, cell):
+        self._cells.append(cell)
+
+    def flush(self):
+        offsets = array.array("Q")
+        text = bytearray()
+        for cell in self._cells:
+            text += cell.encode("utf-8")
+            offsets.append(self.size + len(text))
+        self.size += len(text)
+        self.rows += len(self._cells)
+
+        with open(self.prefix + ".str", "ab") as f:
+            f.write(text)
+        with open(self.prefix + ".off", "ab") as f:
+            offsets.tofile(f)
+        for family, values in self.inferrer.update(self._cells).items():
+            with open(f"{self.prefix}.{family}.f8", "ab") as f:
+                values.tofile(f)
+        self._cells = []
+
+    # Settle the column type and keep only the value file that matches it
+    def finish(self):
+        self.kind = self.inferrer.result()
+        keep = value_family(self.kind)
+        for family in ("number", "bool", "datetime"):
+            path = f"{self.prefix}.{family}.f8"
+            if not os.path.exists(path):
+                continue
+            if family == keep:
+                os.replace(path, self.prefix + ".f8")
+            else:
+                os.remove(path)
+        if keep and not os.path.exists(self.prefix + ".f8"):
+            open(self.prefix + ".f8", "wb").close()
+
+    def describe(self, name):
+        column = {
+            "name": name,
+            "kind": self.kind,
+            "nulls": self.rows - self.inferrer.non_null,
+        }
+        if self.kind == "datetime":
+            column["format"] = self.inferrer.datetime_format
+        return column
+
+
+# Writes parsed CSV records into a store directory; the first record is the header
+class StoreWriter:
+    def __init__(self, directory):
+        self.directory = directory
+        self.header = None
+        self.row_count = 0
+        self._columns = []
+        self._buffered = 0
+
+    def append(self, row):
+        if self.header is None:
+            self.header = list(row)
+            self._columns = [_ColumnWriter(self.directory, i) for i in range(len(row))]
+            return
+
+        width = len(self._columns)
+        if len(row) < width:
+            row = list(row) + [""] * (width - len(row))
+        for column, cell in zip(self._columns, row):
+            column.append(cell)
+
+        self.row_count += 1
+        self._buffered += 1
+        if self._buffered >= FLUSH_ROWS:
+            self.flush()
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def flush(self):
+        for column in self._columns:
+            column.flush()
+        self._buffered = 0
+
+    def close(self, **extra):
+        self.flush()
+        for column in self._columns:
+            column.finish()
+        header = self.header or []
+        manifest = {
+            "version": STORE_VERSION,
+            "header": header,
+            "row_count": self.row_count,
+            "columns": [c.describe(name) for c, name in zip(self._columns, header)],
+        }
+        manifest.update(extra)
+        write_manifest(self.directory, manifest)
+        return manifest
+
+
+def write_manifest(directory, manifest):
+    tmp_path = os.path.join(directory, MANIFEST_NAME + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, os.path.join(directory, MANIFEST_NAME))
+
+
+def read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+# Record the CSV's size and mtime so stale stores can be detected cheaply
+def stamp_source(directory, csv_path, manifest):
+    stat = os.stat(csv_path)
+    manifest["source_size"] = stat.st_size
+    manifest["source_mtime_ns"] = stat.st_mtime_ns
+    write_manifest(directory, manifest)
+    return manifest
+
+
+# Swap a freshly built store directory into place. Another build of the same
+# CSV may install its store between the two renames; that one is kept and
+# ours discarded, as both were built from the same file.
+def install_store(build_dir, csv_path):
+    target = store_dir_for(csv_path)
+    stale = None
+    if os.path.exists(target):
+        stale = tempfile.mkdtemp(prefix=".stale-", dir=os.path.dirname(target))
+        os.rmdir(stale)
+        try:
+            os.rename(target, stale)
+        except FileNotFoundError:
+            stale = None    # a concurrent build moved it aside first
+    try:
+        os.rename(build_dir, target)
+    except OSError as e:
+        if e.errno not in (errno.EEXIST, errno.ENOTEMPTY):
+            raise
+        shutil.rmtree(build_dir, ignore_errors=True)
+    if stale:
+        shutil.rmtree(stale, ignore_errors=True)
+    return target
+
+
+def remove_store(csv_path):
+    shutil.rmtree(store_dir_for(csv_path), ignore_errors=True)
+
+
+# Header row of a CSV, reading no further than the chunk that ends it
+def read_header(csv_path):
+    parser = CsvStreamParser()
+    with open(csv_path, "rb") as f:
+        for chunk in iter(lambda: f.read(HEADER_CHUNK_SIZE), b""):
+            rows = parser.feed(chunk)
+            if rows:
+                return rows[0]
+    rows = parser.close()
+    return rows[0] if rows else []
+
+
+# Parse the CSV in bounded chunks and (re)write its columnar store
+def build_store(csv_path):
+    build_dir = tempfile.mkdtemp(prefix=".build-", dir=os.path.dirname(csv_path))
+    try:
+        parser = CsvStreamParser()
+        writer = StoreWriter(build_dir)
+        digest = hashlib.sha256()
+        byte_size = 0
+
+        with open(csv_path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+                byte_size += len(chunk)
+                writer.extend(parser.feed(chunk))
+        writer.extend(parser.close())
+
+        manifest = writer.close(sha256=digest.hexdigest(), byte_size=byte_size)
+        stamp_source(build_dir, csv_path, manifest)
+        directory = install_store(build_dir, csv_path)
+    except Exception:
+        shutil.rmtree(build_dir, ignore_errors=True)
+        raise
+    return ColumnStore(directory, read_manifest(directory) or manifest)
+
+
+# Fold the edit journal back into the CSV and rebuild the store from it
+def compact_store(csv_path):
+    store = open_store(csv_path)
+    if not store.overlay:
+        return store
+
+    fd, tmp_path = tempfile.mkstemp(prefix=".compact-", dir=os.path.dirname(csv_path))
+    try:
+        with os.fdopen(fd, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(store.header)
+            for start in range(0, store.row_count, FLUSH_ROWS):
+                writer.writerows(store.rows(start=start, stop=start + FLUSH_ROWS))
+        os.replace(tmp_path, csv_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    store.close()
+    return build_store(csv_path)
+
+
+def is_fresh(manifest, csv_path):
+    if not manifest or manifest.get("version") != STORE_VERSION:
+        return False
+    stat = os.stat(csv_path)
+    return (manifest.get("source_size") == stat.st_size
+            and manifest.get("source_mtime_ns") == stat.st_mtime_ns)
+
+
+# Open the store for a CSV, rebuilding it first when the CSV has changed
+def open_store(csv_path):
+    directory = store_dir_for(csv_path)
+    manifest = read_manifest(directory)
+    if not is_fresh(manifest, csv_path):
+        return build_store(csv_path)
+    return ColumnStore(directory, manifest)
+
+
+# Store for a Datasets row, or None when it has no file
+def store_for(dataset):
+    if not dataset or not dataset.file_path:
+        return None
+    return open_store(dataset.file_path.path)
+
+
+# Edits recorded since the store was built, replayed over the base columns.
+# Rows are addressed by key: >= 0 is a base row, < 0 is inserted row (-key - 1).
+# The sheet is kept as runs of consecutive keys, (first key, length), counting
+# up through base rows and down through inserted ones, so a read copies each
+# run of base rows straight from the mapped column and only patches the cells
+# edited inside it.
+class EditOverlay:
+    def __init__(self, base_rows, width):
+        self.base_rows = base_rows
+        self.width = width
+        self.runs = [(0, base_rows)] if base_rows else []
+        self.inserted = []
+        self.edits = {}    # column -> {base row key: cell}
+        self.header_edits = {}
+        self.op_count = 0
+        self._starts = None    # sheet row each run starts at, rebuilt after a change
+
+    @property
+    def row_count(self):
+        return sum(length for _, length in self.runs)
+
+    def _run_starts(self):
+        if self._starts is None:
+            self._starts = list(itertools.accumulate((length for _, length in self.runs), initial=0))
+        return self._starts
+
+    def key(self, row):
+        starts = self._run_starts()
+        run = bisect.bisect_right(starts, row) - 1
+        first, _ = self.runs[run]
+        offset = row - starts[run]
+        return first + offset if first >= 0 else first - offset
+
+    # Index of the run starting at sheet row `row`, splitting the run it falls in
+    def _split(self, row):
+        starts = self._run_starts()
+        run = bisect.bisect_right(starts, row) - 1
+        if run >= len(self.runs):
+            return len(self.runs)
+        if starts[run] == row:
+            return run
+        first, length = self.runs[run]
+        offset = row - starts[run]
+        rest = first + offset if first >= 0 else first - offset
+        self.runs[run:run + 1] = [(first, offset), (rest, length - offset)]
+        self._starts = None
+        return run + 1
+
+    # (first key, length) runs covering sheet rows [start, stop)
+    def segments(self, start, stop):
+        starts = self._run_starts()
+        run = max(bisect.bisect_right(starts, start) - 1, 0)
+        while run < len(self.runs) and starts[run] < stop:
+            first, length = self.runs[run]
+            lo, hi = max(start, starts[run]), min(stop, starts[run] + length)
+            if lo < hi:
+                offset = lo - starts[run]
+                yield (first + offset if first >= 0 else first - offset), hi - lo
+            run += 1
+
+    # (key, cell) of the column's edits to base rows [first, stop)
+    def edits_in(self, col, first, stop):
+        edits = self.edits.get(col)
+        if not edits:
+            return []
+        if len(edits) <= stop - first:
+            return [(key, cell) for key, cell in edits.items() if first <= key < stop]
+        return [(key, edits[key]) for key in range(first, stop) if key in edits]
+
+    # Overlaid text of one cell, or None when the base column holds it
+    def cell(self, key, col):
+        if key < 0:
+            return self.inserted[-key - 1][col]
+        edits = self.edits.get(col)
+        return edits.get(key) if edits else None
+
+    def apply(self, op):
+        self.op_count += 1
+        kind = op["op"]
+        if kind == "header":
+            self.header_edits[op["col"]] = op["value"]
+        elif kind == "set":
+            key = self.key(op["row"])
+            if key < 0:
+                self.inserted[-key - 1][op["col"]] = op["value"]
+            else:
+                self.edits.setdefault(op["col"], {})[key] = op["value"]
+        elif kind == "insert":
+            run = self._split(op["row"])
+            self.runs.insert(run, (-len(self.inserted) - 1, len(op["values"])))
+            self.inserted.extend(list(row) for row in op["values"])
+            self._starts = None
+        elif kind == "delete":
+            first = self._split(op["row"])
+            last = self._split(op["row"] + op["count"])
+            del self.runs[first:last]
+            self._starts = None
+
+
+# Append a patch to the store's edit journal; returns the journal's size
+# before it, for truncate_journal() to take the patch back off
+def append_journal(directory, version, ops):
+    with open(os.path.join(directory, JOURNAL_NAME), "a") as f:
+        offset = f.tell()
+        f.write(json.dumps({"version": version, "ops": ops}) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    return offset
+
+
+# Cut the journal back to `size` bytes (an offset from append_journal())
+def truncate_journal(directory, size):
+    with open(os.path.join(directory, JOURNAL_NAME), "r+") as f:
+        f.truncate(size)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_journal(directory):
+    try:
+        with open(os.path.join(directory, JOURNAL_NAME)) as f:
+            return [json.loads(line) for line in f if line.strip()]
+    except OSError:
+        return []
+
+
+# Read-only, memory-mapped view over a store directory (plus its edit journal)
+class ColumnStore:
+    def __init__(self, directory, manifest):
+        self.directory = directory
+        self.manifest = manifest
+        self.header = list(manifest["header"])
+        self.row_count = manifest["row_count"]
+        self.columns = manifest["columns"]
+        self.overlay = None
+        self._maps = {}
+
+        journal = read_journal(directory)
+        if journal:
+            self.overlay = EditOverlay(self.row_count, len(self.header))
+            for entry in journal:
+                for op in entry["ops"]:
+                    self.overlay.apply(op)
+            for col, value in self.overlay.header_edits.items():
+                self.header[col] = value
+            self.row_count = self.overlay.row_count
+
+    @property
+    def journal_ops(self):
+        return self.overlay.op_count if self.overlay else 0
+
+    @property
+    def sha256(self):
+        return self.manifest.get("sha256")
+
+    def index(self, name):
+        return self.header.index(name)
+
+    def kind(self, name):
+        return self.columns[self.index(name)]["kind"]
+
+    def is_numeric(self, name):
+        return value_family(self.kind(name)) is not None
+
+    def _map(self, filename):
+        if filename not in self._maps:
+            path = os.path.join(self.directory, filename)
+            if os.path.getsize(path) == 0:
+                self._maps[filename] = b""
+            else:
+                with open(path, "rb") as f:
+                    self._maps[filename] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._maps[filename]
+
+    def _offsets(self, index):
+        buffer = self._map(f"c{index}.off")
+        return memoryview(buffer).cast("Q") if buffer else memoryview(array.array("Q"))
+
+    def _bounds(self, start, stop):
+        stop = self.row_count if stop is None else min(stop, self.row_count)
+        return max(start, 0), max(stop, 0)
+
+    # Cell text of one column for rows [start, stop)
+    def text(self, name, start=0, stop=None):
+        start, stop = self._bounds(start, stop)
+        if start >= stop:
+            return []
+        index = self.index(name)
+        if not self.overlay:
+            return self._base_text(index, start, stop)
+        overlay = self.overlay
+        cells = []
+        for first, length in overlay.segments(start, stop):
+            if first < 0:
+                cells.extend(overlay.inserted[-first - 1 + i][index] for i in range(length))
+                continue
+            at = len(cells)
+            cells.extend(self._base_text(index, first, first + length))
+            for key, cell in overlay.edits_in(index, first, first + length):
+                cells[at + key - first] = cell
+        return cells
+
+    # Cell text of base rows [start, stop) of the column at `index`
+    def _base_text(self, index, start, stop):
+        offsets = self._offsets(index)
+        blob = self._map(f"c{index}.str")
+        base = offsets[start - 1] if start else 0
+        block = blob[base:offsets[stop - 1]]
+        cells = []
+        previous = 0
+        for i in range(start, stop):
+            end = offsets[i] - base
+            cells.append(block[previous:end].decode("utf-8"))
+            previous = end
+        return cells
+
+    # Cell text of one column at the given row positions
+    def text_at(self, name, positions):
+        index = self.index(name)
+        offsets = self._offsets(index)
+        blob = self._map(f"c{index}.str")
+        overlay = self.overlay
+        cells = []
+        for i in positions:
+            if overlay:
+                i = overlay.key(i)
+                cell = overlay.cell(i, index)
+                if cell is not None:
+                    cells.append(cell)
+                    continue
+            start = offsets[i - 1] if i else 0
+            cells.append(blob[start:offsets[i]].decode("utf-8"))
+        return cells
+
+    # float64 values of a typed column for rows [start, stop), or None for text
+    def values(self, name, start=0, stop=None):
+        index = self.index(name)
+        if value_family(self.columns[index]["kind"]) is None:
+            return None
+        start, stop = self._bounds(start, stop)
+        buffer = self._map(f"c{index}.f8")
+        if self.overlay:
+            return memoryview(self._overlay_values(index, buffer, start, stop))
+        if not buffer or start >= stop:
+            return memoryview(array.array("d"))
+        return memoryview(buffer).cast("d")[start:stop]
+
+    # Base values run by run, with edited and inserted cells re-encoded on top
+    def _overlay_values(self, index, buffer, start, stop):
+        column = self.columns[index]
+        kind, datetime_format = column["kind"], column.get("format")
+        base = memoryview(buffer) if buffer else memoryview(b"")
+        overlay = self.overlay
+        values = array.array("d")
+        size = values.itemsize
+        if start >= stop:
+            return values
+        for first, length in overlay.segments(start, stop):
+            if first < 0:
+                values.extend(
+                    encode_value(kind, overlay.inserted[-first - 1 + i][index], datetime_format) for i in range(length)
+                )
+                continue
+            at = len(values)
+            values.frombytes(base[first * size:(first + length) * size])
+            for key, cell in overlay.edits_in(index, first, first + length):
+                values[at + key - first] = encode_value(kind, cell, datetime_format)
+        return values
+
+    # Row-major cells for the given columns (all columns by default)
+    def rows(self, columns=None, start=0, stop=None):
+        names = self.header if columns is None else columns
+        data = [self.text(name, start, stop) for name in names]
+        return [list(row) for row in zip(*data)] if data else []
+
+    def close(self):
+        for buffer in self._maps.values():
+            if isinstance(buffer, mmap.mmap):
+                try:
+                    buffer.close()
+                except BufferError:
+                    pass    # a caller still holds a view; GC closes it later
+        self._maps = {}
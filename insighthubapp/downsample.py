@@ -0,0 +1,113 @@
+import math
+from django.conf import settings
+
+
+# Line chart downsampling
+#
+# A line chart can't show more points than its canvas has pixels, so series
+# are reduced on the server to roughly one point per pixel before they are
+# sent. Both modes pick real rows (never averaged ones) and return their
+# positions, which keeps labels and values aligned:
+#   lttb    Largest-Triangle-Three-Buckets; per bucket keeps the point that
+#           forms the largest triangle with its neighbours, which follows the
+#           visual shape of the line
+#   minmax  keeps the lowest and highest point of every bucket, so no spike
+#           is ever lost (two points per bucket)
+# Positions are used as the x coordinate: rows are plotted in file order,
+# evenly spaced, whatever the x column holds. Blank (NaN) and infinite values
+# are never picked from a bucket, and a bucket with nothing else in it is
+# dropped; LTTB still keeps the first and last rows, whatever they hold.
+
+DOWNSAMPLE_MODES = ("lttb", "minmax")
+DEFAULT_MODE = "lttb"
+MIN_POINTS = 16
+
+
+# Point budget for a canvas `width` pixels wide, capped at CHART_MAX_POINTS
+def points_for_width(width):
+    cap = getattr(settings, "CHART_MAX_POINTS", 2000)
+    try:
+        width = int(width)
+    except (TypeError, ValueError):
+        return cap
+    return max(MIN_POINTS, min(width, cap))
+
+
+def _bucket_bounds(size, buckets, first=0):
+    step = size / buckets
+    return [(first + int(i * step), first + int((i + 1) * step)) for i in range(buckets)]
+
+
+# LTTB over values[0:len]; returns at most `threshold` sorted positions
+def lttb(values, threshold):
+    size = len(values)
+    if threshold >= size:
+        return list(range(size))
+    if threshold < 3:
+        return [0, size - 1][:max(threshold, 0)]
+
+    # First and last points are always kept; the rest are split into buckets
+    bounds = _bucket_bounds(size - 2, threshold - 2, first=1)
+    positions = [0]
+    a = 0
+    for i, (start, stop) in enumerate(bounds):
+        # Average point of the next bucket (the last point for the final one)
+        if i + 1 < len(bounds):
+            next_start, next_stop = bounds[i + 1]
+        else:
+            next_start, next_stop = size - 1, size
+        total, count = 0.0, 0
+        for j in range(next_start, next_stop):
+            v = values[j]
+            if math.isfinite(v):
+                total += v
+                count += 1
+        avg_x = (next_start + next_stop - 1) / 2
+        avg_y = total / count if count else math.nan
+
+        ax, ay = a, values[a]
+        best, best_area = None, -1.0
+        for j in range(start, stop):
+            if not math.isfinite(values[j]):
+                continue
+            # Twice the triangle area; when a blank neighbour makes it NaN the
+            # bucket's first finite point is kept
+            area = abs((ax - avg_x) * (values[j] - ay) - (ax - j) * (avg_y - ay))
+            if best is None or area > best_area:
+                best, best_area = j, area
+        if best is not None:
+            positions.append(best)
+            a = best
+    positions.append(size - 1)
+    return positions
+
+
+# Lowest and highest point per bucket; returns at most `threshold` sorted positions
+def minmax(values, threshold):
+    size = len(values)
+    if threshold >= size:
+        return list(range(size))
+
+    positions = []
+    for start, stop in _bucket_bounds(size, max(threshold // 2, 1)):
+        low = high = None
+        for j in range(start, stop):
+            v = values[j]
+            if not math.isfinite(v):
+                continue
+            if low is None or v < values[low]:
+                low = j
+            if high is None or v > values[high]:
+                high = j
+        if low is not None:
+            positions.extend(sorted({low, high}))
+    return positions
+
+
+# Row positions that keep the shape of `values` within `threshold` points
+def downsample(values, threshold, mode=DEFAULT_MODE):
+    if mode == "minmax":
+        return minmax(values, threshold)
+    if mode == "lttb":
+        return lttb(values, threshold)
+    raise ValueError(f"Unknown downsampling mode {mode!r}.")
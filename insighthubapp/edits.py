@@ -0,0 +1,247 @@
+import logging
+from django.conf import settings
+from django.db import transaction
+from . import datastore, ingest, jobs, profiles, pyramid, sketches, uploads
+from .models import Datasets, Dataset_Columns
+
+
+# Spreadsheet patches
+#
+# A patch is a batch of ops against the sheet as the client sees it:
+#   {"op": "set", "row": r, "col": c, "value": "..."}    edit one data cell
+#   {"op": "header", "col": c, "value": "..."}           rename a column
+#   {"op": "insert", "row": r, "count": n, "values": [[...], ...]}
+#   {"op": "delete", "row": r, "count": n}
+# Rows are 0-based data rows (the header is not a row). Each accepted patch
+# is appended to the store's journal and bumps Datasets.data_version; the CSV
+# itself is only rewritten once the journal grows past DATASET_JOURNAL_LIMIT.
+# The zoom pyramid (pyramid.py) is brought up to date with each patch.
+# Column profiles (profiles.py) are recomputed with each rewrite, so between
+# rewrites they describe the data as of the last one, apart from the column
+# sketches, which each patch feeds its new cells into.
+
+DEFAULT_JOURNAL_LIMIT = 1000
+DEFAULT_INSERT_LIMIT = 10000    # rows one patch may insert
+
+logger = logging.getLogger(__name__)
+
+
+class VersionConflict(Exception):
+    def __init__(self, version):
+        super().__init__(f"Dataset has moved on to version {version}.")
+        self.version = version
+
+
+# The dataset's latest ingest job is queued, running or failed: its store is
+# the worker's to build, and the job would overwrite the patch
+class IngestPending(Exception):
+    def __init__(self, status):
+        super().__init__(f"The dataset's ingest job is {status}.")
+        self.status = status
+
+
+def journal_limit():
+    return getattr(settings, "DATASET_JOURNAL_LIMIT", DEFAULT_JOURNAL_LIMIT)
+
+
+def insert_limit():
+    return getattr(settings, "PATCH_INSERT_LIMIT", DEFAULT_INSERT_LIMIT)
+
+
+def _cell(value):
+    return "" if value is None else str(value)
+
+
+# Validate ops against the sheet shape as it changes op by op; returns the
+# normalised ops or raises ValueError naming the first bad one
+def clean_ops(ops, row_count, width):
+    if not isinstance(ops, list) or not ops:
+        raise ValueError("ops must be a non-empty list.")
+
+    cleaned = []
+    inserted = 0
+    for n, op in enumerate(ops):
+        try:
+            kind = op["op"]
+            if kind in ("set", "header"):
+                col = int(op["col"])
+                if not 0 <= col < width:
+                    raise ValueError(f"op {n}: column {col} is out of range.")
+                if kind == "header":
+                    cleaned.append({"op": "header", "col": col, "value": _cell(op.get("value"))})
+                    continue
+                row = int(op["row"])
+                if not 0 <= row < row_count:
+                    raise ValueError(f"op {n}: row {row} is out of range.")
+                cleaned.append({"op": "set", "row": row, "col": col, "value": _cell(op.get("value"))})
+
+            elif kind == "insert":
+                row = int(op["row"])
+                values = op.get("values")
+                if not values:
+                    count = int(op.get("count", 1))
+                    if not 0 < count <= insert_limit():
+                        raise ValueError(f"op {n}: cannot insert {count} rows.")
+                    values = [[]] * count
+                if not isinstance(values, list) or not all(isinstance(values_row, list) for values_row in values):
+                    raise ValueError(f"op {n}: values must be a list of rows.")
+                inserted += len(values)
+                if inserted > insert_limit():
+                    raise ValueError(f"op {n}: a patch may insert at most {insert_limit()} rows.")
+                if not 0 <= row <= row_count:
+                    raise ValueError(f"op {n}: cannot insert at row {row}.")
+                rows = []
+                for values_row in values:
+                    cells = [_cell(v) for v in values_row[:width]]
+                    rows.append(cells + [""] * (width - len(cells)))
+                row_count += len(rows)
+                cleaned.append({"op": "insert", "row": row, "values": rows})
+
+            elif kind == "delete":
+                row = int(op["row"])
+                count = int(op.get("count", 1))
+                if not 0 <= row < row_count or count < 1:
+                    raise ValueError(f"op {n}: cannot delete at row {row}.")
+                count = min(count, row_count - row)
+                row_count -= count
+                cleaned.append({"op": "delete", "row": row, "count": count})
+
+            else:
+                raise ValueError(f"op {n}: unknown op {kind!r}.")
+        except (KeyError, TypeError):
+            raise ValueError(f"op {n} is malformed.")
+    return cleaned
+
+
+# Feed the cells a patch writes (set values and inserted rows) into their
+# columns' sketches; `header` is the sheet header after the patch
+def feed_sketches(dataset, header, ops):
+    written = {}
+    for op in ops:
+        if op["op"] == "set":
+            written.setdefault(header[op["col"]], []).append(op["value"])
+        elif op["op"] == "insert":
+            for row in op["values"]:
+                for col, cell in enumerate(row):
+                    written.setdefault(header[col], []).append(cell)
+
+    columns = [
+        col for col in Dataset_Columns.objects.filter(dataset=dataset, column_name__in=written).only("column_name", "sketch")
+        if col.sketch
+    ]
+    for col in columns:
+        sketch = sketches.ColumnSketch.load(col.sketch)
+        sketch.update(written[col.column_name])
+        col.sketch = sketch.dump()
+    Dataset_Columns.objects.bulk_update(columns, ["sketch"])
+
+
+# Copy a dataset on a pooled file (see uploads.py) to a file of its own
+# before it is edited, so the pooled file keeps the content it is named after
+# for the other datasets sharing it and for later uploads of the same bytes.
+# Pooled files never change, so the copy is made before the patch takes its
+# row lock. Returns the copy's name, or None for a dataset with its own file.
+def detach(dataset):
+    name = dataset.file_path.name
+    if not uploads.is_pooled(name):
+        return None
+    return uploads.copy_file(dataset.file_path.storage, name, uploads.edited_name(name, dataset.pk))
+
+
+# Apply one patch under a row lock on the dataset; returns (version, row_count).
+# The patch is journalled before its database writes, so a failure in any of
+# them cuts it back off the journal (and drops a pyramid it reached) before
+# the transaction rolls back. Compaction runs once the patch has committed.
+def apply_patch(dataset, ops, base_version=None):
+    pooled = dataset.file_path.name
+    copy = detach(dataset)
+    kept = False
+    try:
+        with transaction.atomic():
+            dataset = Datasets.objects.select_for_update().get(pk=dataset.pk)
+            if base_version is not None and base_version != dataset.data_version:
+                raise VersionConflict(dataset.data_version)
+            job = jobs.latest_job(dataset)
+            if not jobs.store_ready(job):
+                raise IngestPending(job.status)
+
+            update_fields = ["data_version", "row_count"]
+            if uploads.is_pooled(dataset.file_path.name):
+                if dataset.file_path.name != pooled:
+                    # The dataset was moved to other content after the copy was made
+                    if copy:
+                        uploads.remove_file(dataset.file_path.storage, copy)
+                    pooled, copy = dataset.file_path.name, detach(dataset)
+                dataset.file_path.name = copy
+                update_fields.append("file_path")
+
+            csv_path = dataset.file_path.path
+            store = datastore.open_store(csv_path)
+            old_header = list(store.header)
+            cleaned = clean_ops(ops, store.row_count, len(old_header))
+
+            # Dataset_Columns names are unique per dataset
+            header = list(old_header)
+            renamed = {op["col"] for op in cleaned if op["op"] == "header"}
+            for op in cleaned:
+                if op["op"] == "header":
+                    header[op["col"]] = op["value"]
+            for col in renamed:
+                if header.count(header[col]) > 1:
+                    raise ValueError(f"Column name {header[col]!r} is already in use.")
+
+            version = dataset.data_version + 1
+            offset = datastore.append_journal(store.directory, version, cleaned)
+            store.close()
+            try:
+                store = datastore.ColumnStore(store.directory, store.manifest)
+
+                # Renamed headers keep their Dataset_Columns row (and axis selections)
+                for col in renamed:
+                    if old_header[col] != store.header[col]:
+                        Dataset_Columns.objects.filter(
+                            dataset=dataset, column_name=old_header[col]
+                        ).update(column_name=store.header[col])
+
+                dataset.data_version = version
+                dataset.row_count = store.row_count
+                feed_sketches(dataset, store.header, cleaned)
+                dataset.save(update_fields=update_fields)
+                pyramid.apply_ops(store, cleaned)
+            except Exception:
+                store.close()
+                datastore.truncate_journal(store.directory, offset)
+                raise
+
+            if store.journal_ops >= journal_limit():
+                transaction.on_commit(lambda: compact_dataset(dataset.pk))
+        kept = "file_path" in update_fields
+    finally:
+        if copy and not kept:
+            uploads.remove_file(dataset.file_path.storage, copy)
+    return version, store.row_count
+
+
+# Fold a dataset's journal back into its CSV once it has grown past
+# journal_limit(). Runs after the patch that crossed the limit commits,
+# under a row lock of its own so no patch appends meanwhile; a failure is
+# logged and leaves the journal for a later patch to try again.
+def compact_dataset(dataset_pk):
+    try:
+        with transaction.atomic():
+            dataset = Datasets.objects.select_for_update().get(pk=dataset_pk)
+            csv_path = dataset.file_path.path
+            store = datastore.open_store(csv_path)
+            if store.journal_ops < journal_limit():
+                store.close()
+                return
+            store.close()
+            store = datastore.compact_store(csv_path)
+            dataset.byte_size = store.manifest["byte_size"]
+            dataset.content_hash = store.sha256
+            pyramid.build_pyramid(store)
+            ingest.register_columns(dataset, store.columns, profiles.profile_store(store))
+            dataset.save(update_fields=["byte_size", "content_hash"])
+            store.close()
+    except Exception:
+        logger.warning("Failed to compact the journal of dataset %s", dataset_pk, exc_info=True)
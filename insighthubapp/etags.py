@@ -0,0 +1,114 @@
+import hashlib
+from functools import wraps
+from django.conf import settings
+from django.middleware.csrf import get_token
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+from . import jobs
+from .models import Dashboards, Datasets, Selected_Columns
+
+
+# Conditional GET for dashboard pages and chart data
+#
+# Everything these responses show comes from the dashboard row, its chart and
+# axis selections, and the dataset's content fingerprint and edit version.
+# dashboard_state() reads just those with indexed lookups and hashes them
+# into a strong ETag, so a visitor whose copy is still current gets a 304
+# before the view opens the column store. Responses are marked private,
+# no-cache: browsers keep them but revalidate on every visit.
+#
+# Last-Modified is sent for information only. Likes, comments and spreadsheet
+# patches change a page without moving any timestamp, so If-Modified-Since
+# on its own never earns a 304; the ETag decides.
+#
+# Pages with forms (forms=True) carry the visitor's CSRF token, which a login
+# rotates, so their ETag also covers the CSRF secret and the session: a page
+# revalidated after logging out and back in is rendered again with a token
+# the next POST will accept. Anonymous visitors see no forms and skip this.
+
+# Bump (ETAG_VERSION setting) when the markup or JSON of these responses
+# changes, so copies rendered by the old code are not revalidated
+DEFAULT_ETAG_VERSION = "1"
+
+DASHBOARD_FIELDS = (
+    "updated_at", "status", "like_count", "comment_count", "chart_id",
+    "chart__updated_at", "chart__chart_type_id",
+)
+DATASET_FIELDS = ("id", "name", "file_path", "content_hash", "data_version", "row_count")
+
+
+# (ETag, last modified) for the dashboard `pk`, or None when there is no such
+# dashboard. The editor (owner=True) reads the owner's dataset for the
+# dashboard; public views read the chart's dataset. Pages that differ per
+# visitor (per_user=True) also key on the user, which costs the session and
+# user lookups that anonymous chart data would otherwise skip. Pages with
+# forms (forms=True) key on the signed-in visitor's CSRF secret and session.
+def dashboard_state(request, pk, owner=False, per_user=False, forms=False):
+    dashboards = Dashboards.objects.filter(pk=pk)
+    fields = DASHBOARD_FIELDS
+    if owner:
+        dashboards = dashboards.filter(user=request.user)
+    else:
+        fields += tuple(f"chart__dataset__{name}" for name in DATASET_FIELDS)
+    row = dashboards.values(*fields).first()
+    if row is None:
+        return None
+
+    dataset = None
+    if owner:
+        # The editor also shows the state of the dataset's latest ingest job
+        dataset = (
+            Datasets.objects.filter(user=request.user, dashboard_id=pk)
+            .annotate(ingest_status=jobs.latest_status())
+            .values(*DATASET_FIELDS, "ingest_status")
+            .first()
+        )
+    selections = []
+    if row["chart_id"]:
+        selections = sorted(
+            Selected_Columns.objects.filter(chart_id=row["chart_id"]).values_list("axis_type", "column__column_name")
+        )
+
+    visitor = None
+    if forms and request.user.is_authenticated:
+        visitor = (csrf_secret(request), request.session.session_key)
+
+    state = (
+        getattr(settings, "ETAG_VERSION", DEFAULT_ETAG_VERSION), request.user.pk if owner or per_user else None,
+        sorted(row.items()), sorted(dataset.items()) if dataset else None, selections, visitor,
+    )
+    etag = quote_etag(hashlib.sha256(repr(state).encode()).hexdigest())
+    last_modified = max(t for t in (row["updated_at"], row["chart__updated_at"]) if t)
+    return etag, last_modified
+
+
+# The CSRF secret behind the (masked) tokens rendered into this response;
+# get_token() makes one if the visitor has none yet
+def csrf_secret(request):
+    get_token(request)
+    return request.META.get("CSRF_COOKIE")
+
+
+# Decorator for a view taking the dashboard pk: answers GET/HEAD with 304 when
+# If-None-Match matches dashboard_state(), and tags fresh responses with it
+def dashboard_condition(owner=False, per_user=False, forms=False):
+    def decorator(view):
+        @wraps(view)
+        def inner(request, pk, *args, **kwargs):
+            if request.method not in ("GET", "HEAD"):
+                return view(request, pk, *args, **kwargs)
+            state = dashboard_state(request, pk, owner, per_user, forms)
+            if state is None:
+                return view(request, pk, *args, **kwargs)
+
+            etag, last_modified = state
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                response = view(request, pk, *args, **kwargs)
+            if response.status_code in (200, 304):
+                response.headers.setdefault("ETag", etag)
+                response.headers.setdefault("Last-Modified", http_date(last_modified.timestamp()))
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return inner
+    return decorator
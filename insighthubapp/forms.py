@@ -95,8 +95,8 @@ class DatasetForm(forms.ModelForm):
     def save(self, commit=True):
         instance = super().save(commit=False)
         if self.cleaned_data.get('file_path') is False:
-            if instance.file_path:
-                instance.file_path.delete(save=False)
+            # The upload is released once the save commits (signals.py); it
+            # may be shared with other datasets, so it is not deleted here
             instance.file_path = None
         if self.user:
             instance.user = self.user
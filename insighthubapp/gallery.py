@@ -0,0 +1,75 @@
+import base64, binascii, json
+from datetime import datetime
+from django.conf import settings
+from django.db.models import Q
+
+
+# Public gallery pages
+#
+# Pages are cut with a keyset ("seek") cursor rather than OFFSET: the cursor
+# carries the sort key and id of the last card shown, and the next page asks
+# for the rows that sort after it. The database starts from that point in the
+# (status, sort key, id) index and reads one page of rows, so page 1,000 costs
+# the same as page 1. The id breaks ties between equal sort keys.
+
+SORTS = {"recent": "create_at", "popular": "like_count"}
+DEFAULT_SORT = "recent"
+DEFAULT_PAGE_SIZE = 24
+
+
+def page_size():
+    return getattr(settings, "GALLERY_PAGE_SIZE", DEFAULT_PAGE_SIZE)
+
+
+# Opaque cursor pointing just past `dashboard` in the given sort
+def encode_cursor(dashboard, sort):
+    value = getattr(dashboard, SORTS[sort])
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort, value, dashboard.pk]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+# (sort key, id) from a cursor made by encode_cursor() for the same sort;
+# anything else (a forged cursor included) raises ValueError
+def decode_cursor(cursor, sort):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        cursor_sort, value, pk = json.loads(raw)
+        if cursor_sort != sort:
+            raise ValueError
+        if sort == "recent":
+            value = datetime.fromisoformat(value)
+        elif not _is_int(value):
+            raise ValueError
+        if not _is_int(pk):
+            raise ValueError
+        return value, pk
+    except (ValueError, TypeError, binascii.Error, UnicodeDecodeError):
+        raise ValueError("Invalid cursor.")
+
+
+# `queryset` in gallery order (newest / most liked first), from just after `cursor`
+def seek(queryset, sort=DEFAULT_SORT, cursor=None):
+    if sort not in SORTS:
+        raise ValueError(f"Unknown sort {sort!r}.")
+    field = SORTS[sort]
+
+    queryset = queryset.order_by(f"-{field}", "-id")
+    if cursor:
+        value, pk = decode_cursor(cursor, sort)
+        queryset = queryset.filter(Q(**{f"{field}__lt": value}) | Q(**{field: value, "id__lt": pk}))
+    return queryset
+
+
+# One page of `queryset` after `cursor`; returns (dashboards, cursor for the
+# next page or None on the last page)
+def page(queryset, sort=DEFAULT_SORT, cursor=None, size=None):
+    size = size or page_size()
+    rows = list(seek(queryset, sort, cursor)[:size + 1])
+    next_cursor = encode_cursor(rows[size - 1], sort) if len(rows) > size else None
+    return rows[:size], next_cursor
@@ -0,0 +1,178 @@
+import array, math, re
+from datetime import datetime, timezone
+
+
+# Column type inference
+#
+# Columns are classified a whole batch at a time while the store is written.
+# Every value-bearing type ("int", "float", "bool", "datetime") starts as a
+# candidate; a batch either encodes entirely to float64 under a candidate or
+# the candidate is dropped. What survives the last batch decides the type, with
+# "category" / "string" as the fallbacks for text.
+
+VALUE_KINDS = ("int", "float", "bool", "datetime")
+TYPE_ORDER = ("bool", "int", "float", "datetime")
+CATEGORY_MAX_DISTINCT = 50
+_UNDETECTED = object()
+
+INT_RE = re.compile(r"[+-]?\d+")
+BOOL_VALUES = {"true": 1.0, "false": 0.0, "yes": 1.0, "no": 0.0}
+DATETIME_FORMATS = (
+    "%d/%m/%Y", "%m/%d/%Y", "%Y/%m/%d", "%d-%m-%Y",
+    "%d/%m/%Y %H:%M", "%m/%d/%Y %H:%M", "%Y/%m/%d %H:%M:%S",
+)
+
+
+def _timestamp(value):
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+def _encode_float(cells):
+    return array.array("d", map(float, cells))
+
+
+def _encode_bool(cells):
+    return array.array("d", (BOOL_VALUES[c.strip().lower()] for c in cells))
+
+
+def _encode_datetime(cells, fmt):
+    if fmt is None:
+        return array.array("d", (_timestamp(datetime.fromisoformat(c.strip())) for c in cells))
+    return array.array("d", (_timestamp(datetime.strptime(c.strip(), fmt)) for c in cells))
+
+
+# (format, encoded values) for the one format (None meaning ISO 8601) that
+# every sample cell parses under, or (False, None) when none does. Formats
+# that read the sample as different dates (01/02/2024 is a day first and a
+# month first date) are ambiguous, so neither is chosen.
+def _detect_datetime_format(sample):
+    found = None
+    for fmt in (None,) + DATETIME_FORMATS:
+        try:
+            values = _encode_datetime(sample, fmt)
+        except ValueError:
+            continue
+        if found is None:
+            found = (fmt, values)
+        elif values != found[1]:
+            return False, None
+    return found or (False, None)
+
+
+# Fill encoded non-blank values back into a full-length batch, NaN for blanks
+def _spread(encoded, blanks, size):
+    if not blanks:
+        return encoded
+    values = array.array("d", [float("nan")]) * size
+    it = iter(encoded)
+    blank_set = set(blanks)
+    for i in range(size):
+        if i not in blank_set:
+            values[i] = next(it)
+    return values
+
+
+class ColumnTypeInferrer:
+    def __init__(self):
+        self.alive = set(VALUE_KINDS)
+        self.datetime_format = _UNDETECTED
+        self.non_null = 0
+        self.distinct = set()
+        self.distinct_overflow = False
+
+    # Classify one batch; returns {"number"|"bool"|"datetime": float64 array}
+    # for every value encoding that is still possible after this batch
+    def update(self, cells):
+        blanks = [i for i, c in enumerate(cells) if not c.strip()]
+        present = [c for c in cells if c.strip()] if blanks else cells
+        self.non_null += len(present)
+
+        if not self.distinct_overflow:
+            self.distinct.update(present)
+            if len(self.distinct) > CATEGORY_MAX_DISTINCT:
+                self.distinct_overflow = True
+                self.distinct = set()
+
+        encoded = {}
+        if not present:
+            for family in self._families():
+                encoded[family] = _spread(array.array("d"), blanks, len(cells))
+            return encoded
+
+        if "int" in self.alive and not all(map(INT_RE.fullmatch, present)):
+            self.alive.discard("int")
+
+        if "float" in self.alive or "int" in self.alive:
+            try:
+                encoded["number"] = _encode_float(present)
+            except ValueError:
+                self.alive -= {"int", "float"}
+
+        if "bool" in self.alive:
+            try:
+                encoded["bool"] = _encode_bool(present)
+            except KeyError:
+                self.alive.discard("bool")
+
+        if "datetime" in self.alive:
+            values = None
+            if self.datetime_format is _UNDETECTED:
+                # The first batch with values settles the format
+                self.datetime_format, values = _detect_datetime_format(present)
+            try:
+                if self.datetime_format is False:
+                    raise ValueError
+                encoded["datetime"] = values if values is not None else _encode_datetime(present, self.datetime_format)
+            except ValueError:
+                self.alive.discard("datetime")
+
+        return {family: _spread(values, blanks, len(cells)) for family, values in encoded.items()}
+
+    def _families(self):
+        families = set()
+        if self.alive & {"int", "float"}:
+            families.add("number")
+        if "bool" in self.alive:
+            families.add("bool")
+        if "datetime" in self.alive:
+            families.add("datetime")
+        return families
+
+    # Final type of the column once every batch has been seen
+    def result(self):
+        if not self.non_null:
+            return "string"
+        for kind in TYPE_ORDER:
+            if kind in self.alive:
+                return kind
+        if not self.distinct_overflow and len(self.distinct) * 2 <= self.non_null:
+            return "category"
+        return "string"
+
+
+# float64 for a single cell of a typed column (NaN when it no longer fits)
+def encode_value(kind, cell, datetime_format=None):
+    cell = cell.strip()
+    if not cell:
+        return math.nan
+    try:
+        if kind in ("int", "float"):
+            return float(cell)
+        if kind == "bool":
+            return BOOL_VALUES[cell.lower()]
+        if kind == "datetime":
+            return _encode_datetime([cell], datetime_format)[0]
+    except (KeyError, ValueError):
+        pass
+    return math.nan
+
+
+# Which encoded family holds the float64 values for a final type
+def value_family(kind):
+    if kind in ("int", "float"):
+        return "number"
+    if kind in ("bool", "datetime"):
+        return kind
+    return None
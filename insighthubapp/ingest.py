@@ -0,0 +1,136 @@
+import hashlib
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db import transaction
+from django.db.models import F
+from . import datastore, profiles, pyramid, signals, uploads
+from .models import Dataset_Columns, Datasets
+
+
+PROFILE_FIELDS = ["null_count", "distinct_count", "min_value", "max_value", "histogram", "sketch"]
+
+
+# Upload handler that spools the CSV to a temporary file, hashing it on the
+# way, and parses only as far as its header row. The header and sha256 are
+# left on the file as `csv_header` and `sha256` (the storage names the file
+# by the latter, see uploads.py). The rest of the parse is the ingest job's
+# (see jobs.py), so an upload request costs about as much as writing the
+# file to disk, or nothing when the same content was uploaded before.
+class CsvIngestUploadHandler(TemporaryFileUploadHandler):
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.parser = datastore.CsvStreamParser()
+        self.header = None
+        self.digest = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.digest.update(raw_data)
+        if self.header is None:
+            rows = self.parser.feed(raw_data)
+            if rows:
+                self.header = rows[0]
+                self.parser = None
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if self.header is None:
+            rows = self.parser.close()
+            self.header = rows[0] if rows else []
+        file.csv_header = self.header
+        file.sha256 = self.digest.hexdigest()
+        return file
+
+
+# Bring Dataset_Columns in line with the store's columns and inferred types:
+# one bulk insert for new columns, one bulk update for changed types and one
+# delete for columns that disappeared. With `profiles` ({name: profile}, see
+# profiles.py) every column's profile is written too.
+def register_columns(dataset, columns, profiles=None):
+    types = {}
+    for column in columns:
+        types.setdefault(column["name"], column["kind"])
+
+    existing = {}
+    for col in Dataset_Columns.objects.filter(dataset=dataset).defer("sketch"):
+        existing.setdefault(col.column_name, col)
+
+    changed = []
+    for name, col in existing.items():
+        if name not in types:
+            continue
+        if profiles is not None:
+            col.data_type = types[name]
+            for field, value in profiles.get(name, {}).items():
+                setattr(col, field, value)
+            changed.append(col)
+        elif col.data_type != types[name]:
+            col.data_type = types[name]
+            changed.append(col)
+
+    Dataset_Columns.objects.filter(dataset=dataset).exclude(column_name__in=types).delete()
+    fields = ["data_type"] + (PROFILE_FIELDS if profiles is not None else [])
+    Dataset_Columns.objects.bulk_update(changed, fields)
+    Dataset_Columns.objects.bulk_create([
+        Dataset_Columns(column_name=name, data_type=kind, dataset=dataset, **(profiles or {}).get(name, {}))
+        for name, kind in types.items()
+        if name not in existing
+    ])
+
+
+# Register a header before its column types are known: new names come in as
+# "string" until the ingest job infers them, names already known keep theirs
+def register_header(dataset, header):
+    known = dict(Dataset_Columns.objects.filter(dataset=dataset).values_list("column_name", "data_type"))
+    register_columns(dataset, [{"name": name, "kind": known.get(name, "string")} for name in header])
+
+
+# Column profiles of another dataset already ingested from the same pooled
+# file, or None. Pooled files never change, so its columns are this one's.
+def shared_profiles(dataset, store):
+    if not uploads.is_pooled(dataset.file_path.name):
+        return None
+    twin = Datasets.objects.filter(
+        file_path=dataset.file_path.name, content_hash=store.sha256
+    ).exclude(pk=dataset.pk).order_by("-id").first()
+    if twin is None:
+        return None
+    column_profiles = {
+        row.pop("column_name"): row
+        for row in Dataset_Columns.objects.filter(dataset=twin).values("column_name", *PROFILE_FIELDS)
+    }
+    if set(column_profiles) != set(store.header):
+        return None
+    return column_profiles
+
+
+# Build the dataset's columnar store, zoom pyramid and column profiles, record
+# its size/row count/fingerprint and register its columns in a single
+# transaction. A file shared with a dataset ingested before reuses its store,
+# pyramid and profiles.
+def ingest_dataset(dataset, rebuild=False):
+    csv_path = dataset.file_path.path
+    if rebuild:
+        store = datastore.build_store(csv_path)
+    else:
+        store = datastore.open_store(csv_path)
+
+    column_profiles = shared_profiles(dataset, store)
+    if column_profiles is None:
+        pyramid.build_pyramid(store)
+        column_profiles = profiles.profile_store(store)
+
+    dataset.row_count = store.row_count
+    dataset.byte_size = store.manifest["byte_size"]
+    dataset.content_hash = store.sha256
+    with transaction.atomic():
+        # data_version moves with F(): the row loaded when the job was
+        # claimed may be behind it by now
+        Datasets.objects.filter(pk=dataset.pk).update(
+            row_count=dataset.row_count, byte_size=dataset.byte_size, content_hash=dataset.content_hash,
+            data_version=F("data_version") + 1,
+        )
+        dataset.refresh_from_db(fields=["data_version"])
+        register_columns(dataset, store.columns, column_profiles)
+        # update() sends no post_save for signals.py to see
+        signals.invalidate_on_commit(dataset.dashboard_id)
+    return store
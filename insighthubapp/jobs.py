@@ -0,0 +1,187 @@
+import logging, threading
+from contextlib import contextmanager
+from datetime import timedelta
+from django.conf import settings
+from django.db import connections
+from django.db.models import F, OuterRef, Q, Subquery
+from django.utils import timezone
+from . import datastore, ingest, uploads
+from .models import Ingest_Jobs
+
+
+logger = logging.getLogger(__name__)
+
+
+# Background ingest
+#
+# An upload request only writes the CSV to disk and registers its header
+# columns. The rest of ingest (the parse into the columnar store, type
+# inference, per-column null counts, the zoom pyramid the chart views read)
+# is queued as an Ingest_Jobs row and done by `manage.py ingest_worker`.
+# Workers claim a job with a conditional UPDATE (queued -> running), so any
+# number of them can share the table, on MySQL or SQLite, without two taking
+# the same job. The dashboard page polls dashboard_ingest until it is done.
+# While a job runs, its worker stamps heartbeat_at every few seconds; a job
+# whose heartbeat stops is put back in the queue, however long it has run.
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+DEFAULT_HEARTBEAT_INTERVAL = 30    # seconds between a running job's heartbeats
+DEFAULT_JOB_TIMEOUT = 5 * 60    # seconds without a heartbeat before a running job counts as abandoned
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+def heartbeat_interval():
+    return getattr(settings, "INGEST_HEARTBEAT_INTERVAL", DEFAULT_HEARTBEAT_INTERVAL)
+
+
+def job_timeout():
+    return getattr(settings, "INGEST_JOB_TIMEOUT", DEFAULT_JOB_TIMEOUT)
+
+
+def max_attempts():
+    return getattr(settings, "INGEST_MAX_ATTEMPTS", DEFAULT_MAX_ATTEMPTS)
+
+
+# Queue an ingest of the dataset's file. A job still waiting for the dataset
+# already covers it, so that one is returned instead.
+def enqueue_ingest(dataset, rebuild=False):
+    waiting = Ingest_Jobs.objects.filter(dataset=dataset, status=QUEUED).order_by("-id").first()
+    if waiting is None:
+        return Ingest_Jobs.objects.create(dataset=dataset, rebuild=rebuild)
+    if rebuild and not waiting.rebuild:
+        Ingest_Jobs.objects.filter(pk=waiting.pk).update(rebuild=True)
+        waiting.rebuild = True
+    return waiting
+
+
+# Register the header of a CSV just written for the dataset and queue the rest
+# of its ingest; returns the header. `upload` is the UploadedFile when the CSV
+# came through CsvIngestUploadHandler, which has read the header already.
+# Pooled files (uploads.py) never change, so their store is only built when
+# it is missing; another upload of the same content reuses it.
+def enqueue_upload(dataset, upload=None):
+    header = getattr(upload, "csv_header", None)
+    if header is None:
+        header = datastore.read_header(dataset.file_path.path)
+    ingest.register_header(dataset, header)
+    enqueue_ingest(dataset, rebuild=not uploads.is_pooled(dataset.file_path.name))
+    return header
+
+
+# The dataset's most recent job, or None
+def latest_job(dataset):
+    if dataset is None:
+        return None
+    return Ingest_Jobs.objects.filter(dataset=dataset).order_by("-id").first()
+
+
+def is_pending(job):
+    return job is not None and job.status in (QUEUED, RUNNING)
+
+
+# Status of the latest job of the dataset at `dataset_ref`, as an annotation,
+# so views read it with the dataset (or dashboard) row instead of calling
+# latest_job()
+def latest_status(dataset_ref="pk"):
+    return Subquery(Ingest_Jobs.objects.filter(dataset=OuterRef(dataset_ref)).order_by("-id").values("status")[:1])
+
+
+# Whether the dataset's store can be read: its last job is done, or it was
+# ingested before there were jobs. Readers check this before store_for(),
+# which would otherwise build a missing store on the request thread while
+# the worker builds the same one.
+def store_ready(job):
+    return job is None or status_ready(job.status)
+
+
+def status_ready(status):
+    return status is None or status == DONE
+
+
+# JSON-ready status of a job for the dashboard page
+def describe(job):
+    return {
+        "id": job.id,
+        "status": job.status,
+        "error": job.error,
+        "created_at": job.created_at.isoformat(),
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+# Take the oldest queued job for this worker, or None when there is none
+def claim_next():
+    for pk in Ingest_Jobs.objects.filter(status=QUEUED).order_by("id").values_list("pk", flat=True)[:10]:
+        now = timezone.now()
+        claimed = Ingest_Jobs.objects.filter(pk=pk, status=QUEUED).update(
+            status=RUNNING, started_at=now, heartbeat_at=now, attempts=F("attempts") + 1
+        )
+        if claimed:
+            return Ingest_Jobs.objects.select_related("dataset").get(pk=pk)
+    return None
+
+
+# The job row as long as it is still this worker's run of it: running, and
+# not requeued and claimed again since (which moves attempts on)
+def _owned(job):
+    return Ingest_Jobs.objects.filter(pk=job.pk, status=RUNNING, attempts=job.attempts)
+
+
+# Stamp the job's heartbeat; returns False once the job is no longer ours
+def beat(job):
+    return bool(_owned(job).update(heartbeat_at=timezone.now()))
+
+
+# Beat for the job from a background thread for as long as the block runs
+@contextmanager
+def heartbeat(job):
+    stop = threading.Event()
+
+    def run():
+        try:
+            while not stop.wait(heartbeat_interval()) and beat(job):
+                pass
+        finally:
+            connections.close_all()
+
+    thread = threading.Thread(target=run, name=f"ingest-heartbeat-{job.pk}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+
+
+# Run a claimed job. A job that raises is failed with the error and not
+# retried: a CSV that cannot be parsed will not parse the second time either.
+# The result is only written while the job is still this worker's; one that
+# was requeued meanwhile belongs to whichever worker claimed it next.
+def run_job(job):
+    with heartbeat(job):
+        try:
+            if job.dataset.file_path:
+                ingest.ingest_dataset(job.dataset, rebuild=job.rebuild)
+            status, error = DONE, ""
+        except Exception as e:
+            logger.exception("Ingest job %s for dataset %s failed", job.pk, job.dataset_id)
+            status, error = FAILED, str(e) or e.__class__.__name__
+    if not _owned(job).update(status=status, error=error, finished_at=timezone.now()):
+        logger.warning("Ingest job %s was requeued while running; its result is dropped", job.pk)
+    job.status, job.error = status, error
+    return job
+
+
+# Put jobs whose worker died (no heartbeat for job_timeout() seconds) back in
+# the queue, or fail them once they have been tried max_attempts() times;
+# returns how many were requeued
+def requeue_abandoned():
+    cutoff = timezone.now() - timedelta(seconds=job_timeout())
+    stale = Ingest_Jobs.objects.filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff), status=RUNNING
+    )
+    stale.filter(attempts__gte=max_attempts()).update(
+        status=FAILED, error="The ingest worker stopped while running this job.", finished_at=timezone.now()
+    )
+    return stale.filter(attempts__lt=max_attempts()).update(status=QUEUED)
+
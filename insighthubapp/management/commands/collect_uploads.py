@@ -0,0 +1,35 @@
+import time
+from django.core.management.base import BaseCommand
+from insighthubapp import uploads
+from insighthubapp.models import Datasets
+
+
+# Delete uploaded files (and columnar stores) no dataset references any more
+class Command(BaseCommand):
+    help = "Delete uploaded CSVs no dataset references, orphaned column stores and interrupted builds."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Report what would be deleted without deleting it.")
+        parser.add_argument("--rate", type=float, default=10.0, help="Most deletions per second (0 for no limit).")
+        parser.add_argument("--batch", type=int, default=500, help="File names checked against the database per query.")
+
+    def handle(self, *args, **options):
+        storage = uploads.upload_storage
+        directory = Datasets._meta.get_field("file_path").upload_to
+        pause = 1 / options["rate"] if options["rate"] > 0 else 0
+        count = freed = 0
+
+        for kind, name, size in uploads.unreferenced(storage, directory, batch=options["batch"]):
+            if options["dry_run"]:
+                self.stdout.write(f"Would delete {kind} {name} ({size} bytes)")
+                count, freed = count + 1, freed + size
+                continue
+            removed = uploads.remove_unreferenced(storage, kind, name)
+            if removed is not None:
+                self.stdout.write(f"Deleted {kind} {name} ({removed} bytes)")
+                count, freed = count + 1, freed + removed
+            if pause:
+                time.sleep(pause)
+
+        verb = "would be deleted" if options["dry_run"] else "deleted"
+        self.stdout.write(self.style.SUCCESS(f"{count} path(s) {verb}, {freed} bytes."))
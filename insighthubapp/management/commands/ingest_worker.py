@@ -0,0 +1,37 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from insighthubapp import jobs
+
+
+# Run queued dataset ingest jobs (see insighthubapp/jobs.py)
+class Command(BaseCommand):
+    help = "Run queued dataset ingest jobs, polling for new ones until stopped."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Run the jobs queued now, then exit.")
+        parser.add_argument("--poll", type=float, default=1.0, help="Seconds between checks of an empty queue.")
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                close_old_connections()
+                requeued = jobs.requeue_abandoned()
+                if requeued:
+                    self.stdout.write(f"Requeued {requeued} abandoned job(s).")
+
+                job = jobs.claim_next()
+                if job is None:
+                    if options["once"]:
+                        break
+                    time.sleep(options["poll"])
+                    continue
+
+                jobs.run_job(job)
+                message = f"Job {job.pk} (dataset {job.dataset_id}): {job.status}"
+                if job.status == jobs.DONE:
+                    self.stdout.write(self.style.SUCCESS(message))
+                else:
+                    self.stdout.write(self.style.ERROR(f"{message}: {job.error}"))
+        except KeyboardInterrupt:
+            pass
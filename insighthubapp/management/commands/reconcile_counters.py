@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from insighthubapp.social import reconcile_counters
+
+
+# Repair Dashboards.like_count / comment_count that drifted from their rows
+class Command(BaseCommand):
+    help = "Recount likes and comments for dashboards whose stored counters have drifted."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Report drifted counters without fixing them.")
+
+    def handle(self, *args, **options):
+        fixed = reconcile_counters(dry_run=options["dry_run"])
+        for pk, likes, actual_likes, comments, actual_comments in fixed:
+            self.stdout.write(
+                f"Dashboard {pk}: likes {likes} -> {actual_likes}, comments {comments} -> {actual_comments}"
+            )
+        verb = "would be fixed" if options["dry_run"] else "fixed"
+        self.stdout.write(self.style.SUCCESS(f"{len(fixed)} dashboard(s) {verb}."))
@@ -0,0 +1,65 @@
+import logging, time
+from collections import Counter
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+
+# Every SQL statement a request runs: how many, how long in total, and how
+# many were exact repeats (same SQL and parameters) of an earlier one
+class QueryLog:
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    # connection.execute_wrapper() hook
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.count += 1
+            self.statements[(sql, repr(params))] += 1
+
+    @property
+    def duplicates(self):
+        return sum(n - 1 for n in self.statements.values() if n > 1)
+
+    @property
+    def duration_ms(self):
+        return round(self.duration * 1000, 2)
+
+
+# Count the queries behind each request. The log is left on request.query_log;
+# with QUERY_DEBUG_HEADERS on it is also sent back as X-DB-Queries,
+# X-DB-Time-Ms and X-DB-Duplicate-Queries, and requests over QUERY_BUDGET are
+# logged as warnings.
+class QueryBudgetMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        log = QueryLog()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(log))
+            response = self.get_response(request)
+        request.query_log = log
+
+        if getattr(settings, "QUERY_DEBUG_HEADERS", settings.DEBUG):
+            response["X-DB-Queries"] = log.count
+            response["X-DB-Time-Ms"] = log.duration_ms
+            response["X-DB-Duplicate-Queries"] = log.duplicates
+
+        budget = getattr(settings, "QUERY_BUDGET", None)
+        if budget is not None and log.count > budget:
+            logger.warning(
+                "%s %s ran %d queries (%d duplicate, %.1f ms), over the budget of %d",
+                request.method, request.path, log.count, log.duplicates, log.duration_ms, budget,
+            )
+        return response
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insighthubapp', '0016_remove_charts_description_remove_charts_name_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasets',
+            name='byte_size',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='datasets',
+            name='content_hash',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddField(
+            model_name='datasets',
+            name='row_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AlterField(
+            model_name='datasets',
+            name='file_path',
+            field=models.FileField(blank=True, null=True, upload_to='uploads/'),
+        ),
+    ]
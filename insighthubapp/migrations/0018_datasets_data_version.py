@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insighthubapp', '0017_datasets_ingest_profile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasets',
+            name='data_version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
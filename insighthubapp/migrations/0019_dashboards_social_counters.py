@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:37
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    Dashboards = apps.get_model('insighthubapp', 'Dashboards')
+    Social_Like = apps.get_model('insighthubapp', 'Social_Like')
+    Social_Comment = apps.get_model('insighthubapp', 'Social_Comment')
+
+    def count_of(model):
+        counts = model.objects.filter(dashboard=OuterRef('pk')).values('dashboard').annotate(n=Count('id')).values('n')
+        return Coalesce(Subquery(counts), 0)
+
+    Dashboards.objects.update(like_count=count_of(Social_Like), comment_count=count_of(Social_Comment))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insighthubapp', '0018_datasets_data_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dashboards',
+            name='comment_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dashboards',
+            name='like_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insighthubapp', '0019_dashboards_social_counters'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dashboards',
+            index=models.Index(fields=['status', '-create_at', '-id'], name='dashboards_gallery_recent'),
+        ),
+        migrations.AddIndex(
+            model_name='dashboards',
+            index=models.Index(fields=['status', '-like_count', '-id'], name='dashboards_gallery_popular'),
+        ),
+    ]
@@ -0,0 +1,71 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:41
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Min, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+# Rows that would break the new unique constraints: (kept id, [duplicate ids])
+def _duplicates(queryset, fields, keep):
+    groups = queryset.values(*fields).annotate(n=Count('id'), kept=keep('id')).filter(n__gt=1)
+    for group in groups:
+        if any(group[f] is None for f in fields):
+            continue    # NULLs never collide
+        ids = queryset.filter(**{f: group[f] for f in fields}).exclude(id=group['kept']).values_list('id', flat=True)
+        yield group['kept'], list(ids)
+
+
+def dedupe(apps, schema_editor):
+    Dashboards = apps.get_model('insighthubapp', 'Dashboards')
+    Dataset_Columns = apps.get_model('insighthubapp', 'Dataset_Columns')
+    Selected_Columns = apps.get_model('insighthubapp', 'Selected_Columns')
+    Social_Like = apps.get_model('insighthubapp', 'Social_Like')
+
+    # Repeated likes: keep the first, then recount the affected dashboards
+    liked = set()
+    for kept, ids in _duplicates(Social_Like.objects.all(), ['dashboard', 'user'], Min):
+        liked.add(Social_Like.objects.get(id=kept).dashboard_id)
+        Social_Like.objects.filter(id__in=ids).delete()
+    if liked:
+        likes = Social_Like.objects.filter(dashboard=OuterRef('pk')).values('dashboard').annotate(n=Count('id')).values('n')
+        Dashboards.objects.filter(pk__in=liked).update(like_count=Coalesce(Subquery(likes), 0))
+
+    # Repeated column names: point selections at the first row, drop the rest
+    for kept, ids in _duplicates(Dataset_Columns.objects.all(), ['dataset', 'column_name'], Min):
+        Selected_Columns.objects.filter(column_id__in=ids).update(column_id=kept)
+        Dataset_Columns.objects.filter(id__in=ids).delete()
+
+    # Chart-less rows left by saving the axis form, and repeated axes (the
+    # latest selection wins)
+    Selected_Columns.objects.filter(chart__isnull=True).delete()
+    for kept, ids in _duplicates(Selected_Columns.objects.all(), ['chart', 'axis_type'], Max):
+        Selected_Columns.objects.filter(id__in=ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insighthubapp', '0020_dashboards_gallery_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='datasets',
+            index=models.Index(fields=['user', 'dashboard'], name='datasets_user_dashboard'),
+        ),
+        migrations.AddConstraint(
+            model_name='dataset_columns',
+            constraint=models.UniqueConstraint(fields=('dataset', 'column_name'), name='dataset_columns_unique_name'),
+        ),
+        migrations.AddConstraint(
+            model_name='selected_columns',
+            constraint=models.UniqueConstraint(fields=('chart', 'axis_type'), name='selected_columns_unique_axis'),
+        ),
+        migrations.AddConstraint(
+            model_name='social_like',
+            constraint=models.UniqueConstraint(fields=('dashboard', 'user'), name='social_like_unique_user'),
+        ),
+    ]
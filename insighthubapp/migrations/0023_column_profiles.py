@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insighthubapp', '0022_ingest_jobs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset_columns',
+            name='distinct_count',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='dataset_columns',
+            name='histogram',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='dataset_columns',
+            name='max_value',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='dataset_columns',
+            name='min_value',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='dataset_columns',
+            name='null_count',
+            field=models.PositiveBigIntegerField(default=0),
+        ),
+    ]
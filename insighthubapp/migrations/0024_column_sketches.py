@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insighthubapp', '0023_column_profiles'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dataset_columns',
+            name='sketch',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
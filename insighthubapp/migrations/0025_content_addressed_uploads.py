@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:06
+
+import insighthubapp.uploads
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insighthubapp', '0024_column_sketches'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='datasets',
+            name='file_path',
+            field=models.FileField(blank=True, db_index=True, null=True, storage=insighthubapp.uploads.ContentAddressedStorage(), upload_to='uploads/'),
+        ),
+    ]
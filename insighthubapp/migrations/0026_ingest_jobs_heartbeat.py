@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('insighthubapp', '0025_content_addressed_uploads'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingest_jobs',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
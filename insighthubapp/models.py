@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from .uploads import upload_storage
 
 
 # User's Role
@@ -32,20 +33,78 @@ class Chart_Types(models.Model):
 # Datasets
 class Datasets(models.Model):
     name = models.CharField(max_length=255)
-    file_path = models.FileField(upload_to="uploads/", blank=True, null=True)
+    file_path = models.FileField(upload_to="uploads/", storage=upload_storage, blank=True, null=True, db_index=True)    # see uploads.py
     create_at = models.DateTimeField(auto_now_add=True)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     dashboard = models.ForeignKey("Dashboards", on_delete=models.CASCADE, null=True)
+    row_count = models.PositiveIntegerField(default=0)
+    byte_size = models.PositiveBigIntegerField(default=0)
+    content_hash = models.CharField(max_length=64, blank=True, default="")
+    data_version = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["user", "dashboard"], name="datasets_user_dashboard"),
+        ]
+
+    # Remember the stored file name, so signals.py can release a replaced upload
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        loaded = dict(zip(field_names, (value for value in values if value is not models.DEFERRED)))
+        instance._loaded_file_path = loaded.get("file_path")
+        return instance
 
     def __str__(self):
         return f"{self.id}"
 
 
+# Ingest job: the parse, type inference and store build for an uploaded
+# dataset, done by the ingest worker (see jobs.py)
+class Ingest_Jobs(models.Model):
+    STATUS_CHOICES = (
+        ("queued", "Queued"),
+        ("running", "Running"),
+        ("done", "Done"),
+        ("failed", "Failed"),
+    )
+    dataset = models.ForeignKey("Datasets", on_delete=models.CASCADE)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default="queued")
+    rebuild = models.BooleanField(default=False)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)  # stamped by the worker while running
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Workers take the oldest queued job
+            models.Index(fields=["status", "id"], name="ingest_jobs_queue"),
+        ]
+
+    def __str__(self):
+        return f"{self.id} ({self.status})"
+
+
 # Dataset Columns
 class Dataset_Columns(models.Model):
     column_name = models.CharField(max_length=255)
     data_type = models.CharField(max_length=255)
     dataset = models.ForeignKey("Datasets", on_delete=models.CASCADE, null=True)
+    # Column profile computed at ingest (see profiles.py)
+    null_count = models.PositiveBigIntegerField(default=0)
+    distinct_count = models.PositiveBigIntegerField(default=0)
+    min_value = models.FloatField(null=True, blank=True)
+    max_value = models.FloatField(null=True, blank=True)
+    histogram = models.JSONField(default=list, blank=True)
+    sketch = models.JSONField(default=dict, blank=True)    # sketches.ColumnSketch.dump()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["dataset", "column_name"], name="dataset_columns_unique_name"),
+        ]
 
     def __str__(self):
         return f"{self.column_name} ({self.dataset})"
@@ -63,6 +122,12 @@ class Selected_Columns(models.Model):
     chart = models.ForeignKey("Charts", on_delete=models.CASCADE, null=True)
     column = models.ForeignKey("Dataset_Columns", on_delete=models.CASCADE, null=True)
 
+    class Meta:
+        constraints = [
+            # One column per axis, so axis saves can upsert
+            models.UniqueConstraint(fields=["chart", "axis_type"], name="selected_columns_unique_axis"),
+        ]
+
     def __str__(self):
         return f"{self.axis_type} → {self.column.column_name} (Chart ID: {self.chart_id})"
         
@@ -76,6 +141,15 @@ class Dashboards(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     chart = models.ForeignKey("Charts", on_delete=models.SET_NULL, null=True)
+    like_count = models.PositiveIntegerField(default=0)  # kept in step with Social_Like
+    comment_count = models.PositiveIntegerField(default=0)  # kept in step with Social_Comment
+
+    class Meta:
+        indexes = [
+            # Keyset pages of the public gallery, newest / most liked first
+            models.Index(fields=["status", "-create_at", "-id"], name="dashboards_gallery_recent"),
+            models.Index(fields=["status", "-like_count", "-id"], name="dashboards_gallery_popular"),
+        ]
 
     def __str__(self):
         return f"{self.id}"
@@ -112,5 +186,11 @@ class Social_Like(models.Model):
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     dashboard = models.ForeignKey("Dashboards", on_delete=models.SET_NULL, null=True)
 
+    class Meta:
+        constraints = [
+            # One like per user per dashboard, so the like toggle can't double count
+            models.UniqueConstraint(fields=["dashboard", "user"], name="social_like_unique_user"),
+        ]
+
     def __str__(self):
         return self.comment
\ No newline at end of file
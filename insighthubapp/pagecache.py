@@ -0,0 +1,85 @@
+import uuid
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+
+# Public page cache
+#
+# Every anonymous visitor sees the same public dashboard page, and everyone
+# gets the same public chart data, so these responses are kept in the cache
+# framework (CACHES["default"]) and served again without touching the
+# database or the dataset. Gallery cards are kept the same way as template
+# fragments ({% cache %} in publicProjectCards.html).
+#
+# Entries are keyed on the dashboard's cache version, a random token that
+# signals.py replaces once a write to the dashboard, its chart, axes,
+# dataset, likes or comments commits. Entries under an old token are never
+# read again and expire after PUBLIC_PAGE_CACHE_TIMEOUT seconds.
+
+DEFAULT_TIMEOUT = 300
+
+
+def timeout():
+    return getattr(settings, "PUBLIC_PAGE_CACHE_TIMEOUT", DEFAULT_TIMEOUT)
+
+
+def _version_key(dashboard_id):
+    return f"dashboard-version:{dashboard_id}"
+
+
+# {dashboard id: cache version} in one cache round trip; dashboards seen for
+# the first time get a fresh version
+def dashboard_versions(dashboard_ids):
+    keys = {_version_key(pk): pk for pk in dashboard_ids}
+    versions = cache.get_many(keys)
+    missing = {key: uuid.uuid4().hex for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def dashboard_version(dashboard_id):
+    return dashboard_versions([dashboard_id])[dashboard_id]
+
+
+# Retire every cached page and card of a dashboard
+def invalidate_dashboard(dashboard_id):
+    cache.set(_version_key(dashboard_id), uuid.uuid4().hex, None)
+
+
+# Decorator for a public view taking the dashboard pk: GETs are answered from
+# the cache (a 304 when If-None-Match matches the cached ETag), and the first
+# one at each version renders and stores the response. Views whose response
+# differs per visitor (per_user=True) are only cached for anonymous visitors.
+# Responses that set cookies are never stored.
+def cache_public(per_user=False):
+    def decorator(view):
+        @wraps(view)
+        def inner(request, pk, *args, **kwargs):
+            if request.method != "GET" or (per_user and request.user.is_authenticated):
+                return view(request, pk, *args, **kwargs)
+
+            key = f"public-page:{pk}:{dashboard_version(pk)}:{request.get_full_path()}"
+            cached = cache.get(key)
+            if cached is None:
+                response = view(request, pk, *args, **kwargs)
+                if response.status_code == 200 and not response.cookies:
+                    headers = {name: response[name] for name in ("Content-Type", "ETag", "Last-Modified") if name in response}
+                    cache.set(key, (response.content, headers), timeout())
+                return response
+
+            content, headers = cached
+            response = get_conditional_response(request, etag=headers.get("ETag"))
+            if response is None:
+                response = HttpResponse(content, content_type=headers["Content-Type"])
+            for name in ("ETag", "Last-Modified"):
+                if name in headers:
+                    response[name] = headers[name]
+            patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return inner
+    return decorator
@@ -0,0 +1,323 @@
+import logging, math, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from django.conf import settings
+from django.db.models import Prefetch
+from . import datastore, downsample, jobs
+from .models import Datasets, Selected_Columns
+
+
+logger = logging.getLogger(__name__)
+
+
+# Gallery card previews
+#
+# A card only ever plots the x and y columns, so the preview carries just
+# those two series, sampled down to a fixed point budget. Page size then
+# depends on the number of cards, not on how big each dataset is.
+
+DEFAULT_PREVIEW_MAX_POINTS = 200
+DEFAULT_PREVIEW_CACHE_SIZE = 512
+DEFAULT_PREVIEW_WORKERS = 8
+DEFAULT_PREVIEW_DEADLINE = 2.0  # seconds
+
+
+def preview_point_budget():
+    return getattr(settings, "PREVIEW_MAX_POINTS", DEFAULT_PREVIEW_MAX_POINTS)
+
+
+def preview_deadline():
+    return getattr(settings, "PREVIEW_DEADLINE", DEFAULT_PREVIEW_DEADLINE)
+
+
+# In-process LRU of finished preview payloads. Keys carry the dataset content
+# hash and the chart's updated_at, so a rewritten file or a new axis/chart type
+# selection can never be served stale; invalidate() just frees the old entries.
+class PreviewCache:
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, dashboard_id):
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == dashboard_id]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+preview_cache = PreviewCache(getattr(settings, "PREVIEW_CACHE_SIZE", DEFAULT_PREVIEW_CACHE_SIZE))
+
+# Threads that read the column stores for uncached previews, shared by every
+# request so the number of files open at once stays bounded
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def preview_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=getattr(settings, "PREVIEW_WORKERS", DEFAULT_PREVIEW_WORKERS),
+                thread_name_prefix="preview",
+            )
+    return _pool
+
+
+# Drop cached previews after a dashboard's data, axes or chart type change
+def invalidate_preview(dashboard_id):
+    preview_cache.invalidate(dashboard_id)
+
+
+# The editor's chart payload `name` (its projected series or its aggregate)
+# for a dataset's store. It shares the preview cache, keyed on the store's
+# content hash, the dataset's data version and the chart's updated_at, so
+# build() reads the whole dataset only after the data, axes or chart type
+# change rather than on every page load.
+def editor_payload(dashboard, dataset, store, name, build):
+    chart = dashboard.chart
+    key = (dashboard.id, store.sha256, dataset.data_version, chart.updated_at if chart else None, name)
+    payload = preview_cache.get(key)
+    if payload is None:
+        payload = build()
+        preview_cache.set(key, payload)
+    return payload
+
+
+# Cache key for a dashboard, or None when its dataset has no fingerprint yet
+def preview_cache_key(dashboard, max_points):
+    chart = dashboard.chart
+    if not chart:
+        return (dashboard.id, "", 0, None, max_points)
+    dataset = chart.dataset
+    fingerprint = dataset.content_hash if dataset and dataset.file_path else ""
+    if dataset and dataset.file_path and not fingerprint:
+        return None
+    version = dataset.data_version if dataset else 0
+    return (dashboard.id, fingerprint, version, chart.updated_at, max_points)
+
+
+# Evenly spaced row positions, at most `budget` of them, first and last included
+def sample_positions(row_count, budget):
+    if row_count <= budget:
+        return range(row_count)
+    if budget < 2:
+        return range(min(budget, row_count))
+    return [i * (row_count - 1) // (budget - 1) for i in range(budget)]
+
+
+# Chart.js type for a chart row
+def chart_type_name(chart):
+    if chart and chart.chart_type and chart.chart_type.chart_type == "Line Chart":
+        return "line"
+    return "bar"
+
+
+# Dashboards with everything a preview reads loaded up front: the chart, its
+# dataset and chart type in one join (with the status of the dataset's latest
+# ingest job as `ingest_status`), and every chart's axis selections (with
+# their columns) in one more query, however many dashboards there are
+def with_preview_relations(queryset):
+    queryset = queryset.annotate(ingest_status=jobs.latest_status("chart__dataset"))
+    return queryset.select_related("chart", "chart__dataset", "chart__chart_type").prefetch_related(
+        Prefetch(
+            "chart__selected_columns_set",
+            queryset=Selected_Columns.objects.select_related("column").defer("column__sketch"),
+            to_attr="selections",
+        )
+    )
+
+
+# {axis_type: column_name} for a chart's selected columns
+def selected_axis(chart):
+    axis = {}
+    if chart:
+        selections = getattr(chart, "selections", None)
+        if selections is None:
+            selections = Selected_Columns.objects.filter(chart=chart).select_related("column").defer("column__sketch")
+        for sel in selections:
+            if sel.column:
+                axis[sel.axis_type] = sel.column.column_name
+    return axis
+
+
+# Resolve the x/y column names, falling back to the first two columns
+def axis_columns(header, axis):
+    x = axis.get("x") or header[0]
+    y = axis.get("y") or header[min(1, len(header) - 1)]
+    return x, y
+
+
+# JSON-safe number for a float64 or a cell that might hold one (None if not)
+def _number(value):
+    if isinstance(value, str):
+        try:
+            value = float(value)
+        except ValueError:
+            return None
+    return None if math.isnan(value) or math.isinf(value) else value
+
+
+# Labels from the x column and numbers from the y column at the given rows
+def read_series(store, x, y, positions):
+    labels = store.text_at(x, positions)
+    values = store.values(y)
+    if values is None:
+        numbers = [_number(cell) for cell in store.text_at(y, positions)]
+    else:
+        numbers = [_number(values[i]) for i in positions]
+    return labels, numbers
+
+
+# Downsampling mode for a chart: line charts keep their shape, bars are strided
+def series_mode(chart):
+    return downsample.DEFAULT_MODE if chart_type_name(chart) == "line" else None
+
+
+# x labels / y values of a dataset's axis columns, capped at max_points. With a
+# downsampling mode and a numeric y the rows are chosen by downsample(),
+# otherwise they are evenly spaced.
+def project_series(store, axis, max_points, mode=None):
+    if store is None or not store.header:
+        return {"labels": [], "values": []}
+
+    x, y = axis_columns(store.header, axis)
+    if x not in store.header or y not in store.header:
+        return {"labels": [], "values": []}
+
+    if mode and store.row_count > max_points and store.is_numeric(y):
+        positions = downsample.downsample(store.values(y), max_points, mode)
+    else:
+        positions = sample_positions(store.row_count, max_points)
+    labels, values = read_series(store, x, y, positions)
+    return {"x": x, "y": y, "labels": labels, "values": values, "rows": store.row_count}
+
+
+# (cache key, cached payload or None) for a dashboard's preview
+def _cached_preview(dashboard, max_points):
+    key = preview_cache_key(dashboard, max_points)
+    cached = preview_cache.get(key) if key is not None else None
+    return key, dict(cached) if cached is not None else None
+
+
+# Cache a freshly rendered preview. Only a key with the dataset fingerprint (or
+# one for a dashboard without data) may be used: a payload whose store had no
+# fingerprint could describe a file that has changed since.
+def _keep_preview(key, preview, fingerprint):
+    if key is not None and (fingerprint or not key[1]):
+        preview_cache.set(key, preview)
+
+
+# Cache a preview that finished after its request gave up on it, so the next
+# page load finds it ready
+def _keep_late_preview(key, future):
+    preview, fingerprint = future.result()
+    _keep_preview(key, preview, fingerprint)
+
+
+# Cache a preview rendered for this request (on the request thread, which may
+# also save the dataset's fingerprint) and return a copy of it
+def _store_preview(dashboard, max_points, key, preview, fingerprint):
+    if key is None and fingerprint:
+        # Datasets ingested before fingerprints existed get one on first view
+        dataset = dashboard.chart.dataset
+        dataset.content_hash = fingerprint
+        Datasets.objects.filter(pk=dataset.pk).update(content_hash=fingerprint)
+        key = preview_cache_key(dashboard, max_points)
+    _keep_preview(key, preview, fingerprint)
+    return dict(preview)
+
+
+# Card for a preview that missed the deadline; the page shows a placeholder
+def _pending_preview(dashboard):
+    chart = dashboard.chart
+    return {
+        "id": dashboard.id,
+        "type": chart_type_name(chart),
+        "axis": selected_axis(chart),
+        "labels": None,
+        "values": None,
+        "pending": True,
+    }
+
+
+# Previews for a list of dashboards (loaded with with_preview_relations), in
+# order. Cached previews are used as they are; the rest are read from their
+# stores on the preview pool at the same time, so a page waits for its slowest
+# file rather than the sum of them. Previews not done within `deadline`
+# seconds come back as placeholders ("pending": True) and are cached when
+# they finish.
+def build_previews(dashboards, max_points=None, deadline=None):
+    max_points = max_points or preview_point_budget()
+    deadline = preview_deadline() if deadline is None else deadline
+    results = {}
+    rendering = {}
+    for dashboard in dashboards:
+        key, cached = _cached_preview(dashboard, max_points)
+        if cached is not None:
+            results[dashboard.pk] = cached
+        else:
+            rendering[preview_pool().submit(_render_preview, dashboard, max_points)] = (dashboard, key)
+
+    if rendering:
+        done, late = wait(rendering, timeout=deadline)
+        for future in done:
+            dashboard, key = rendering[future]
+            results[dashboard.pk] = _store_preview(dashboard, max_points, key, *future.result())
+        for future in late:
+            dashboard, key = rendering[future]
+            results[dashboard.pk] = _pending_preview(dashboard)
+            future.add_done_callback(lambda future, key=key: _keep_late_preview(key, future))
+    return [results[dashboard.pk] for dashboard in dashboards]
+
+
+# Load a queryset of dashboards with their preview relations and build every
+# card's preview; returns (dashboards, previews) in a constant number of queries
+def load_previews(queryset, max_points=None, deadline=None):
+    dashboards = list(with_preview_relations(queryset))
+    return dashboards, build_previews(dashboards, max_points, deadline)
+
+
+# Build a preview from the store; returns (payload, content hash or None).
+# Runs on the preview pool: it reads the store and the dashboard's prefetched
+# relations, never the database. A dataset still with the ingest worker gets
+# the (uncached) placeholder.
+def _render_preview(dashboard, max_points):
+    chart = dashboard.chart
+    fingerprint = None
+    if not jobs.status_ready(getattr(dashboard, "ingest_status", None)):
+        return _pending_preview(dashboard), fingerprint
+    preview = {
+        "id": dashboard.id,
+        "type": chart_type_name(chart),
+        "axis": selected_axis(chart),
+        "labels": None,
+        "values": None,
+    }
+
+    if chart and chart.dataset and chart.dataset.file_path:
+        try:
+            store = datastore.store_for(chart.dataset)
+            preview.update(project_series(store, preview["axis"], max_points, series_mode(chart)))
+            fingerprint = store.sha256
+        except Exception:
+            logger.warning("Failed to read CSV for dashboard %s", dashboard.id, exc_info=True)
+    return preview, fingerprint
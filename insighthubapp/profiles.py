@@ -0,0 +1,87 @@
+import math
+from django.conf import settings
+from . import sketches
+
+
+# Column profiles
+#
+# Ingest summarises every column of a dataset once, so axis scaling, the axis
+# picker's hints and data-quality badges read a few numbers off
+# Dataset_Columns instead of scanning the data: the null (blank) count, the
+# distinct count and, for value columns (numbers, bools, and datetimes as
+# epoch seconds), the min, max and a histogram of HISTOGRAM_BINS equal-width
+# bins between them. Text columns have no min, max or histogram. The same
+# pass builds the column's sketches.
+
+DEFAULT_HISTOGRAM_BINS = 20
+DEFAULT_DISTINCT_LIMIT = 100_000    # distinct cells counted exactly before the HyperLogLog estimate takes over
+BLOCK_ROWS = 65536    # rows read per column per step
+
+
+def histogram_bins():
+    return getattr(settings, "PROFILE_HISTOGRAM_BINS", DEFAULT_HISTOGRAM_BINS)
+
+
+def distinct_limit():
+    return getattr(settings, "PROFILE_DISTINCT_LIMIT", DEFAULT_DISTINCT_LIMIT)
+
+
+# Profile of one store column, with the same keys as the Dataset_Columns
+# fields, including the column's sketches (see sketches.py)
+def profile_column(store, name):
+    column = store.columns[store.index(name)]
+    sketch = sketches.ColumnSketch(column["kind"], column.get("format"))
+    limit = distinct_limit()
+    nulls = 0
+    distinct = set()
+    low, high = math.inf, -math.inf
+    for start in range(0, store.row_count, BLOCK_ROWS):
+        stop = min(start + BLOCK_ROWS, store.row_count)
+        cells = store.text(name, start, stop)
+        values = store.values(name, start, stop)
+        sketch.update(cells, values)
+        for cell in cells:
+            if not cell.strip():
+                nulls += 1
+            elif len(distinct) <= limit:
+                distinct.add(cell)
+        if values is not None:
+            present = [v for v in values if math.isfinite(v)]
+            if present:
+                low, high = min(low, min(present)), max(high, max(present))
+
+    profile = {
+        "null_count": nulls,
+        # Exact while there are few enough to hold, estimated past that
+        "distinct_count": len(distinct) if len(distinct) <= limit else sketch.hll.estimate(),
+        "min_value": None,
+        "max_value": None,
+        "histogram": [],
+        "sketch": sketch.dump(),
+    }
+    if low <= high:
+        profile["min_value"], profile["max_value"] = low, high
+        profile["histogram"] = histogram(store, name, low, high)
+    return profile
+
+
+# Counts of a value column's cells in equal-width bins from low to high; the
+# top bin holds `high`, and a column of one value puts everything in the
+# first bin
+def histogram(store, name, low, high, bins=None):
+    bins = bins or histogram_bins()
+    counts = [0] * bins
+    span = high - low
+    scale = bins / span if span and not math.isinf(span) else 0
+    last = bins - 1
+    for start in range(0, store.row_count, BLOCK_ROWS):
+        for value in store.values(name, start, min(start + BLOCK_ROWS, store.row_count)):
+            if math.isfinite(value):
+                counts[min(int((value - low) * scale), last)] += 1
+    return counts
+
+
+# {column name: profile} for every column of the store
+def profile_store(store):
+    return {name: profile_column(store, name) for name in store.header}
+
@@ -0,0 +1,382 @@
+import array, json, math, mmap, os
+from django.conf import settings
+
+
+# Zoom pyramid
+#
+# For every numeric column the store directory also holds a stack of bucket
+# summaries at power-of-two resolutions:
+#   c<N>.L<k>.f8  (min, max, sum, count) float64 quadruples, one per 2**k rows
+# Level MIN_LEVEL is reduced from the raw values, every level above merges
+# pairs of the one below, up to a single bucket. pyramid.json records which
+# levels exist, whether a column is sorted (so x ranges can be looked up by
+# value) and the store state it describes.
+#
+# Readers never rebuild a pyramid for an edit. A spreadsheet patch brings it
+# up to date on the patch request (apply_ops): cell edits re-reduce just the
+# buckets holding the edited rows at every level, and row inserts or deletes
+# reduce level MIN_LEVEL again from the first row they move. Only a missing
+# pyramid, or one built from other file content, is built on first use.
+#
+# A range query picks the coarsest level that still gives one bucket per pixel
+# and reads only the buckets in range, so zooming costs O(width), not O(rows).
+# The first and last buckets are clipped to the range, summed from the
+# largest aligned buckets inside it. Ranges narrower than 2**MIN_LEVEL rows per
+# pixel are bucketed from the raw values, which is still at most
+# 2**MIN_LEVEL * width rows.
+
+PYRAMID_NAME = "pyramid.json"
+MIN_LEVEL = 4
+FIELDS = 4    # min, max, sum, count
+EMPTY = (math.inf, -math.inf, 0.0, 0.0)
+BLOCK_ROWS = 65536    # raw rows reduced per step (a multiple of 2**MIN_LEVEL)
+
+
+def _level_file(index, level):
+    return f"c{index}.L{level}.f8"
+
+
+def _stamp(store):
+    return {"sha256": store.sha256, "row_count": store.row_count, "journal_ops": store.journal_ops}
+
+
+# (min, max, sum, count) of a run of float64 values, NaNs skipped
+def _summary(values):
+    present = [v for v in values if v == v]
+    if not present:
+        return EMPTY
+    return (min(present), max(present), math.fsum(present), float(len(present)))
+
+
+def _combine(a, b):
+    return (min(a[0], b[0]), max(a[1], b[1]), a[2] + b[2], a[3] + b[3])
+
+
+# Level MIN_LEVEL buckets for a column from row `first` (a multiple of
+# 2**MIN_LEVEL) on, plus whether those rows are sorted without blanks and
+# start no lower than `previous`
+def _reduce_column(store, name, first=0, previous=-math.inf):
+    size = 1 << MIN_LEVEL
+    buckets = array.array("d")
+    ordered = True
+    for start in range(first, store.row_count, BLOCK_ROWS):
+        values = store.values(name, start, start + BLOCK_ROWS)
+        for offset in range(0, len(values), size):
+            chunk = values[offset:offset + size]
+            bucket = _summary(chunk)
+            if ordered:
+                if bucket[3] < len(chunk) or bucket[0] < previous or list(chunk) != sorted(chunk):
+                    ordered = False
+                previous = bucket[1]
+            buckets.extend(bucket)
+    return buckets, ordered
+
+
+# Next level up: each bucket merges a pair from the level below
+def _merge(buckets):
+    merged = array.array("d")
+    for i in range(0, len(buckets), FIELDS * 2):
+        a = buckets[i:i + FIELDS]
+        b = buckets[i + FIELDS:i + FIELDS * 2] or EMPTY
+        merged.extend(_combine(a, b))
+    return merged
+
+
+# Files are replaced, never written in place: readers may have the old one
+# mapped, and a dataset's edited copy shares unedited files by hard link
+def _write(path, buckets):
+    partial = f"{path}.partial"
+    with open(partial, "wb") as f:
+        buckets.tofile(f)
+    os.replace(partial, path)
+
+
+def _read(path):
+    buckets = array.array("d")
+    with open(path, "rb") as f:
+        buckets.frombytes(f.read())
+    return buckets
+
+
+# Write level MIN_LEVEL of a column and every level merged above it; returns
+# the top level
+def _write_levels(directory, index, buckets):
+    level = MIN_LEVEL
+    _write(os.path.join(directory, _level_file(index, level)), buckets)
+    while len(buckets) > FIELDS:
+        buckets = _merge(buckets)
+        level += 1
+        _write(os.path.join(directory, _level_file(index, level)), buckets)
+    return level
+
+
+def _read_meta(directory):
+    try:
+        with open(os.path.join(directory, PYRAMID_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_meta(directory, meta):
+    partial = os.path.join(directory, f"{PYRAMID_NAME}.partial")
+    with open(partial, "w") as f:
+        json.dump(meta, f)
+    os.replace(partial, os.path.join(directory, PYRAMID_NAME))
+
+
+# Whether `meta` was built from the store's file content (edits aside)
+def _matches(meta, store):
+    return bool(meta) and meta.get("min_level") == MIN_LEVEL and meta.get("sha256") == store.sha256
+
+
+# Build every numeric column's pyramid next to its store and return the metadata
+def build_pyramid(store):
+    meta = dict(_stamp(store), min_level=MIN_LEVEL, columns={})
+    for index, column in enumerate(store.columns):
+        name = store.header[index]
+        if not store.is_numeric(name):
+            continue
+        buckets, ordered = _reduce_column(store, name)
+        meta["columns"][str(index)] = {"top": _write_levels(store.directory, index, buckets), "sorted": ordered}
+    _write_meta(store.directory, meta)
+    return meta
+
+
+# Re-reduce the buckets holding `rows` of one column at every level
+def _update_rows(store, index, column, rows):
+    name = store.header[index]
+    dirty = sorted({row >> MIN_LEVEL for row in rows})
+    below = None
+    for level in range(MIN_LEVEL, column["top"] + 1):
+        path = os.path.join(store.directory, _level_file(index, level))
+        buckets = _read(path)
+        for b in dirty:
+            if below is None:
+                start = b << MIN_LEVEL
+                bucket = _summary(store.values(name, start, start + (1 << MIN_LEVEL)))
+            else:
+                bucket = _merge(below[b * 2 * FIELDS:(b + 1) * 2 * FIELDS])
+            buckets[b * FIELDS:(b + 1) * FIELDS] = array.array("d", bucket)
+        _write(path, buckets)
+        below = buckets
+        dirty = sorted({b >> 1 for b in dirty})
+
+    # An edited cell out of order with its neighbours unsorts the column
+    if column["sorted"]:
+        for row in rows:
+            window = list(store.values(name, max(row - 1, 0), row + 2))
+            if any(v != v for v in window) or window != sorted(window):
+                column["sorted"] = False
+                break
+
+
+# Reduce one column again from `row` on, keeping the buckets before it
+def _rebuild_from(store, index, column, row):
+    first = row >> MIN_LEVEL
+    buckets = _read(os.path.join(store.directory, _level_file(index, MIN_LEVEL)))[:first * FIELDS]
+    previous = buckets[-FIELDS + 1] if buckets else -math.inf
+    tail, ordered = _reduce_column(store, store.header[index], first << MIN_LEVEL, previous)
+    buckets.extend(tail)
+    column["top"] = _write_levels(store.directory, index, buckets)
+    column["sorted"] = ordered and (column["sorted"] or not first)
+
+
+# Bring the pyramid up to date with a patch (edits.clean_ops ops) just
+# appended to the store's journal; `store` is opened with the patch applied.
+# A pyramid that is missing or built from other content is left for
+# open_pyramid() to build, and so is one an update fails part way through.
+def apply_ops(store, ops):
+    meta = _read_meta(store.directory)
+    if not _matches(meta, store):
+        return None
+    if meta.get("journal_ops", 0) + len(ops) != store.journal_ops:
+        # An earlier patch never reached it
+        return build_pyramid(store)
+    rows = [op["row"] for op in ops if op["op"] != "header"]
+    try:
+        if rows:
+            moved = any(op["op"] in ("insert", "delete") for op in ops)
+            for index, column in meta["columns"].items():
+                index = int(index)
+                if moved:
+                    # Every row after the first one touched may have moved
+                    _rebuild_from(store, index, column, min(rows))
+                else:
+                    edited = [op["row"] for op in ops if op["op"] == "set" and op["col"] == index]
+                    if edited:
+                        _update_rows(store, index, column, edited)
+        meta.update(_stamp(store))
+        _write_meta(store.directory, meta)
+    except Exception:
+        remove_pyramid(store.directory)
+        raise
+    return meta
+
+
+# Delete a store's pyramid metadata, so the next open_pyramid() builds it again
+def remove_pyramid(directory):
+    try:
+        os.remove(os.path.join(directory, PYRAMID_NAME))
+    except FileNotFoundError:
+        pass
+
+
+# The store's pyramid, built first if it is missing or was built from other
+# content. One a patch has not caught up with yet (its journal_ops are
+# behind) is still read: cell edits leave its shape as it is, and a range
+# over rows it does not describe yet is bucketed from the raw values.
+def open_pyramid(store):
+    meta = _read_meta(store.directory)
+    if not _matches(meta, store):
+        meta = build_pyramid(store)
+    return Pyramid(store, meta)
+
+
+class Pyramid:
+    def __init__(self, store, meta):
+        self.store = store
+        self.meta = meta
+        self._maps = {}
+
+    def column(self, name):
+        return self.meta["columns"].get(str(self.store.index(name)))
+
+    # Whether the levels cover the store's rows as they are now
+    @property
+    def current(self):
+        return self.meta.get("row_count") == self.store.row_count
+
+    # Bucket quadruples of one level as a flat float64 view
+    def level(self, name, level):
+        filename = _level_file(self.store.index(name), level)
+        if filename not in self._maps:
+            path = os.path.join(self.store.directory, filename)
+            if os.path.getsize(path) == 0:
+                self._maps[filename] = memoryview(array.array("d"))
+            else:
+                with open(path, "rb") as f:
+                    self._maps[filename] = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)).cast("d")
+        return self._maps[filename]
+
+    # First row whose sorted x is >= value (> value when after=True)
+    def _bound(self, name, value, after=False):
+        buckets = self.level(name, MIN_LEVEL)
+        lo, hi = 0, len(buckets) // FIELDS
+        while lo < hi:
+            mid = (lo + hi) // 2
+            top = buckets[mid * FIELDS + 1]
+            if top > value or (not after and top == value):
+                hi = mid
+            else:
+                lo = mid + 1
+        start = lo << MIN_LEVEL
+        values = self.store.values(name, start, start + (1 << MIN_LEVEL))
+        for offset, v in enumerate(values):
+            if v > value or (not after and v == value):
+                return start + offset
+        return min(start + len(values), self.store.row_count)
+
+    # Row range [start, stop) for an x range: by value when x is numeric and
+    # sorted, by row position otherwise (or when by_row is set)
+    def row_range(self, x, x_from=None, x_to=None, by_row=False):
+        row_count = self.store.row_count
+        column = self.column(x) if x in self.store.header else None
+        if not by_row and column and column["sorted"] and self.current:
+            start = 0 if x_from is None else self._bound(x, x_from)
+            stop = row_count if x_to is None else self._bound(x, x_to, after=True)
+            return start, max(start, stop), "value"
+        start = 0 if x_from is None else min(max(int(x_from), 0), row_count)
+        stop = row_count if x_to is None else min(max(int(x_to) + 1, start), row_count)
+        return start, stop, "row"
+
+    # Buckets of y over rows [start, stop), at most `width` of them
+    def buckets(self, y, start, stop, width):
+        span = stop - start
+        rows_per_bucket = max(math.ceil(span / max(width, 1)), 1)
+        if rows_per_bucket < (1 << MIN_LEVEL) or not span or not self.current:
+            return self._raw_buckets(y, start, stop, rows_per_bucket)
+
+        column = self.column(y)
+        level = min(max(math.ceil(math.log2(rows_per_bucket)), MIN_LEVEL), column["top"])
+        while level < column["top"] and ((stop - 1) >> level) - (start >> level) + 1 > width:
+            level += 1
+        first, last = start >> level, ((stop - 1) >> level) + 1
+        data = self.level(y, level)[first * FIELDS:last * FIELDS]
+        buckets = [(b << level, data[i * FIELDS:(i + 1) * FIELDS]) for i, b in enumerate(range(first, last))]
+
+        # Clip the end buckets, which may reach outside the range
+        if buckets[0][0] < start:
+            buckets[0] = (start, self._span(y, start, min((first + 1) << level, stop)))
+        if (last << level) > stop and (last - 1) << level >= start:
+            row = buckets[-1][0]
+            buckets[-1] = (row, self._span(y, row, stop))
+        return level, buckets
+
+    # Summary of y over rows [start, stop) from the largest aligned buckets
+    # inside it, plus at most 2**MIN_LEVEL raw values at each end
+    def _span(self, y, start, stop):
+        size = 1 << MIN_LEVEL
+        top = self.column(y)["top"]
+        head = min(-(-start // size) * size, stop)
+        tail = max(stop // size * size, head)
+        result = _combine(_summary(self.store.values(y, start, head)), _summary(self.store.values(y, tail, stop)))
+        row = head
+        while row < tail:
+            level = MIN_LEVEL
+            while level < top and not row % (2 << level) and row + (2 << level) <= tail:
+                level += 1
+            b = row >> level
+            result = _combine(result, self.level(y, level)[b * FIELDS:(b + 1) * FIELDS])
+            row += 1 << level
+        return result
+
+    def _raw_buckets(self, y, start, stop, size):
+        values = self.store.values(y, start, stop)
+        return None, [
+            (start + offset, _summary(values[offset:offset + size]))
+            for offset in range(0, len(values), size)
+        ]
+
+    def close(self):
+        for view in self._maps.values():
+            view.release()
+        self._maps = {}
+
+
+def _finite(value):
+    return None if math.isnan(value) or math.isinf(value) else value
+
+
+# Zoomed series of y against x for the range [x_from, x_to] at `width` pixels:
+# per bucket the first row's x label and the min / max / mean / count of y
+def query_range(store, x, y, x_from=None, x_to=None, width=1000, by_row=False):
+    if y not in store.header or not store.is_numeric(y):
+        raise ValueError(f"Column {y!r} is not numeric.")
+    if x not in store.header:
+        raise ValueError(f"Unknown column {x!r}.")
+
+    pyramid = open_pyramid(store)
+    try:
+        start, stop, x_mode = pyramid.row_range(x, x_from, x_to, by_row)
+        level, buckets = pyramid.buckets(y, start, stop, width)
+        labels = store.text_at(x, [row for row, _ in buckets])
+        result = {
+            "x": x,
+            "y": y,
+            "x_mode": x_mode,
+            "from": start,
+            "to": stop,
+            "rows": store.row_count,
+            "level": level,
+            "bucket_rows": (1 << level) if level is not None else max(math.ceil((stop - start) / max(width, 1)), 1),
+            "labels": labels,
+            "start": [row for row, _ in buckets],
+            "min": [_finite(b[0]) for _, b in buckets],
+            "max": [_finite(b[1]) for _, b in buckets],
+            "mean": [b[2] / b[3] if b[3] else None for _, b in buckets],
+            "count": [int(b[3]) for _, b in buckets],
+        }
+    finally:
+        pyramid.close()
+    return result
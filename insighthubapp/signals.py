@@ -0,0 +1,66 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from . import pagecache, uploads
+from .models import Charts, Dashboards, Dataset_Columns, Datasets, Selected_Columns, Social_Comment
+
+
+# Public page cache invalidation (see pagecache.py). The version is replaced
+# after the write commits, so a page rendered from the old rows can only be
+# stored under the version being retired.
+
+def invalidate_on_commit(dashboard_id):
+    if dashboard_id:
+        transaction.on_commit(lambda: pagecache.invalidate_dashboard(dashboard_id))
+
+
+@receiver([post_save, post_delete], sender=Dashboards)
+def dashboard_changed(sender, instance, **kwargs):
+    invalidate_on_commit(instance.pk)
+
+
+# Likes are written by social.toggle_like, which retires the page itself
+@receiver([post_save, post_delete], sender=Charts)
+@receiver([post_save, post_delete], sender=Datasets)
+@receiver([post_save, post_delete], sender=Social_Comment)
+def dashboard_row_changed(sender, instance, **kwargs):
+    invalidate_on_commit(instance.dashboard_id)
+
+
+# Axis saves upsert with bulk_create, which sends no signals; the editor
+# bumps the chart's updated_at after them, which lands in dashboard_row_changed
+@receiver([post_save, post_delete], sender=Selected_Columns)
+def selection_changed(sender, instance, origin=None, **kwargs):
+    # Deletes cascading from a chart, dataset or column come with a chart or
+    # dataset write whose own signal covers them
+    if origin is not None and getattr(origin, "model", type(origin)) is not Selected_Columns:
+        return
+    for dashboard_id in Dashboards.objects.filter(chart_id=instance.chart_id).values_list("pk", flat=True):
+        invalidate_on_commit(dashboard_id)
+
+
+# Uploaded files are deleted once the transaction dropping their last
+# reference commits (see uploads.py); a rolled back delete or replacement
+# keeps them
+
+def release_on_commit(name):
+    if name:
+        transaction.on_commit(lambda: uploads.release(uploads.upload_storage, name))
+
+
+@receiver(post_save, sender=Datasets)
+def dataset_file_changed(sender, instance, **kwargs):
+    old = getattr(instance, "_loaded_file_path", None) or ""
+    new = instance.file_path.name if instance.file_path else ""
+    if old == new:
+        return
+    release_on_commit(old)
+    if not new:
+        # A cleared dataset keeps no columns (or the axis selections on them)
+        Dataset_Columns.objects.filter(dataset=instance).delete()
+    instance._loaded_file_path = new
+
+
+@receiver(post_delete, sender=Datasets)
+def dataset_deleted(sender, instance, **kwargs):
+    release_on_commit(instance.file_path.name if instance.file_path else "")
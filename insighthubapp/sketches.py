@@ -0,0 +1,263 @@
+import base64, hashlib, math, random
+from collections import Counter
+from django.conf import settings
+from .inference import encode_value, value_family
+
+
+# Column sketches
+#
+# Small, mergeable summaries of a column built in the ingest pass and kept on
+# its Dataset_Columns row, so approximate answers over huge datasets cost a
+# row read instead of a scan:
+#   HyperLogLog    distinct count (about 1.6% error at precision 12)
+#   KLL            quantiles of a value column (rank error about 1-2% at k=128)
+#   FrequentItems  heaviest cells (Misra-Gries; counts are lower bounds and
+#                  at most `error` below the true count)
+# Each can take more cells at any time and be merged with another built over
+# other rows, so a patch only feeds its new cells in. Cells a patch removes
+# or overwrites are not taken out; the next compaction rebuilds the sketches
+# from the data.
+
+DEFAULT_HLL_PRECISION = 12
+DEFAULT_KLL_K = 128
+DEFAULT_TOP_ITEMS = 100
+ITEM_MAX_CHARS = 200    # longer cells are counted by their first 200 characters
+
+
+def hll_precision():
+    return getattr(settings, "SKETCH_HLL_PRECISION", DEFAULT_HLL_PRECISION)
+
+
+def kll_k():
+    return getattr(settings, "SKETCH_KLL_K", DEFAULT_KLL_K)
+
+
+def top_items():
+    return getattr(settings, "SKETCH_TOP_ITEMS", DEFAULT_TOP_ITEMS)
+
+
+class HyperLogLog:
+    def __init__(self, precision=None, registers=None):
+        self.precision = precision or hll_precision()
+        self.registers = registers if registers is not None else bytearray(1 << self.precision)
+
+    def add(self, cell):
+        digest = hashlib.blake2b(cell.encode("utf-8"), digest_size=8).digest()
+        h = int.from_bytes(digest, "big")
+        width = 64 - self.precision
+        index = h >> width
+        rank = width - (h & ((1 << width) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLogs of different precision.")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def estimate(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)    # linear counting for small counts
+        return int(round(estimate))
+
+    def dump(self):
+        return {"p": self.precision, "registers": base64.b64encode(bytes(self.registers)).decode("ascii")}
+
+    @classmethod
+    def load(cls, data):
+        return cls(data["p"], bytearray(base64.b64decode(data["registers"])))
+
+
+# Levels of compactors; an item at level h stands for 2**h input values.
+# A full level is sorted and every other item (odd or even, at random) moves
+# up a level, with lower levels given less room than higher ones.
+class KLL:
+    def __init__(self, k=None, levels=None, n=0):
+        self.k = k or kll_k()
+        self.levels = levels or [[]]
+        self.n = n
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return int(math.ceil(self.k * (2 / 3) ** depth)) + 1
+
+    def _size(self):
+        return sum(len(items) for items in self.levels)
+
+    def _max_size(self):
+        return sum(self._capacity(h) for h in range(len(self.levels)))
+
+    def _compress(self):
+        while self._size() >= self._max_size():
+            for h, items in enumerate(self.levels):
+                if len(items) >= self._capacity(h):
+                    if h + 1 == len(self.levels):
+                        self.levels.append([])
+                    items.sort()
+                    odd = [items.pop()] if len(items) % 2 else []
+                    self.levels[h + 1].extend(items[random.getrandbits(1)::2])
+                    self.levels[h] = odd
+                    break
+
+    def update(self, values):
+        values = [v for v in values if math.isfinite(v)]
+        self.n += len(values)
+        self.levels[0].extend(values)
+        self._compress()
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append([])
+        for h, items in enumerate(other.levels):
+            self.levels[h].extend(items)
+        self.n += other.n
+        self._compress()
+
+    # Values at each of the ranks `qs` (0..1), or Nones when empty
+    def quantiles(self, qs):
+        weighted = sorted((v, 1 << h) for h, items in enumerate(self.levels) for v in items)
+        total = sum(weight for _, weight in weighted)
+        if not total:
+            return [None] * len(qs)
+        results = []
+        for q in qs:
+            target = q * total
+            seen = 0
+            for value, weight in weighted:
+                seen += weight
+                if seen >= target:
+                    break
+            results.append(value)
+        return results
+
+    def dump(self):
+        return {"k": self.k, "n": self.n, "levels": self.levels}
+
+    @classmethod
+    def load(cls, data):
+        return cls(data["k"], [list(items) for items in data["levels"]], data["n"])
+
+
+# Misra-Gries summary keeping at most `capacity` cells
+class FrequentItems:
+    def __init__(self, capacity=None, counts=None, error=0):
+        self.capacity = capacity or top_items()
+        self.counts = Counter(counts or {})
+        self.error = error
+
+    def update(self, counts):
+        self.counts.update(counts)
+        if len(self.counts) > self.capacity:
+            cut = sorted(self.counts.values(), reverse=True)[self.capacity]
+            self.counts = Counter({item: count - cut for item, count in self.counts.items() if count > cut})
+            self.error += cut
+
+    def merge(self, other):
+        self.error += other.error
+        self.update(other.counts)
+
+    # [(cell, count)] heaviest first
+    def top(self, k):
+        return self.counts.most_common(k)
+
+    def dump(self):
+        return {"capacity": self.capacity, "error": self.error, "counts": dict(self.counts)}
+
+    @classmethod
+    def load(cls, data):
+        return cls(data["capacity"], data["counts"], data["error"])
+
+
+# The sketches of one column: distinct and heavy cells for every column,
+# quantiles for value columns
+class ColumnSketch:
+    def __init__(self, kind, datetime_format=None, hll=None, kll=None, items=None):
+        self.kind = kind
+        self.datetime_format = datetime_format
+        self.hll = hll or HyperLogLog()
+        self.items = items or FrequentItems()
+        self.kll = kll
+        if self.kll is None and value_family(kind):
+            self.kll = KLL()
+
+    # Feed non-blank cells; `values` are their float64 encodings when the
+    # caller has them already
+    def update(self, cells, values=None):
+        counts = Counter(cell[:ITEM_MAX_CHARS] for cell in cells if cell.strip())
+        for cell in counts:
+            self.hll.add(cell)
+        self.items.update(counts)
+        if self.kll is not None:
+            if values is None:
+                values = [encode_value(self.kind, cell, self.datetime_format) for cell in cells]
+            self.kll.update(values)
+
+    def merge(self, other):
+        self.hll.merge(other.hll)
+        self.items.merge(other.items)
+        if self.kll is not None and other.kll is not None:
+            self.kll.merge(other.kll)
+
+    def dump(self):
+        data = {"kind": self.kind, "hll": self.hll.dump(), "items": self.items.dump()}
+        if self.datetime_format:
+            data["format"] = self.datetime_format
+        if self.kll is not None:
+            data["kll"] = self.kll.dump()
+        return data
+
+    @classmethod
+    def load(cls, data):
+        return cls(
+            data["kind"],
+            data.get("format"),
+            HyperLogLog.load(data["hll"]),
+            KLL.load(data["kll"]) if "kll" in data else None,
+            FrequentItems.load(data["items"]),
+        )
+
+
+# Approximate chart modes, answered from one column's sketches
+
+APPROX_MODES = ("percentiles", "topk")
+DEFAULT_QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+DEFAULT_TOP_K = 10
+
+
+# Values of a value column at the ranks in `q` (comma-separated, 0..1), for
+# percentile bands across the chart
+def chart_percentiles(sketch, name, q=None):
+    if sketch.kll is None:
+        raise ValueError(f"{name!r} is not a number, bool or datetime column.")
+    try:
+        qs = [float(v) for v in q.split(",")] if q else list(DEFAULT_QUANTILES)
+    except ValueError:
+        raise ValueError("q must be a comma-separated list of numbers.")
+    if not all(0 <= v <= 1 for v in qs):
+        raise ValueError("q values must be between 0 and 1.")
+    return {"mode": "percentiles", "y": name, "n": sketch.kll.n, "q": qs, "values": sketch.kll.quantiles(qs)}
+
+
+# The `k` most frequent cells of a column with their counts, shaped like a
+# chart_aggregate result so the editor draws it the same way; each count is
+# at most `error` below the true one
+def chart_top_k(sketch, name, k=None):
+    try:
+        k = int(k) if k else DEFAULT_TOP_K
+    except ValueError:
+        raise ValueError("k must be an integer.")
+    top = sketch.items.top(min(max(k, 1), sketch.items.capacity))
+    return {
+        "mode": "topk",
+        "agg": "count",
+        "y": name,
+        "keys": [name],
+        "labels": [cell for cell, _ in top],
+        "series": [name],
+        "data": [[count for _, count in top]],
+        "error": sketch.items.error,
+    }
@@ -0,0 +1,151 @@
+from django.conf import settings
+from django.db import connections, router, transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from . import pagecache
+from .models import Dashboards, Social_Comment, Social_Like
+
+
+# Social counters
+#
+# Dashboards.like_count and comment_count mirror the number of Social_Like /
+# Social_Comment rows pointing at each dashboard, so the gallery reads them as
+# plain columns instead of counting over joins. Every write that adds or
+# removes a like or comment moves the counter in the same transaction with a
+# relative UPDATE (count = count + n), which stays correct under concurrent
+# requests; reconcile_counters() repairs any drift left by writes made some other way.
+
+
+def _bump(dashboard_id, field, delta):
+    updates = Dashboards.objects.filter(pk=dashboard_id)
+    if delta < 0:
+        updates = updates.filter(**{f"{field}__gte": -delta})
+    updates.update(**{field: F(field) + delta})
+
+
+# Move a dashboard's like_count by the SQL expression `delta` (over `params`)
+# in one UPDATE that also hands back the new count: with RETURNING where the
+# database has it, and on MySQL through LAST_INSERT_ID(expr), whose value comes
+# back in the UPDATE's own reply. `floor` keeps a drifted counter from going
+# below zero. Returns None when no row was updated.
+def _move_like_count(dashboard_id, delta, params=(), floor=0):
+    connection = connections[router.db_for_write(Dashboards)]
+    table = connection.ops.quote_name(Dashboards._meta.db_table)
+    column = connection.ops.quote_name("like_count")
+    value = f"{column} {delta}"
+    where = f"WHERE {connection.ops.quote_name('id')} = %s AND {column} >= %s"
+    params = [*params, dashboard_id, floor]
+    with connection.cursor() as cursor:
+        if connection.vendor == "mysql":
+            cursor.execute(f"UPDATE {table} SET {column} = LAST_INSERT_ID({value}) {where}", params)
+            return cursor.lastrowid if cursor.rowcount else None
+        if connection.features.can_return_columns_from_insert:
+            cursor.execute(f"UPDATE {table} SET {column} = {value} {where} RETURNING {column}", params)
+            row = cursor.fetchone()
+            return row[0] if row else None
+        cursor.execute(f"UPDATE {table} SET {column} = {value} {where}", params)
+        if not cursor.rowcount:
+            return None
+    return Dashboards.objects.values_list("like_count", flat=True).get(pk=dashboard_id)
+
+
+# Like the dashboard (liked=True), take the like back (liked=False), or with
+# liked=None switch whichever way it is; returns (liked, like_count). There is
+# no lock and no read: a like is one INSERT the unique constraint turns into a
+# no-op when the user's like is already there, an unlike one DELETE, and the
+# counter moves in the one UPDATE that returns it. The INSERT cannot say
+# whether it added the row, so the UPDATE counts the like only if it carries
+# this request's created_at. A toggle without `liked` tries the DELETE first,
+# which makes switching a like on a third statement. Raises
+# Dashboards.DoesNotExist for an unknown dashboard.
+def toggle_like(dashboard_id, user, liked=None):
+    with transaction.atomic():
+        removed = 0
+        if not liked:
+            # A plain DELETE: Social_Like has no delete signals or cascades
+            removed, _ = Social_Like.objects.filter(user=user, dashboard_id=dashboard_id).delete()
+        if liked is None:
+            liked = not removed
+        if liked:
+            like = Social_Like(user=user, dashboard_id=dashboard_id)
+            Social_Like.objects.bulk_create([like], ignore_conflicts=True)
+            connection = connections[router.db_for_write(Social_Like)]
+            quote = connection.ops.quote_name
+            fields = [Social_Like._meta.get_field(name) for name in ("dashboard", "user", "created_at")]
+            added = "+ (SELECT COUNT(*) FROM %s WHERE %s)" % (
+                quote(Social_Like._meta.db_table),
+                " AND ".join(f"{quote(field.column)} = %s" for field in fields),
+            )
+            created = fields[2].get_db_prep_value(like.created_at, connection)
+            like_count = _move_like_count(dashboard_id, added, [dashboard_id, user.pk, created])
+        elif removed:
+            like_count = _move_like_count(dashboard_id, "- %s", [removed], floor=removed)
+            if like_count is None:
+                like_count = 0  # the counter had drifted below the likes; reconcile_counters() repairs it
+        else:
+            like_count = Dashboards.objects.values_list("like_count", flat=True).filter(pk=dashboard_id).first()
+        if like_count is None:
+            raise Dashboards.DoesNotExist("Dashboards matching query does not exist.")
+        # Sent here rather than from a Social_Like signal, which would turn
+        # the DELETE back into a SELECT and a DELETE per row
+        transaction.on_commit(lambda: pagecache.invalidate_dashboard(dashboard_id))
+    return liked, like_count
+
+
+# {dashboard id: liked?} for the user over a page of dashboards, in one query
+def liked_state(user, dashboard_ids):
+    liked = set(Social_Like.objects.filter(user=user, dashboard_id__in=dashboard_ids).values_list("dashboard_id", flat=True))
+    return {pk: pk in liked for pk in dashboard_ids}
+
+
+# Save a new comment (an unsaved Social_Comment) and count it
+def add_comment(comment):
+    with transaction.atomic():
+        comment.save()
+        _bump(comment.dashboard_id, "comment_count", 1)
+    return comment
+
+
+DEFAULT_COMMENT_PAGE_SIZE = 20
+
+
+def comment_page_size():
+    return getattr(settings, "COMMENT_PAGE_SIZE", DEFAULT_COMMENT_PAGE_SIZE)
+
+
+# One page of a dashboard's comments, newest first, older than the comment id
+# `before`; returns (comments, `before` for the next page or None on the last
+# page). Ids grow with created_at, so the page is a seek on the
+# (dashboard_id, id) index rather than an OFFSET.
+def comment_page(dashboard_id, before=None, size=None):
+    size = size or comment_page_size()
+    comments = Social_Comment.objects.filter(dashboard_id=dashboard_id).select_related("user").order_by("-id")
+    if before:
+        comments = comments.filter(id__lt=before)
+    rows = list(comments[:size + 1])
+    return rows[:size], rows[size - 1].pk if len(rows) > size else None
+
+
+def _count_of(model):
+    counts = model.objects.filter(dashboard=OuterRef("pk")).values("dashboard").annotate(n=Count("id")).values("n")
+    return Coalesce(Subquery(counts), 0)
+
+
+# Reset every counter that no longer matches its rows; returns the dashboards
+# that were off as (id, like_count, actual likes, comment_count, actual comments)
+def reconcile_counters(dry_run=False):
+    drifted = (
+        Dashboards.objects.annotate(actual_likes=_count_of(Social_Like), actual_comments=_count_of(Social_Comment))
+        .exclude(like_count=F("actual_likes"), comment_count=F("actual_comments"))
+        .order_by("pk")
+    )
+    fixed = [
+        (d.pk, d.like_count, d.actual_likes, d.comment_count, d.actual_comments)
+        for d in drifted
+    ]
+    if fixed and not dry_run:
+        # Recount inside the UPDATE so likes/comments added since the read still land
+        Dashboards.objects.filter(pk__in=[row[0] for row in fixed]).update(
+            like_count=_count_of(Social_Like), comment_count=_count_of(Social_Comment)
+        )
+    return fixed
@@ -1,3 +1,1219 @@
-from django.test import TestCase
+import base64, hashlib, io, json, math, os, random, re, shutil, tempfile, threading, time
+from datetime import timedelta
+from unittest import mock
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from . import aggregate, datastore, downsample, edits, gallery, inference, ingest, jobs, previews, profiles, pyramid, sketches, social, uploads, urls
+from .models import Chart_Types, Charts, Dashboards, Datasets, Dataset_Columns, Ingest_Jobs, Selected_Columns, Social_Comment, Social_Like
 
-# Create your tests here.
+
+MEDIA_ROOT = tempfile.mkdtemp(prefix="insighthub-tests-")
+CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+CSV = "month,sales,region\n" + "".join(f"m{i},{i * 1.5},{'NSEW'[i % 4]}\n" for i in range(100))
+
+
+# Create `count` public dashboards owned by `user`, each with an ingested CSV,
+# a chart, x/y/category selections, one like and two comments
+def seed_dashboards(user, count):
+    bar, _ = Chart_Types.objects.get_or_create(chart_type="Bar Chart")
+    line, _ = Chart_Types.objects.get_or_create(chart_type="Line Chart")
+    dashboards = []
+    for i in range(count):
+        dashboard = Dashboards.objects.create(user=user, name=f"Dashboard {i}", status=False)
+        dataset = Datasets(name="sales.csv", user=user, dashboard=dashboard)
+        dataset.file_path.save("sales.csv", ContentFile(CSV.encode()))
+        ingest.ingest_dataset(dataset)
+
+        chart = Charts.objects.create(dashboard=dashboard, dataset=dataset, chart_type=bar if i % 2 else line)
+        dashboard.chart = chart
+        dashboard.save()
+        columns = {c.column_name: c for c in Dataset_Columns.objects.filter(dataset=dataset)}
+        for axis_type, name in (("x", "month"), ("y", "sales"), ("category", "region"), ("series", "sales")):
+            Selected_Columns.objects.create(chart=chart, axis_type=axis_type, column=columns[name])
+
+        social.toggle_like(dashboard.pk, user)
+        social.add_comment(Social_Comment(user=user, dashboard=dashboard, comment="Nice"))
+        social.add_comment(Social_Comment(user=user, dashboard=dashboard, comment="Thanks"))
+        dashboards.append(dashboard)
+    return dashboards
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, CACHES=CACHES, QUERY_DEBUG_HEADERS=True)
+class QueryBudgetTests(TestCase):
+    # Most queries each URL may run (session and auth lookups included). The
+    # count must also stay the same however many dashboards exist.
+    BUDGETS = {
+        "index": 2,
+        "signup": 0,
+        "login": 0,
+        "logout": 4,
+        "projects": 4,
+        "create_dashboard": 3,
+        "dashboard": 13,
+        "dashboard_rows": 7,
+        "dashboard_ingest": 3,
+        "dashboard_columns": 8,
+        "dashboard_approx": 8,
+        "dashboard_aggregate": 8,
+        "dashboard_series": 8,
+        "dashboard_range": 8,
+        "dashboard_patch": 11,
+        "delete_dashboard": 8,
+        "publicProjects": 4,
+        "publicProjects_page": 4,
+        "publicProjects_likes": 3,
+        "publicDashboard": 8,
+        "publicDashboard_series": 4,
+        "publicDashboard_range": 4,
+        "publicDashboard_comments": 1,
+        "create_publicDashboard_comment": 7,
+        "create_publicDashboard_like": 6,
+    }
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create_user("alice", password="pw")
+        self.dashboards = seed_dashboards(self.user, 1)
+
+    # (method, path, body) for one request to the named URL
+    def request_for(self, name):
+        first = self.dashboards[0].pk
+        if name in ("index", "signup", "login", "logout", "projects", "publicProjects", "publicProjects_page"):
+            return "get", reverse(name), None
+        if name == "publicProjects_likes":
+            return "get", reverse(name) + "?ids=" + ",".join(str(d.pk) for d in self.dashboards), None
+        if name == "dashboard_ingest":
+            Ingest_Jobs.objects.create(dataset=self.dashboards[0].chart.dataset, status="done")
+        if name == "dashboard_approx":
+            return "get", reverse(name, args=[first]) + "?mode=topk", None
+        if name == "create_dashboard":
+            return "post", reverse(name), {}
+        if name == "dashboard_patch":
+            body = json.dumps({"ops": [{"op": "set", "row": 0, "col": 1, "value": "2"}]})
+            return "post", reverse(name, args=[first]), body
+        if name == "delete_dashboard":
+            doomed = Dashboards.objects.create(user=self.user, name="Doomed")
+            return "post", reverse(name, args=[doomed.pk]), {}
+        if name == "create_publicDashboard_comment":
+            return "post", reverse(name, args=[first]), {"comment": "Hello"}
+        if name == "create_publicDashboard_like":
+            unliked = Dashboards.objects.create(user=self.user, name="Unliked", status=False)
+            return "post", reverse(name, args=[unliked.pk]), json.dumps({"liked": True})
+        return "get", reverse(name, args=[first]), None
+
+    # Queries run by one request to the named URL, with cold caches
+    def count_queries(self, name):
+        method, path, body = self.request_for(name)
+        self.client.force_login(self.user)
+        previews.preview_cache.clear()
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            if method == "get":
+                response = self.client.get(path)
+            elif isinstance(body, str):
+                response = self.client.post(path, body, content_type="application/json")
+            else:
+                response = self.client.post(path, body)
+        self.assertLess(response.status_code, 400, f"{name} returned {response.status_code}")
+        return len(queries)
+
+    def test_every_url_has_a_budget(self):
+        names = {pattern.name for pattern in urls.urlpatterns}
+        self.assertEqual(names, set(self.BUDGETS))
+
+    def test_queries_stay_within_budget(self):
+        for name, budget in self.BUDGETS.items():
+            with self.subTest(url=name):
+                self.assertLessEqual(self.count_queries(name), budget)
+
+    def test_queries_do_not_grow_with_dashboards(self):
+        few = {name: self.count_queries(name) for name in self.BUDGETS}
+        self.dashboards += seed_dashboards(self.user, 10)
+        for name in self.BUDGETS:
+            with self.subTest(url=name):
+                self.assertEqual(self.count_queries(name), few[name])
+
+    def test_debug_headers(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("projects"))
+        self.assertEqual(int(response["X-DB-Queries"]), response.wsgi_request.query_log.count)
+        self.assertIn("X-DB-Time-Ms", response)
+        self.assertEqual(response["X-DB-Duplicate-Queries"], "0")
+
+    @override_settings(QUERY_BUDGET=1)
+    def test_over_budget_is_logged(self):
+        self.client.force_login(self.user)
+        with self.assertLogs("insighthubapp.middleware", level="WARNING") as logs:
+            self.client.get(reverse("projects"))
+        self.assertIn("over the budget of 1", logs.output[0])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, CACHES=CACHES)
+class CommentTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("carol", password="pw")
+        cls.dashboard = seed_dashboards(cls.user, 1)[0]
+
+    def test_pages_cover_every_comment_once(self):
+        for i in range(45):
+            social.add_comment(Social_Comment(user=self.user, dashboard=self.dashboard, comment=f"c{i}"))
+        url = reverse("publicDashboard_comments", args=[self.dashboard.pk])
+        seen, cursor = [], ""
+        while True:
+            data = self.client.get(url, {"cursor": cursor}).json()
+            seen += re.findall(r'<p class="mt-2">(\w+)</p>', data["html"])
+            cursor = data["next"]
+            if not cursor:
+                break
+        self.assertEqual(seen, [f"c{i}" for i in reversed(range(45))] + ["Thanks", "Nice"])
+
+    def test_bad_cursor_and_unknown_dashboard(self):
+        url = reverse("publicDashboard_comments", args=[self.dashboard.pk])
+        self.assertEqual(self.client.get(url, {"cursor": "x"}).status_code, 400)
+        self.assertEqual(self.client.get(reverse("publicDashboard_comments", args=[0])).status_code, 404)
+
+    def test_ajax_post_returns_the_new_comment(self):
+        self.client.force_login(self.user)
+        url = reverse("create_publicDashboard_comment", args=[self.dashboard.pk])
+        response = self.client.post(url, {"comment": "Hello"}, headers={"Accept": "application/json"})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Hello", response.json()["html"])
+        self.assertEqual(self.client.post(url, {"comment": "Hello"}).status_code, 302)
+        self.assertEqual(Dashboards.objects.get(pk=self.dashboard.pk).comment_count, 4)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, CACHES=CACHES)
+class LikeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("lena", password="pw")
+        cls.other = User.objects.create_user("mia", password="pw")
+        cls.dashboard = seed_dashboards(cls.user, 1)[0]
+
+    def test_toggle_keeps_the_count_in_step(self):
+        self.assertEqual(social.toggle_like(self.dashboard.pk, self.user), (False, 0))
+        self.assertEqual(social.toggle_like(self.dashboard.pk, self.other), (True, 1))
+        self.assertEqual(social.toggle_like(self.dashboard.pk, self.user), (True, 2))
+        self.assertEqual(social.toggle_like(self.dashboard.pk, self.other, liked=True), (True, 2))
+        self.assertEqual(social.toggle_like(self.dashboard.pk, self.user, liked=False), (False, 1))
+        self.assertEqual(Social_Like.objects.filter(dashboard=self.dashboard).count(), 1)
+        with self.assertRaises(Dashboards.DoesNotExist):
+            social.toggle_like(0, self.user, liked=True)
+
+    def test_setting_the_state_is_two_statements(self):
+        for liked in (True, False):
+            with self.subTest(liked=liked):
+                with CaptureQueriesContext(connection) as queries:
+                    social.toggle_like(self.dashboard.pk, self.other, liked=liked)
+                # (SAVEPOINT / RELEASE come from the test's own transaction)
+                statements = [q["sql"].split()[0].upper() for q in queries if "SAVEPOINT" not in q["sql"]]
+                self.assertEqual(statements, ["INSERT" if liked else "DELETE", "UPDATE"])
+
+    def test_like_retires_the_cached_page(self):
+        path = reverse("publicDashboard", args=[self.dashboard.pk])
+        cache.clear()
+        self.client.get(path)
+        self.client.force_login(self.other)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("create_publicDashboard_like", args=[self.dashboard.pk]),
+                json.dumps({"liked": True}), content_type="application/json",
+            )
+        self.assertEqual(response.json(), {"liked": True, "like_count": 2})
+        self.client.logout()
+        self.assertContains(self.client.get(path), '<span id="like-count" class="ms-1">2</span>')
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, CACHES=CACHES)
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("dave", password="pw")
+        cls.dashboard = seed_dashboards(cls.user, 1)[0]
+
+    def revalidate(self, path):
+        etag = self.client.get(path)["ETag"]
+        with mock.patch("insighthubapp.datastore.store_for", side_effect=AssertionError("store opened")):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(path, headers={"If-None-Match": etag})
+        return etag, response, len(queries)
+
+    def test_public_views_answer_304_without_reading_data(self):
+        for name in ("publicDashboard", "publicDashboard_series", "publicDashboard_range"):
+            with self.subTest(url=name):
+                etag, response, queries = self.revalidate(reverse(name, args=[self.dashboard.pk]))
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response["ETag"], etag)
+                self.assertLessEqual(queries, 2)
+
+    def test_editor_views_answer_304(self):
+        self.client.force_login(self.user)
+        for name in ("dashboard", "dashboard_rows", "dashboard_series"):
+            with self.subTest(url=name):
+                _, response, _ = self.revalidate(reverse(name, args=[self.dashboard.pk]))
+                self.assertEqual(response.status_code, 304)
+
+    def test_pages_with_forms_are_rendered_again_after_login(self):
+        for name in ("dashboard", "publicDashboard"):
+            with self.subTest(url=name):
+                path = reverse(name, args=[self.dashboard.pk])
+                self.client.force_login(self.user)
+                etag = self.client.get(path)["ETag"]
+                self.client.logout()
+                self.client.cookies.pop(settings.CSRF_COOKIE_NAME, None)
+                self.client.force_login(self.user)
+                response = self.client.get(path, headers={"If-None-Match": etag})
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, 'name="csrfmiddlewaretoken"')
+
+    def test_etag_follows_likes_edits_and_axes(self):
+        self.client.force_login(self.user)
+        public = reverse("publicDashboard", args=[self.dashboard.pk])
+        series = reverse("dashboard_series", args=[self.dashboard.pk])
+        etags = [self.client.get(public)["ETag"], self.client.get(series)["ETag"]]
+
+        social.toggle_like(self.dashboard.pk, self.user)
+        self.assertNotEqual(self.client.get(public)["ETag"], etags[0])
+
+        body = json.dumps({"ops": [{"op": "set", "row": 0, "col": 1, "value": "9"}]})
+        self.client.post(reverse("dashboard_patch", args=[self.dashboard.pk]), body, content_type="application/json")
+        self.assertNotEqual(self.client.get(series)["ETag"], etags[1])
+
+        etag = self.client.get(series)["ETag"]
+        Selected_Columns.objects.filter(chart=self.dashboard.chart, axis_type="x").update(
+            column=Dataset_Columns.objects.get(dataset=self.dashboard.chart.dataset, column_name="region")
+        )
+        self.assertNotEqual(self.client.get(series)["ETag"], etag)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, CACHES=CACHES)
+class PublicPageCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("erin", password="pw")
+        cls.dashboard = seed_dashboards(cls.user, 1)[0]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_anonymous_repeat_visit_is_served_from_cache(self):
+        path = reverse("publicDashboard", args=[self.dashboard.pk])
+        first = self.client.get(path)
+        with mock.patch("insighthubapp.datastore.store_for", side_effect=AssertionError("store opened")):
+            with CaptureQueriesContext(connection) as queries:
+                second = self.client.get(path)
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second["ETag"], first["ETag"])
+        self.assertNotIn(b'name="csrfmiddlewaretoken"', second.content)
+
+    def test_writes_retire_cached_pages_and_cards(self):
+        path = reverse("publicDashboard", args=[self.dashboard.pk])
+        self.client.get(path)
+        with self.captureOnCommitCallbacks(execute=True):
+            social.add_comment(Social_Comment(user=self.user, dashboard=self.dashboard, comment="Fresh"))
+        self.assertContains(self.client.get(path), "Fresh")
+
+        self.client.force_login(self.user)
+        self.client.get(reverse("publicProjects"))
+        with self.captureOnCommitCallbacks(execute=True):
+            dashboard = Dashboards.objects.get(pk=self.dashboard.pk)
+            dashboard.name = "Renamed"
+            dashboard.save()
+        self.assertContains(self.client.get(reverse("publicProjects")), "Renamed")
+
+    def test_signed_in_visitors_get_a_fresh_page(self):
+        path = reverse("publicDashboard", args=[self.dashboard.pk])
+        self.client.get(path)
+        self.client.force_login(self.user)
+        self.assertContains(self.client.get(path), 'name="csrfmiddlewaretoken"')
+
+    def test_private_dashboards_are_neither_served_nor_cached(self):
+        path = reverse("publicDashboard", args=[self.dashboard.pk])
+        self.assertEqual(self.client.get(path).status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            dashboard = Dashboards.objects.get(pk=self.dashboard.pk)
+            dashboard.status = True
+            dashboard.save()
+        self.assertEqual(self.client.get(path).status_code, 404)
+        self.assertEqual(self.client.get(path).status_code, 404)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(path).status_code, 404)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, CACHES=CACHES)
+class PreviewFanOutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("frank", password="pw")
+        seed_dashboards(cls.user, 4)
+
+    def setUp(self):
+        previews.preview_cache.clear()
+
+    # store_for() that takes `delay` seconds, as a slow disk would
+    def slow_store(self, delay, release=None):
+        store_for = previews.datastore.store_for
+        def slow(dataset):
+            if release is not None:
+                release.wait()
+            time.sleep(delay)
+            return store_for(dataset)
+        return mock.patch("insighthubapp.datastore.store_for", side_effect=slow)
+
+    def test_stores_are_read_in_parallel(self):
+        with self.slow_store(0.3):
+            start = time.perf_counter()
+            _, cards = previews.load_previews(Dashboards.objects.filter(user=self.user))
+            elapsed = time.perf_counter() - start
+        self.assertLess(elapsed, 0.9)
+        self.assertTrue(all(card["labels"] for card in cards))
+
+    def test_late_previews_become_placeholders_then_cache(self):
+        release = threading.Event()
+        with self.slow_store(0, release):
+            _, cards = previews.load_previews(Dashboards.objects.filter(user=self.user), deadline=0.05)
+            release.set()
+        self.assertTrue(all(card.get("pending") for card in cards))
+
+        for _ in range(50):
+            _, cards = previews.load_previews(Dashboards.objects.filter(user=self.user), deadline=0)
+            if not any(card.get("pending") for card in cards):
+                break
+            time.sleep(0.02)
+        self.assertTrue(all(card["labels"] for card in cards))
+
+    def test_editor_reads_its_chart_from_the_cache(self):
+        dashboard = Dashboards.objects.filter(user=self.user).first()
+        path = reverse("dashboard", args=[dashboard.pk])
+        self.client.force_login(self.user)
+        page = self.client.get(path)
+        with mock.patch("insighthubapp.previews.project_series", side_effect=AssertionError("series read")), \
+                mock.patch("insighthubapp.aggregate.chart_aggregate", side_effect=AssertionError("aggregate read")):
+            again = self.client.get(path)
+        self.assertEqual(again.context["chart_series"], page.context["chart_series"])
+        self.assertEqual(again.context["chart_groups"], page.context["chart_groups"])
+
+        body = json.dumps({"ops": [{"op": "set", "row": 0, "col": 1, "value": "9"}]})
+        self.client.post(reverse("dashboard_patch", args=[dashboard.pk]), body, content_type="application/json")
+        self.assertEqual(json.loads(self.client.get(path).context["chart_series"])["values"][0], 9)
+
+
+class ColumnStoreTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="insighthub-store-")
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+
+    def write_csv(self, content, name="data.csv"):
+        path = os.path.join(self.directory, name)
+        with open(path, "wb") as f:
+            f.write(content.encode("utf-8") if isinstance(content, str) else content)
+        return path
+
+    def test_parser_joins_records_split_across_chunks(self):
+        data = '\ufeffa,b,c\n1,"x\ny",\u00e9\r\n2\n3,4,5,6\n\n"q""",,\n'.encode("utf-8")
+        expected = [["a", "b", "c"], ["1", "x\ny", "\u00e9"], ["2"], ["3", "4", "5", "6"], ['q"', "", ""]]
+        for size in (1, 2, 3, len(data)):
+            with self.subTest(chunk=size):
+                parser = datastore.CsvStreamParser()
+                rows = []
+                for start in range(0, len(data), size):
+                    rows += parser.feed(data[start:start + size])
+                self.assertEqual(rows + parser.close(), expected)
+
+    def test_bom_is_not_part_of_the_header(self):
+        path = self.write_csv(b"\xef\xbb\xbfmonth,sales\nJan,1\n")
+        self.assertEqual(datastore.read_header(path), ["month", "sales"])
+        self.assertEqual(datastore.build_store(path).header, ["month", "sales"])
+
+    def test_ragged_rows_are_padded_and_cut_to_the_header(self):
+        store = datastore.build_store(self.write_csv("a,b,c\n1\n2,3,4,5\n6,7,8"))
+        self.assertEqual(store.rows(), [["1", "", ""], ["2", "3", "4"], ["6", "7", "8"]])
+        self.assertEqual([c["nulls"] for c in store.columns], [0, 1, 1])
+
+    def test_install_keeps_a_store_installed_concurrently(self):
+        path = self.write_csv("a,b\n1,2\n")
+        datastore.build_store(path).close()
+        build_dir = tempfile.mkdtemp(prefix=".build-", dir=self.directory)
+        with mock.patch("insighthubapp.datastore.os.path.exists", return_value=False):
+            target = datastore.install_store(build_dir, path)
+        self.assertFalse(os.path.exists(build_dir))
+        self.assertEqual(sorted(os.listdir(self.directory)), ["data.csv", "data.csv.cols"])
+        self.assertEqual(datastore.open_store(path).rows(), [["1", "2"]])
+        self.assertEqual(target, datastore.store_dir_for(path))
+
+
+class InferenceTests(TestCase):
+    # (kind, datetime format) of a column fed `batches` of cells
+    def infer(self, *batches):
+        inferrer = inference.ColumnTypeInferrer()
+        for cells in batches:
+            inferrer.update(cells)
+        return inferrer.result(), inferrer.datetime_format
+
+    def test_types(self):
+        self.assertEqual(self.infer(["1", "+2", "", "-3"])[0], "int")
+        self.assertEqual(self.infer(["1", "2"], ["2.5"])[0], "float")
+        self.assertEqual(self.infer(["yes", "No", "TRUE"])[0], "bool")
+        self.assertEqual(self.infer(["a", "b", "a", "a"])[0], "category")
+        self.assertEqual(self.infer(["a", "b", "c"])[0], "string")
+        self.assertEqual(self.infer(["", " "])[0], "string")
+        self.assertEqual(self.infer(["1", "1"], ["x", "x"])[0], "category")
+
+    def test_blanks_encode_as_nan(self):
+        encoded = inference.ColumnTypeInferrer().update(["1", "", "3"])
+        self.assertEqual(list(encoded["number"])[::2], [1.0, 3.0])
+        self.assertTrue(math.isnan(encoded["number"][1]))
+
+    def test_datetime_formats(self):
+        self.assertEqual(self.infer(["2024-01-02", "2024-01-03T10:00"]), ("datetime", None))
+        self.assertEqual(self.infer(["01/02/2024", "25/12/2024"]), ("datetime", "%d/%m/%Y"))
+        self.assertEqual(self.infer(["01/02/2024", "12/25/2024"]), ("datetime", "%m/%d/%Y"))
+        self.assertEqual(self.infer(["12/25/2024 10:30"]), ("datetime", "%m/%d/%Y %H:%M"))
+        self.assertEqual(self.infer(["01/01/2024"]), ("datetime", "%d/%m/%Y"))
+
+    def test_ambiguous_or_mixed_dates_stay_text(self):
+        self.assertEqual(self.infer(["01/02/2024", "03/04/2024"]), ("string", False))
+        self.assertEqual(self.infer(["25/12/2024", "2024-12-26"]), ("string", False))
+        self.assertEqual(self.infer(["25/12/2024"], ["12/26/2024"])[0], "string")
+        self.assertEqual(inference.encode_value("datetime", "02/01/1970", "%d/%m/%Y"), 86400.0)
+
+
+class DownsampleTests(TestCase):
+    def test_lttb_keeps_the_shape(self):
+        values = [0, 5, 1, 2, 9, 1, 3, 4, 0]
+        self.assertEqual(downsample.lttb(values, 5), [0, 1, 4, 5, 8])
+        self.assertEqual(downsample.lttb(values, 20), list(range(9)))
+        self.assertEqual(downsample.lttb(values, 2), [0, 8])
+
+    def test_minmax_keeps_every_spike(self):
+        self.assertEqual(downsample.minmax([0, 5, 1, 2, 9, 1, 3, 4, 0], 4), [0, 1, 4, 8])
+
+    def test_blanks_are_never_picked(self):
+        values = [0, 1, 5, 1, math.inf, math.nan, math.nan, math.nan, 2, 8, 2, 0]
+        self.assertEqual(downsample.lttb(values, 6), [0, 2, 3, 9, 11])
+        self.assertEqual(downsample.minmax(values, 6), [0, 2, 9, 11])
+        self.assertEqual(downsample.lttb([math.nan, 3, math.nan, math.nan, 7, 1, math.nan], 4), [0, 1, 4, 6])
+        with self.assertRaises(ValueError):
+            downsample.downsample(values, 4, "mean")
+
+
+class AggregateTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix="insighthub-aggregate-")
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        path = os.path.join(directory, "data.csv")
+        with open(path, "w") as f:
+            f.write("cat,ser,y\nA,x,1\nB,x,2\nA,y,3\n,x,4\nA,x,\n ,y,5\nC,y,6\n")
+        self.store = datastore.build_store(path)
+
+    def test_group_by_one_key(self):
+        result = aggregate.group_by(self.store, ["cat"], "y")
+        self.assertEqual((result["labels"], result["series"]), (["A", "B", "(blank)", "C"], ["y"]))
+        self.assertEqual(result["data"], [[4.0, 2.0, 9.0, 6.0]])
+        self.assertEqual(aggregate.group_by(self.store, ["cat"], "y", "count")["data"], [[2, 1, 2, 1]])
+
+    def test_group_by_two_keys(self):
+        result = aggregate.group_by(self.store, ["cat", "ser"], "y", "mean")
+        self.assertEqual((result["labels"], result["series"], result["groups"]), (["A", "B", "(blank)", "C"], ["x", "y"], 6))
+        self.assertEqual(result["data"], [[1.0, 2.0, 4.0, None], [3.0, None, 5.0, 6.0]])
+
+    def test_group_limit_and_errors(self):
+        result = aggregate.group_by(self.store, ["cat"], "y", "max", limit=2)
+        self.assertEqual((result["labels"], result["data"], result["truncated"]), (["A", "B"], [[3.0, 2.0]], True))
+        for keys, y, agg in ((["cat"], "y", "median"), ([], "y", "sum"), (["cat"], "z", "sum"), (["ser"], "cat", "sum")):
+            with self.subTest(keys=keys, y=y, agg=agg), self.assertRaises(ValueError):
+                aggregate.group_by(self.store, keys, y, agg)
+
+    def test_chart_aggregate_ignores_a_series_that_is_the_y_column(self):
+        self.assertIsNone(aggregate.chart_aggregate(self.store, {"x": "cat", "y": "y"}))
+        result = aggregate.chart_aggregate(self.store, {"category": "cat", "y": "y", "series": "y"})
+        self.assertEqual(result["keys"], ["cat"])
+
+
+class PyramidTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp(prefix="insighthub-pyramid-")
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        self.path = os.path.join(directory, "data.csv")
+        with open(self.path, "w") as f:
+            f.write("x,y\n" + "".join(f"{i},{i}\n" for i in range(100)))
+        self.store = datastore.build_store(self.path)
+        pyramid.build_pyramid(self.store)
+
+    # The store with a patch journalled and applied to the pyramid
+    def patch(self, ops):
+        datastore.append_journal(self.store.directory, 1, ops)
+        store = datastore.ColumnStore(self.store.directory, self.store.manifest)
+        pyramid.apply_ops(store, ops)
+        return store
+
+    def columns(self, result):
+        return {key: result[key] for key in ("start", "min", "max", "mean", "count")}
+
+    def test_levels_merge_pairs(self):
+        meta = pyramid.open_pyramid(self.store).meta
+        self.assertEqual(meta["columns"], {"0": {"top": 7, "sorted": True}, "1": {"top": 7, "sorted": True}})
+        result = pyramid.query_range(self.store, "x", "y", width=4)
+        self.assertEqual((result["level"], result["x_mode"]), (5, "value"))
+        self.assertEqual(self.columns(result), {
+            "start": [0, 32, 64, 96],
+            "min": [0, 32, 64, 96],
+            "max": [31, 63, 95, 99],
+            "mean": [15.5, 47.5, 79.5, 97.5],
+            "count": [32, 32, 32, 4],
+        })
+
+    def test_end_buckets_are_clipped_to_the_range(self):
+        result = pyramid.query_range(self.store, "x", "y", 5, 90, width=2)
+        self.assertEqual((result["from"], result["to"], result["level"]), (5, 91, 6))
+        self.assertEqual(self.columns(result), {
+            "start": [5, 64], "min": [5, 64], "max": [63, 90], "mean": [34.0, 77.0], "count": [59, 27],
+        })
+        self.assertEqual(result["labels"], ["5", "64"])
+
+    def test_narrow_ranges_read_raw_values(self):
+        result = pyramid.query_range(self.store, "x", "y", 10, 13, width=100, by_row=True)
+        self.assertIsNone(result["level"])
+        self.assertEqual(self.columns(result), {
+            "start": [10, 11, 12, 13], "min": [10, 11, 12, 13], "max": [10, 11, 12, 13],
+            "mean": [10.0, 11.0, 12.0, 13.0], "count": [1, 1, 1, 1],
+        })
+
+    def test_patches_update_the_pyramid_in_place_of_a_rebuild(self):
+        for ops in (
+            [{"op": "set", "row": 10, "col": 1, "value": "1000"}, {"op": "set", "row": 70, "col": 1, "value": ""}],
+            [{"op": "insert", "row": 3, "values": [["3.5", "-7"]]}, {"op": "delete", "row": 50, "count": 2}],
+        ):
+            with self.subTest(ops=ops):
+                self.setUp()
+                store = self.patch(ops)
+                with mock.patch("insighthubapp.pyramid.build_pyramid", side_effect=AssertionError("rebuilt")):
+                    patched = [pyramid.query_range(store, "x", "y", width=w) for w in (4, 7, 100)]
+                    clipped = pyramid.query_range(store, "x", "y", 5, 90, width=2)
+                pyramid.build_pyramid(store)
+                self.assertEqual(patched, [pyramid.query_range(store, "x", "y", width=w) for w in (4, 7, 100)])
+                self.assertEqual(clipped, pyramid.query_range(store, "x", "y", 5, 90, width=2))
+
+        self.assertEqual(patched[0]["rows"], 99)
+        self.assertEqual(patched[0]["min"][0], -7)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, CACHES=CACHES)
+class IngestJobTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("grace", password="pw")
+        self.bar, _ = Chart_Types.objects.get_or_create(chart_type="Bar Chart")
+        self.dashboard = Dashboards.objects.create(user=self.user, name="Upload")
+        self.client.force_login(self.user)
+        cache.clear()
+
+    def upload(self):
+        return self.client.post(reverse("dashboard", args=[self.dashboard.pk]), {
+            "action": "chart", "name": "Upload", "description": "", "chart_type": self.bar.pk, "status": "True",
+            "file_path": SimpleUploadedFile("sales.csv", CSV.encode(), content_type="text/csv"),
+        })
+
+    def run_worker(self):
+        call_command("ingest_worker", "--once", stdout=open("/dev/null", "w"))
+
+    def test_upload_queues_the_parse_for_the_worker(self):
+        self.assertEqual(self.upload().status_code, 302)
+        dataset = Datasets.objects.get(dashboard=self.dashboard)
+        self.assertEqual(Ingest_Jobs.objects.get(dataset=dataset).status, jobs.QUEUED)
+        self.assertEqual(dataset.file_path.name, uploads.pooled_name("uploads", hashlib.sha256(CSV.encode()).hexdigest(), ".csv"))
+        self.assertEqual(set(Dataset_Columns.objects.filter(dataset=dataset).values_list("data_type", flat=True)), {"string"})
+        self.assertEqual(Datasets.objects.get(pk=dataset.pk).row_count, 0)
+        self.assertContains(self.client.get(reverse("dashboard", args=[self.dashboard.pk])), "Processing the uploaded file")
+        self.assertEqual(self.client.get(reverse("dashboard_columns", args=[self.dashboard.pk])).status_code, 409)
+
+        self.run_worker()
+        status = self.client.get(reverse("dashboard_ingest", args=[self.dashboard.pk])).json()
+        self.assertEqual(status["job"]["status"], jobs.DONE)
+        self.assertEqual(Datasets.objects.get(pk=dataset.pk).row_count, 100)
+        self.assertEqual(Dataset_Columns.objects.get(dataset=dataset, column_name="sales").data_type, "float")
+        self.assertNotContains(self.client.get(reverse("dashboard", args=[self.dashboard.pk])), "Processing the uploaded file")
+
+    def test_store_readers_wait_for_the_worker(self):
+        self.upload()
+        Dashboards.objects.filter(pk=self.dashboard.pk).update(status=False)
+        body = json.dumps({"ops": [{"op": "set", "row": 0, "col": 1, "value": "2"}]})
+        with mock.patch("insighthubapp.datastore.store_for", side_effect=AssertionError("store opened")):
+            for name in ("dashboard_rows", "dashboard_aggregate", "dashboard_series", "dashboard_range"):
+                with self.subTest(url=name):
+                    self.assertEqual(self.client.get(reverse(name, args=[self.dashboard.pk])).status_code, 409)
+            patch = self.client.post(reverse("dashboard_patch", args=[self.dashboard.pk]), body, content_type="application/json")
+            self.assertEqual(patch.status_code, 409)
+            for name in ("publicDashboard_series", "publicDashboard_range"):
+                with self.subTest(url=name):
+                    self.assertEqual(self.client.get(reverse(name, args=[self.dashboard.pk])).status_code, 409)
+            self.assertContains(self.client.get(reverse("publicDashboard", args=[self.dashboard.pk])), "still being processed")
+            _, cards = previews.load_previews(Dashboards.objects.filter(pk=self.dashboard.pk))
+            self.assertTrue(cards[0]["pending"])
+
+        self.run_worker()
+        self.assertEqual(self.client.get(reverse("dashboard_series", args=[self.dashboard.pk])).status_code, 200)
+        patch = self.client.post(reverse("dashboard_patch", args=[self.dashboard.pk]), body, content_type="application/json")
+        self.assertEqual(patch.status_code, 200)
+
+    def test_job_bumps_the_current_data_version(self):
+        self.upload()
+        job = jobs.claim_next()
+        version = job.dataset.data_version
+        Datasets.objects.filter(pk=job.dataset_id).update(data_version=version + 5)
+        jobs.run_job(job)
+        self.assertEqual(Datasets.objects.get(pk=job.dataset_id).data_version, version + 6)
+        self.assertEqual(job.dataset.data_version, version + 6)
+
+    def test_failed_job_reports_its_error(self):
+        self.upload()
+        dataset = Datasets.objects.get(dashboard=self.dashboard)
+        with mock.patch("insighthubapp.ingest.ingest_dataset", side_effect=ValueError("Unreadable CSV.")):
+            with self.assertLogs("insighthubapp.jobs", level="ERROR"):
+                self.run_worker()
+        job = Ingest_Jobs.objects.get(dataset=dataset)
+        self.assertEqual((job.status, job.error), (jobs.FAILED, "Unreadable CSV."))
+        self.assertContains(self.client.get(reverse("dashboard", args=[self.dashboard.pk])), "could not be processed")
+
+    def test_abandoned_jobs_are_requeued_then_failed(self):
+        self.upload()
+        job = jobs.claim_next()
+        self.assertIsNone(jobs.claim_next())
+        long_ago = job.started_at - timedelta(seconds=jobs.job_timeout() + 1)
+        for attempt in range(jobs.max_attempts() - 1):
+            Ingest_Jobs.objects.filter(pk=job.pk).update(heartbeat_at=long_ago)
+            self.assertEqual(jobs.requeue_abandoned(), 1)
+            self.assertEqual(jobs.claim_next().pk, job.pk)
+        Ingest_Jobs.objects.filter(pk=job.pk).update(heartbeat_at=long_ago)
+        self.assertEqual(jobs.requeue_abandoned(), 0)
+        self.assertEqual(Ingest_Jobs.objects.get(pk=job.pk).status, jobs.FAILED)
+
+    def test_long_job_with_a_heartbeat_is_left_running(self):
+        self.upload()
+        job = jobs.claim_next()
+        long_ago = job.started_at - timedelta(seconds=jobs.job_timeout() * 10)
+        Ingest_Jobs.objects.filter(pk=job.pk).update(started_at=long_ago, heartbeat_at=long_ago)
+        self.assertTrue(jobs.beat(job))
+        self.assertEqual(jobs.requeue_abandoned(), 0)
+        self.assertEqual(Ingest_Jobs.objects.get(pk=job.pk).status, jobs.RUNNING)
+
+    def test_requeued_job_drops_the_first_workers_result(self):
+        self.upload()
+        first = jobs.claim_next()
+        long_ago = first.started_at - timedelta(seconds=jobs.job_timeout() + 1)
+        Ingest_Jobs.objects.filter(pk=first.pk).update(heartbeat_at=long_ago)
+        jobs.requeue_abandoned()
+        second = jobs.claim_next()
+        self.assertFalse(jobs.beat(first))
+        with self.assertLogs("insighthubapp.jobs", level="WARNING"):
+            jobs.run_job(first)
+        self.assertEqual(Ingest_Jobs.objects.get(pk=first.pk).status, jobs.RUNNING)
+        jobs.run_job(second)
+        self.assertEqual(Ingest_Jobs.objects.get(pk=first.pk).status, jobs.DONE)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, CACHES=CACHES)
+class ColumnProfileTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("hedy", password="pw")
+        self.dashboard = seed_dashboards(self.user, 1)[0]
+        self.client.force_login(self.user)
+
+    def test_ingest_profiles_every_column(self):
+        sales = Dataset_Columns.objects.get(dataset__dashboard=self.dashboard, column_name="sales")
+        self.assertEqual((sales.min_value, sales.max_value), (0.0, 148.5))
+        self.assertEqual((sales.null_count, sales.distinct_count), (0, 100))
+        self.assertEqual(sales.histogram, [5] * profiles.histogram_bins())
+
+        region = Dataset_Columns.objects.get(dataset__dashboard=self.dashboard, column_name="region")
+        self.assertEqual((region.distinct_count, region.min_value, region.histogram), (4, None, []))
+
+    def test_endpoint_lists_profiles_in_sheet_order(self):
+        response = self.client.get(reverse("dashboard_columns", args=[self.dashboard.pk]))
+        columns = response.json()["columns"]
+        self.assertEqual([(c["letter"], c["name"]) for c in columns], [("A", "month"), ("B", "sales"), ("C", "region")])
+        self.assertEqual((columns[1]["type"], columns[1]["max"], columns[1]["distinct_exact"]), ("float", 148.5, True))
+
+        other = User.objects.create_user("ivan", password="pw")
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(reverse("dashboard_columns", args=[self.dashboard.pk])).status_code, 404)
+
+    def test_histogram_bins(self):
+        class Store:
+            row_count = 4
+            def values(self, name, start, stop):
+                return [1.0, 1.5, 2.0, 4.0][start:stop] if name == "spread" else [7.0, math.nan, 7.0, 7.0][start:stop]
+        self.assertEqual(profiles.histogram(Store(), "spread", 1.0, 4.0, bins=3), [2, 1, 1])
+        self.assertEqual(profiles.histogram(Store(), "flat", 7.0, 7.0, bins=3), [3, 0, 0])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, CACHES=CACHES)
+class UploadStorageTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("ken", password="pw")
+        self.client.force_login(self.user)
+
+    def test_same_content_is_stored_once(self):
+        first = seed_dashboards(self.user, 1)[0].chart.dataset
+        dashboard = Dashboards.objects.create(user=self.user, name="Copy")
+        second = Datasets(name="copy.csv", user=self.user, dashboard=dashboard)
+        second.file_path.save("copy.csv", ContentFile(CSV.encode()))
+        # Its store, pyramid and profiles come from the first dataset
+        with mock.patch("insighthubapp.profiles.profile_store", side_effect=AssertionError):
+            ingest.ingest_dataset(second)
+
+        self.assertEqual(second.file_path.name, first.file_path.name)
+        self.assertTrue(uploads.is_pooled(first.file_path.name))
+        self.assertGreaterEqual(uploads.references(first.file_path.name), 2)
+        profile = lambda dataset: list(Dataset_Columns.objects.filter(dataset=dataset).order_by("column_name").values_list("column_name", "data_type", "max_value"))
+        self.assertEqual(profile(second), profile(first))
+
+    def test_edit_moves_the_dataset_off_the_shared_file(self):
+        edited, other = (d.chart.dataset for d in seed_dashboards(self.user, 2))
+        shared = edited.file_path.name
+        ops = [{"op": "set", "row": 0, "col": 0, "value": "edited"}]
+        self.client.post(reverse("dashboard_patch", args=[edited.dashboard_id]), json.dumps({"ops": ops}), content_type="application/json")
+
+        edited.refresh_from_db()
+        self.assertIn("/edited/", edited.file_path.name)
+        self.assertEqual(datastore.store_for(edited).text("month", 0, 1), ["edited"])
+        self.assertEqual(datastore.store_for(other).text("month", 0, 1), ["m0"])
+        with open(other.file_path.path, "rb") as f:
+            self.assertEqual(uploads.pooled_name("uploads", hashlib.sha256(f.read()).hexdigest(), ".csv"), shared)
+
+    def test_racing_upload_of_the_same_bytes_finds_it_pooled(self):
+        body = b"month,sales\nrace,1\n"
+        pooled = uploads.pooled_name("uploads", hashlib.sha256(body).hexdigest(), ".csv")
+
+        # The other upload finishes while this one is still writing its bytes
+        class Racing(ContentFile):
+            def chunks(self, chunk_size=None):
+                with open(uploads.upload_storage.path(pooled), "xb") as f:
+                    f.write(body)
+                return super().chunks(chunk_size)
+
+        content = Racing(body)
+        content.sha256 = hashlib.sha256(body).hexdigest()    # as CsvIngestUploadHandler sets it
+        os.makedirs(os.path.dirname(uploads.upload_storage.path(pooled)), exist_ok=True)
+        name = uploads.upload_storage.save("uploads/race.csv", content)
+        self.assertEqual(name, pooled)
+        directory = os.path.dirname(uploads.upload_storage.path(name))
+        self.assertEqual(os.listdir(directory), [os.path.basename(name)])
+        with open(uploads.upload_storage.path(name), "rb") as f:
+            self.assertEqual(f.read(), body)
+
+    def test_new_content_is_saved_as_a_new_upload(self):
+        replaced, other = (d.chart.dataset for d in seed_dashboards(self.user, 2))
+        body = "month,sales\nm0,1\n"
+        response = self.client.post(reverse("dashboard", args=[replaced.dashboard_id]), body, content_type="text/csv", HTTP_X_ACTION="data")
+        self.assertTrue(response.json()["success"])
+
+        replaced.refresh_from_db()
+        self.assertNotEqual(replaced.file_path.name, other.file_path.name)
+        self.assertTrue(uploads.is_pooled(replaced.file_path.name))
+        self.assertEqual(datastore.read_header(other.file_path.path), ["month", "sales", "region"])
+
+
+GC_MEDIA_ROOT = tempfile.mkdtemp(prefix="insighthub-gc-tests-")
+
+
+@override_settings(MEDIA_ROOT=GC_MEDIA_ROOT, CACHES=CACHES, UPLOAD_GRACE_SECONDS=0)
+class UploadCleanupTests(TestCase):
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(GC_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.user = User.objects.create_user("lin", password="pw")
+
+    def test_file_is_released_with_its_last_dataset(self):
+        first, second = seed_dashboards(self.user, 2)
+        path = first.chart.dataset.file_path.path
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(os.path.exists(path))
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(datastore.store_dir_for(path)))
+
+    def test_clearing_the_file_drops_its_columns(self):
+        dataset = Datasets.objects.get(dashboard=seed_dashboards(self.user, 1)[0])
+        path = dataset.file_path.path
+        dataset.file_path = None
+        with self.captureOnCommitCallbacks(execute=True):
+            dataset.save()
+        self.assertFalse(Dataset_Columns.objects.filter(dataset=dataset).exists())
+        self.assertFalse(os.path.exists(path))
+
+    def test_collect_uploads(self):
+        kept = seed_dashboards(self.user, 1)[0].chart.dataset.file_path.path
+        root = os.path.join(GC_MEDIA_ROOT, "uploads")
+        stray = os.path.join(root, "ab", "cd", "ab" + "0" * 62 + ".csv")
+        os.makedirs(stray + datastore.STORE_SUFFIX)
+        with open(stray, "w") as f:
+            f.write(CSV)
+        os.makedirs(os.path.join(root, "gone.csv" + datastore.STORE_SUFFIX))
+        os.makedirs(os.path.join(root, ".build-x"))
+
+        out = io.StringIO()
+        call_command("collect_uploads", "--dry-run", stdout=out)
+        self.assertIn("3 path(s) would be deleted", out.getvalue())
+        self.assertTrue(os.path.exists(stray))
+
+        with override_settings(UPLOAD_GRACE_SECONDS=3600):
+            call_command("collect_uploads", "--rate", "0", stdout=io.StringIO())
+        self.assertTrue(os.path.exists(stray))
+
+        out = io.StringIO()
+        call_command("collect_uploads", "--rate", "0", stdout=out)
+        self.assertIn("3 path(s) deleted", out.getvalue())
+        self.assertFalse(os.path.exists(stray) or os.path.exists(stray + datastore.STORE_SUFFIX))
+        self.assertTrue(os.path.exists(kept) and os.path.exists(datastore.store_dir_for(kept)))
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, CACHES=CACHES)
+class SketchTests(TestCase):
+    def test_hyperloglog_estimates_and_merges(self):
+        left, right = sketches.HyperLogLog(), sketches.HyperLogLog()
+        for i in range(20000):
+            (left if i % 2 else right).add(f"id-{i}")
+        left.merge(sketches.HyperLogLog.load(right.dump()))
+        self.assertAlmostEqual(left.estimate(), 20000, delta=20000 * 0.05)
+
+    def test_kll_quantiles_and_merge(self):
+        left, right = sketches.KLL(), sketches.KLL()
+        left.update(float(v) for v in range(0, 50000))
+        right.update(float(v) for v in range(50000, 100000))
+        left.merge(sketches.KLL.load(json.loads(json.dumps(right.dump()))))
+        low, median, high = left.quantiles([0.1, 0.5, 0.9])
+        self.assertEqual(left.n, 100000)
+        self.assertAlmostEqual(low, 10000, delta=3000)
+        self.assertAlmostEqual(median, 50000, delta=3000)
+        self.assertAlmostEqual(high, 90000, delta=3000)
+
+    def test_frequent_items_keep_heavy_cells(self):
+        items = sketches.FrequentItems(capacity=10)
+        for block in range(10):
+            items.update({"heavy": 100, **{f"rare-{block}-{i}": 1 for i in range(50)}})
+        (cell, count), = items.top(1)
+        self.assertEqual(cell, "heavy")
+        self.assertLessEqual(count, 1000)
+        self.assertGreaterEqual(count + items.error, 1000)
+
+    def test_approximate_chart_modes(self):
+        user = User.objects.create_user("judy", password="pw")
+        dashboard = seed_dashboards(user, 1)[0]
+        self.client.force_login(user)
+        url = reverse("dashboard_approx", args=[dashboard.pk])
+
+        bands = self.client.get(url + "?mode=percentiles&q=0,0.5,1").json()
+        self.assertEqual((bands["y"], bands["n"], bands["values"]), ("sales", 100, [0.0, 73.5, 148.5]))
+        top = self.client.get(url + "?mode=topk&k=2").json()
+        self.assertEqual((top["y"], top["data"], top["error"]), ("region", [[25, 25]], 0))
+        self.assertEqual(self.client.get(url + "?mode=percentiles&q=2").status_code, 400)
+        self.assertEqual(self.client.get(url + "?mode=median").status_code, 400)
+
+        # Patched rows are fed into the sketches without a rescan
+        ops = [{"op": "insert", "row": 0, "values": [["m", "1000", "Z"]] * 30}]
+        self.client.post(reverse("dashboard_patch", args=[dashboard.pk]), json.dumps({"ops": ops}), content_type="application/json")
+        top = self.client.get(url + "?mode=topk&k=1").json()
+        self.assertEqual((top["labels"], top["data"]), (["Z"], [[30]]))
+        self.assertEqual(self.client.get(url + "?mode=percentiles&q=1").json()["values"], [1000.0])
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, CACHES=CACHES)
+class GalleryCursorTests(TestCase):
+    def forge(self, *parts):
+        return base64.urlsafe_b64encode(json.dumps(list(parts)).encode()).decode().rstrip("=")
+
+    def test_cursor_round_trip(self):
+        user = User.objects.create_user("kim", password="pw")
+        dashboard = Dashboards.objects.create(user=user, name="Cursor", status=False, like_count=3)
+        self.assertEqual(gallery.decode_cursor(gallery.encode_cursor(dashboard, "popular"), "popular"), (3, dashboard.pk))
+        self.assertEqual(gallery.decode_cursor(gallery.encode_cursor(dashboard, "recent"), "recent"), (dashboard.create_at, dashboard.pk))
+
+    def test_forged_cursors_are_rejected(self):
+        self.client.force_login(User.objects.create_user("lee", password="pw"))
+        for sort, cursor in (
+            ("popular", self.forge("popular", "3", 1)),
+            ("popular", self.forge("popular", True, 1)),
+            ("popular", self.forge("popular", 1.5, 1)),
+            ("popular", self.forge("popular", [1], 1)),
+            ("popular", self.forge("popular", 3, "1")),
+            ("recent", self.forge("recent", 3, 1)),
+            ("recent", self.forge("popular", 3, 1)),
+            ("recent", "x"),
+        ):
+            with self.subTest(sort=sort, cursor=cursor):
+                with self.assertRaises(ValueError):
+                    gallery.decode_cursor(cursor, sort)
+                response = self.client.get(reverse("publicProjects_page"), {"sort": sort, "cursor": cursor})
+                self.assertEqual(response.status_code, 400)
+
+
+# Tables a query reads with a full scan, from the backend's query plan
+def full_scans(queryset):
+    if connection.vendor == "sqlite":
+        return re.findall(r"\bSCAN (\w+)\s*$", queryset.explain(), re.M)
+    if connection.vendor == "mysql":
+        scans = []
+        def walk(node):
+            if isinstance(node, dict):
+                if node.get("access_type") == "ALL":
+                    scans.append(node.get("table_name"))
+                for value in node.values():
+                    walk(value)
+            elif isinstance(node, list):
+                for value in node:
+                    walk(value)
+        walk(json.loads(queryset.explain(format="json")))
+        return scans
+    return None
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, CACHES=CACHES)
+class QueryPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("bob", password="pw")
+        cls.dashboards = seed_dashboards(cls.user, 3)
+        cls.dashboard = cls.dashboards[0]
+        cls.dataset = cls.dashboard.chart.dataset
+
+    def assertIndexed(self, queryset):
+        scans = full_scans(queryset)
+        if scans is None:
+            self.skipTest(f"No plan check for {connection.vendor}.")
+        self.assertEqual(scans, [], queryset.explain())
+
+    def test_like_lookup(self):
+        self.assertIndexed(Social_Like.objects.filter(dashboard=self.dashboard, user=self.user))
+
+    def test_axis_selections(self):
+        self.assertIndexed(Selected_Columns.objects.filter(chart=self.dashboard.chart, axis_type="x"))
+
+    def test_column_by_name(self):
+        self.assertIndexed(Dataset_Columns.objects.filter(dataset=self.dataset, column_name="sales"))
+
+    def test_dataset_for_dashboard(self):
+        self.assertIndexed(Datasets.objects.filter(user=self.user, dashboard=self.dashboard))
+
+    def test_gallery_pages(self):
+        if connection.vendor == "sqlite":
+            self.skipTest("SQLite compiles status=False to NOT status, which can't seek an index.")
+        public = Dashboards.objects.filter(status=False)
+        for sort in gallery.SORTS:
+            with self.subTest(sort=sort):
+                cursor = gallery.encode_cursor(self.dashboards[1], sort)
+                self.assertIndexed(gallery.seek(public, sort, cursor)[:gallery.page_size()])
+
+    def test_axis_save_upserts(self):
+        chart = self.dashboard.chart
+        self.client.force_login(self.user)
+        for x_axis in ("A", "C"):
+            response = self.client.post(reverse("dashboard", args=[self.dashboard.pk]), {
+                "action": "data", "name": "D", "x_axis": x_axis, "y_axis": "B", "category": "C", "series": "B",
+            })
+            self.assertEqual(response.status_code, 302)
+        self.assertEqual(Selected_Columns.objects.filter(chart=chart).count(), 4)
+        self.assertEqual(Selected_Columns.objects.get(chart=chart, axis_type="x").column.column_name, "region")
+        self.assertFalse(Selected_Columns.objects.filter(chart__isnull=True).exists())
+
+
+class StoreReadTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="insighthub-store-")
+        self.addCleanup(shutil.rmtree, self.directory, ignore_errors=True)
+        self.path = os.path.join(self.directory, "data.csv")
+
+    def write_csv(self, content):
+        with open(self.path, "w") as f:
+            f.write(content)
+        return self.path
+
+    def test_columns_are_read_back(self):
+        store = datastore.build_store(self.write_csv("n,t\n1,a\n,b\n3.5,c\n"))
+        self.assertEqual((store.header, store.row_count), (["n", "t"], 3))
+        self.assertEqual([c["kind"] for c in store.columns], ["float", "string"])
+        self.assertEqual(store.text("t", 1), ["b", "c"])
+        self.assertEqual(store.values("n")[::2].tolist(), [1.0, 3.5])
+        self.assertTrue(math.isnan(store.values("n")[1]))
+        self.assertIsNone(store.values("t"))
+        self.assertEqual(store.rows(["t", "n"], 0, 2), [["a", "1"], ["b", ""]])
+        self.assertEqual(store.rows(start=5), [])
+
+    def test_store_is_rebuilt_when_the_csv_changes(self):
+        datastore.build_store(self.write_csv("n\n1\n")).close()
+        self.assertEqual(datastore.open_store(self.path).rows(), [["1"]])
+        self.write_csv("n\n1\n22\n")
+        self.assertEqual(datastore.open_store(self.path).rows(), [["1"], ["22"]])
+
+    def test_journal_is_replayed_over_the_base_columns(self):
+        directory = datastore.build_store(self.write_csv("n,t\n1,a\n2,b\n3,c\n")).directory
+        datastore.append_journal(directory, 1, [
+            {"op": "set", "row": 1, "col": 0, "value": "20"},
+            {"op": "insert", "row": 0, "values": [["0", "z"]]},
+            {"op": "header", "col": 1, "value": "letter"},
+        ])
+        datastore.append_journal(directory, 2, [
+            {"op": "delete", "row": 1, "count": 1},
+            {"op": "set", "row": 0, "col": 1, "value": "y"},
+            {"op": "set", "row": 1, "col": 0, "value": "x"},
+        ])
+        store = datastore.open_store(self.path)
+        self.assertEqual((store.header, store.row_count, store.journal_ops), (["n", "letter"], 3, 6))
+        self.assertEqual(store.rows(), [["0", "y"], ["x", "b"], ["3", "c"]])
+        self.assertEqual(store.rows(start=1, stop=2), [["x", "b"]])
+        values = store.values("n").tolist()
+        self.assertEqual((values[0], values[2]), (0.0, 3.0))
+        self.assertTrue(math.isnan(values[1]))
+
+    def test_overlaid_reads_match_the_edited_sheet(self):
+        rng = random.Random(7)
+        sheet = [[str(i), f"t{i}"] for i in range(200)]
+        directory = datastore.build_store(self.write_csv("n,t\n" + "".join(f"{n},{t}\n" for n, t in sheet))).directory
+        for version in range(1, 40):
+            op = rng.choice(["set", "set", "insert", "delete"])
+            row = rng.randrange(len(sheet) + (op == "insert"))
+            if op == "set":
+                col = rng.randrange(2)
+                value = str(rng.randrange(1000))
+                sheet[row][col] = value
+                ops = [{"op": "set", "row": row, "col": col, "value": value}]
+            elif op == "insert":
+                rows = [[str(-version), f"new{version}.{k}"] for k in range(rng.randrange(1, 4))]
+                sheet[row:row] = [list(r) for r in rows]
+                ops = [{"op": "insert", "row": row, "values": rows}]
+            else:
+                count = min(rng.randrange(1, 6), len(sheet) - row)
+                del sheet[row:row + count]
+                ops = [{"op": "delete", "row": row, "count": count}]
+            datastore.append_journal(directory, version, ops)
+
+        store = datastore.open_store(self.path)
+        self.assertEqual(store.row_count, len(sheet))
+        for start, stop in ((0, None), (13, 97), (len(sheet) - 5, None)):
+            with self.subTest(start=start, stop=stop):
+                self.assertEqual(store.rows(start=start, stop=stop), sheet[start:stop])
+                self.assertEqual(store.values("n", start, stop).tolist(), [float(n) for n, _ in sheet[start:stop]])
+        positions = sorted(rng.sample(range(len(sheet)), 20))
+        self.assertEqual(store.text_at("t", positions), [sheet[i][1] for i in positions])
+
+
+class PreviewCacheTests(TestCase):
+    def test_least_recently_used_entries_are_evicted(self):
+        lru = previews.PreviewCache(3)
+        for key in ((1, "a"), (2, "a"), (1, "b")):
+            lru.set(key, key[1])
+        self.assertEqual(lru.get((1, "a")), "a")
+        lru.set((3, "a"), "c")
+        self.assertEqual([lru.get(k) for k in ((1, "a"), (2, "a"), (1, "b"), (3, "a"))], ["a", None, "b", "c"])
+
+    def test_invalidate_drops_one_dashboard(self):
+        lru = previews.PreviewCache(10)
+        for key in ((1, "a"), (2, "a"), (1, "b")):
+            lru.set(key, key[1])
+        lru.invalidate(1)
+        self.assertEqual([lru.get(k) for k in ((1, "a"), (2, "a"), (1, "b"))], [None, "a", None])
+        lru.clear()
+        self.assertIsNone(lru.get((2, "a")))
+
+
+class PatchTests(TestCase):
+    CSV = "n,t\n1,a\n2,b\n3,c\n"
+
+    def setUp(self):
+        media = tempfile.mkdtemp(prefix="insighthub-patch-")
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        media_root = override_settings(MEDIA_ROOT=media)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.dataset = Datasets(name="data.csv")
+        self.dataset.file_path.save("data.csv", ContentFile(self.CSV.encode()))
+        ingest.ingest_dataset(self.dataset)
+
+    def test_ops_are_normalised_against_the_changing_shape(self):
+        ops = [
+            {"op": "set", "row": "1", "col": 0, "value": 5},
+            {"op": "insert", "row": 3, "values": [["a", "b", "c"], ["d"]]},
+            {"op": "delete", "row": 4, "count": 9},
+            {"op": "header", "col": 1, "value": None},
+        ]
+        self.assertEqual(edits.clean_ops(ops, 3, 2), [
+            {"op": "set", "row": 1, "col": 0, "value": "5"},
+            {"op": "insert", "row": 3, "values": [["a", "b"], ["d", ""]]},
+            {"op": "delete", "row": 4, "count": 1},
+            {"op": "header", "col": 1, "value": ""},
+        ])
+        for bad in ([], [{"op": "set", "row": 3, "col": 0}], [{"op": "set", "row": 0, "col": 2}],
+                    [{"op": "insert", "row": 4}], [{"op": "delete", "row": 0, "count": 0}], [{"op": "move"}], [{"op": "set"}], ["set"],
+                    [{"op": "insert", "row": 0, "count": edits.DEFAULT_INSERT_LIMIT + 1}], [{"op": "insert", "row": 0, "count": 0}],
+                    [{"op": "insert", "row": 0, "values": ["ab"]}], [{"op": "insert", "row": 0, "values": "ab"}]):
+            with self.subTest(ops=bad), self.assertRaises(ValueError):
+                edits.clean_ops(bad, 3, 2)
+
+    def test_patch_is_journalled_and_versioned(self):
+        version = self.dataset.data_version
+        ops = [{"op": "insert", "row": 0, "values": [["0", "z"]]}, {"op": "set", "row": 1, "col": 1, "value": "q"}]
+        self.assertEqual(edits.apply_patch(self.dataset, ops, version), (version + 1, 4))
+
+        self.dataset.refresh_from_db()
+        store = datastore.store_for(self.dataset)
+        self.assertEqual((self.dataset.data_version, self.dataset.row_count, store.journal_ops), (version + 1, 4, 2))
+        self.assertEqual(store.rows(), [["0", "z"], ["1", "q"], ["2", "b"], ["3", "c"]])
+        with self.assertRaises(edits.VersionConflict):
+            edits.apply_patch(self.dataset, ops, version)
+
+    def test_renamed_header_keeps_its_column_row(self):
+        edits.apply_patch(self.dataset, [{"op": "header", "col": 1, "value": "letter"}])
+        self.assertEqual(sorted(Dataset_Columns.objects.filter(dataset=self.dataset).values_list("column_name", flat=True)), ["letter", "n"])
+
+    def test_failed_patch_leaves_no_trace(self):
+        pooled, version = self.dataset.file_path.name, self.dataset.data_version
+        with mock.patch("insighthubapp.edits.feed_sketches", side_effect=RuntimeError("boom")):
+            with self.assertRaises(RuntimeError):
+                edits.apply_patch(self.dataset, [{"op": "set", "row": 0, "col": 0, "value": "9"}])
+        self.dataset.refresh_from_db()
+        self.assertEqual((self.dataset.file_path.name, self.dataset.data_version), (pooled, version))
+        # The private copy made for the edit is gone again
+        self.assertEqual([f for root, _, files in os.walk(settings.MEDIA_ROOT) if uploads.EDITED_DIR in root for f in files], [])
+
+        edits.apply_patch(self.dataset, [{"op": "set", "row": 0, "col": 0, "value": "9"}])
+        with mock.patch("insighthubapp.pyramid._write_meta", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                edits.apply_patch(self.dataset, [{"op": "set", "row": 1, "col": 0, "value": "8"}])
+        self.dataset.refresh_from_db()
+        store = datastore.store_for(self.dataset)
+        self.assertEqual((self.dataset.data_version, store.journal_ops), (version + 1, 1))
+        self.assertEqual(store.text("n"), ["9", "2", "3"])
+        self.assertFalse(os.path.exists(os.path.join(store.directory, pyramid.PYRAMID_NAME)))
+
+    @override_settings(DATASET_JOURNAL_LIMIT=3)
+    def test_journal_is_compacted_into_the_csv(self):
+        edits.apply_patch(self.dataset, [{"op": "set", "row": 0, "col": 0, "value": "9"}])
+        with self.captureOnCommitCallbacks(execute=True):
+            edits.apply_patch(self.dataset, [{"op": "delete", "row": 1, "count": 1}, {"op": "header", "col": 1, "value": "letter"}])
+
+        self.dataset.refresh_from_db()
+        store = datastore.store_for(self.dataset)
+        with open(self.dataset.file_path.path, "rb") as f:
+            content = f.read()
+        self.assertEqual(content, b"n,letter\r\n9,a\r\n3,c\r\n")
+        self.assertIsNone(store.overlay)
+        self.assertEqual((self.dataset.row_count, self.dataset.byte_size), (2, len(content)))
+        self.assertEqual(self.dataset.content_hash, hashlib.sha256(content).hexdigest())
@@ -0,0 +1,264 @@
+import hashlib, os, re, secrets, shutil, tempfile, time
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+from . import datastore
+
+
+# Content-addressed upload storage
+#
+# An uploaded CSV is stored once per distinct content, named by its sha256
+# under two levels of hash-prefix directories:
+#   uploads/ab/cd/abcd...ef.csv
+# Uploading the same bytes again writes nothing; the new Datasets row points
+# at the existing file, which is shared (with its columnar store) by every
+# row that references it. References are counted from the Datasets rows
+# themselves (file_path is indexed), so there is no counter to drift.
+#
+# Pooled files never change in place. A dataset gets its own copy under
+# uploads/edited/ before its first spreadsheet edit (edits.detach), and new
+# CSV content for a dataset is saved as a new upload.
+#
+# A file is removed (with its store) once the transaction that deletes or
+# replaces its last referencing dataset commits (signals.py), and
+# `manage.py collect_uploads` sweeps whatever that missed. Neither touches a
+# file whose inode changed within UPLOAD_GRACE_SECONDS: a new upload, or an
+# old one just reused by an upload whose Datasets row is not committed yet.
+
+DIGEST_CHUNK_SIZE = 1024 * 1024
+EDITED_DIR = "edited"
+DEFAULT_GRACE_SECONDS = 15 * 60
+TEMP_PREFIXES = (".build-", ".compact-", ".stale-", ".upload-")    # left behind by interrupted builds and saves
+POOLED_NAME = re.compile(r"(?:^|/)([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}(?:\.\w+)?$")
+
+
+def grace_seconds():
+    return getattr(settings, "UPLOAD_GRACE_SECONDS", DEFAULT_GRACE_SECONDS)
+
+
+def pooled_name(directory, digest, ext):
+    return "/".join(filter(None, [directory, digest[:2], digest[2:4], digest + ext.lower()]))
+
+
+def is_pooled(name):
+    return bool(name) and POOLED_NAME.search(name) is not None
+
+
+# Private name for a dataset's edited copy of `name`, sharded on the dataset
+# pk, with a random tag so copies made by concurrent requests never collide
+def edited_name(name, dataset_pk):
+    directory = name.split("/", 1)[0] if "/" in name else ""
+    stem, ext = os.path.splitext(os.path.basename(name))
+    filename = f"{dataset_pk}-{stem[:16]}-{secrets.token_hex(4)}{ext}"
+    return "/".join(filter(None, [directory, EDITED_DIR, f"{dataset_pk % 256:02x}", filename]))
+
+
+# sha256 of a file's content, read in chunks
+def file_digest(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks(DIGEST_CHUNK_SIZE):
+        digest.update(chunk)
+    if hasattr(content, "seek"):
+        content.seek(0)
+    return digest.hexdigest()
+
+
+# Number of Datasets rows referencing the stored file `name`
+def references(name, exclude=None):
+    datasets = apps.get_model("insighthubapp", "Datasets").objects.filter(file_path=name)
+    if exclude is not None:
+        datasets = datasets.exclude(pk=exclude)
+    return datasets.count()
+
+
+# Whether a stored path changed too recently to be removed
+def _in_grace(path, now=None):
+    try:
+        changed = os.stat(path).st_ctime
+    except FileNotFoundError:
+        return False
+    return (now or time.time()) - changed < grace_seconds()
+
+
+# Delete a stored CSV and its columnar store; returns the bytes freed
+def remove_file(storage, name):
+    path = storage.path(name)
+    freed = _tree_size(path) + _tree_size(datastore.store_dir_for(path))
+    if os.path.exists(path):
+        os.remove(path)
+    shutil.rmtree(datastore.store_dir_for(path), ignore_errors=True)
+    return freed
+
+
+def _tree_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for filename in files:
+            try:
+                total += os.path.getsize(os.path.join(root, filename))
+            except OSError:
+                pass
+    return total
+
+
+# Delete `name` (and its store) if no dataset references it any more and it
+# is out of its grace period; returns the bytes freed, or None if it was kept
+def release(storage, name):
+    if not name or references(name) or _in_grace(storage.path(name)):
+        return None
+    return remove_file(storage, name)
+
+
+# Unreferenced stored paths under `directory` past their grace period, as
+# (kind, path relative to the storage, bytes) with kind "file" (a CSV and its
+# store), "store" (a store whose CSV is gone) or "temp" (an interrupted
+# build). The tree is walked lazily and references are looked up `batch`
+# names at a time, so memory stays flat however many files there are.
+def unreferenced(storage, directory, batch=500):
+    root = storage.path("")
+    now = time.time()
+    pending = []
+
+    def flush():
+        names = [name for name, _ in pending]
+        referenced = set(
+            apps.get_model("insighthubapp", "Datasets").objects.filter(file_path__in=names).values_list("file_path", flat=True)
+        )
+        found = [("file", name, size) for name, size in pending if name not in referenced]
+        pending.clear()
+        return found
+
+    for current, dirs, files in os.walk(storage.path(directory)):
+        relative = os.path.relpath(current, root).replace(os.sep, "/")
+        for dirname in list(dirs):
+            path = os.path.join(current, dirname)
+            if dirname.startswith(TEMP_PREFIXES) or dirname.endswith(datastore.STORE_SUFFIX):
+                dirs.remove(dirname)    # never descend into stores
+                if _in_grace(path, now):
+                    continue
+                if dirname.startswith(TEMP_PREFIXES):
+                    yield "temp", f"{relative}/{dirname}", _tree_size(path)
+                elif not os.path.exists(path[:-len(datastore.STORE_SUFFIX)]):
+                    yield "store", f"{relative}/{dirname}", _tree_size(path)
+        for filename in files:
+            path = os.path.join(current, filename)
+            if _in_grace(path, now):
+                continue
+            if filename.startswith(TEMP_PREFIXES):
+                yield "temp", f"{relative}/{filename}", _tree_size(path)
+                continue
+            pending.append((f"{relative}/{filename}", _tree_size(path) + _tree_size(datastore.store_dir_for(path))))
+            if len(pending) >= batch:
+                yield from flush()
+    if pending:
+        yield from flush()
+
+
+# Delete one path reported by unreferenced(), checking again that nothing has
+# started using it since; returns the bytes freed, or None if it was kept
+def remove_unreferenced(storage, kind, name):
+    if kind == "file":
+        return release(storage, name)
+    path = storage.path(name)
+    if _in_grace(path):
+        return None
+    if kind == "store" and os.path.exists(path[:-len(datastore.STORE_SUFFIX)]):
+        return None
+    freed = _tree_size(path)
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.exists(path):
+        os.remove(path)
+    return freed
+
+
+# Hard link (or copy, across devices) a file, keeping its modification time
+def _link(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+# Give a stored CSV and its built columnar store a second name. The files are
+# hard-linked: everything that rewrites them writes a new file and renames it
+# over the old one, and the edit journal (the one file appended to) is only
+# created once the copy is edited. The store stays fresh for the new name.
+def copy_file(storage, name, new_name):
+    source, target = storage.path(name), storage.path(new_name)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if os.path.exists(target):
+        os.remove(target)
+    _link(source, target)
+    store_dir = datastore.store_dir_for(source)
+    if os.path.isdir(store_dir):
+        shutil.rmtree(datastore.store_dir_for(target), ignore_errors=True)
+        shutil.copytree(store_dir, datastore.store_dir_for(target), copy_function=_link)
+    return new_name
+
+
+# Restart a stored file's grace period (its ctime; the mtime its store is
+# stamped with stays put) so it is not collected before the dataset
+# referencing it commits. Raises FileNotFoundError if it is gone.
+def _touch(path):
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+
+# Storage for Datasets.file_path: saves each distinct content once under its
+# pooled name. Uploads through CsvIngestUploadHandler arrive with their
+# sha256 computed while they streamed in; other content is hashed here.
+# New content is written to a temporary file and hard-linked into place, so
+# the pooled name only ever holds a complete file, and of two uploads of the
+# same bytes racing each other the one that links second finds it pooled.
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, "chunks"):
+            content = File(content, name)
+        digest = getattr(content, "sha256", None) or file_digest(content)
+        name = pooled_name(os.path.dirname(name), digest, os.path.splitext(name)[1])
+        path = self.path(name)
+        temp = None
+        try:
+            while True:
+                try:
+                    _touch(path)
+                    return name
+                except FileNotFoundError:
+                    pass
+                if temp is None:
+                    temp = self._write_temp(path, content)
+                try:
+                    os.link(temp, path)
+                    return name
+                except FileExistsError:
+                    pass    # another upload of the same bytes got there first
+        finally:
+            if temp is not None:
+                os.remove(temp)
+
+    # Write the content to a temporary file next to `path`; returns its path
+    def _write_temp(self, path, content):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temp = tempfile.mkstemp(prefix=".upload-", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for chunk in content.chunks():
+                    f.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(temp, self.file_permissions_mode)
+        except Exception:
+            os.remove(temp)
+            raise
+        return temp
+
+
+upload_storage = ContentAddressedStorage()
@@ -10,9 +10,22 @@ urlpatterns = [
     path("projects/", views.projects, name="projects"),
     path("dashboard/create/", views.create_dashboard, name="create_dashboard"),
     path("dashboard/<int:pk>", views.dashboard, name="dashboard"),
+    path("dashboard/<int:pk>/rows", views.dashboard_rows, name="dashboard_rows"),
+    path("dashboard/<int:pk>/ingest", views.dashboard_ingest, name="dashboard_ingest"),
+    path("dashboard/<int:pk>/columns", views.dashboard_columns, name="dashboard_columns"),
+    path("dashboard/<int:pk>/approx", views.dashboard_approx, name="dashboard_approx"),
+    path("dashboard/<int:pk>/aggregate", views.dashboard_aggregate, name="dashboard_aggregate"),
+    path("dashboard/<int:pk>/series", views.dashboard_series, name="dashboard_series"),
+    path("dashboard/<int:pk>/range", views.dashboard_range, name="dashboard_range"),
+    path("dashboard/<int:pk>/patch", views.dashboard_patch, name="dashboard_patch"),
     path("dashboard/<int:pk>/delete", views.delete_dashboard, name="delete_dashboard"),
     path("publicprojects/", views.publicProjects, name="publicProjects"),
+    path("publicprojects/page", views.publicProjects_page, name="publicProjects_page"),
+    path("publicprojects/likes", views.publicProjects_likes, name="publicProjects_likes"),
     path("publicProjects/<int:pk>", views.publicDashboard, name="publicDashboard"),
+    path("publicProjects/<int:pk>/series", views.publicDashboard_series, name="publicDashboard_series"),
+    path("publicProjects/<int:pk>/range", views.publicDashboard_range, name="publicDashboard_range"),
+    path("publicProjects/<int:pk>/comments", views.publicDashboard_comments, name="publicDashboard_comments"),
     path("publicProjects/<int:pk>/comment", views.create_publicDashboard_comment, name="create_publicDashboard_comment"),
     path("publicProjects/<int:pk>/like/", views.create_publicDashboard_like, name="create_publicDashboard_like"),
 ]
\ No newline at end of file
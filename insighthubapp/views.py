@@ -1,15 +1,21 @@
 from django.shortcuts import render, get_object_or_404, redirect
+from django.template.loader import render_to_string
 from django.contrib.auth import authenticate, login as auth_login, logout as auth_logout
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from .forms import UserSignUpForm, UserLoginForm, DatasetForm, DashboardForm, CommentForm, SelectedColumnsForm
-from .models import UserProfile, Roles, Dashboards, Datasets, Charts, Chart_Types, Social_Like, Social_Comment, Dataset_Columns, Selected_Columns
-import csv, json
+from .models import UserProfile, Roles, Dashboards, Datasets, Charts, Chart_Types, Social_Like, Social_Comment, Dataset_Columns, Selected_Columns, Ingest_Jobs
+import csv, io, json
+from django.core.files.base import ContentFile
 from django.utils.html import escape
-from django.http import JsonResponse
-from django.db.models import Count
-import os
+from django.http import Http404, JsonResponse
+from django.db import connection
+import logging, os
 from django.conf import settings
+from . import aggregate, datastore, downsample, edits, etags, gallery, jobs, pagecache, previews, profiles, pyramid, sketches, social
+
+
+logger = logging.getLogger(__name__)
 
 
 def index(request):
@@ -95,42 +101,8 @@ def logout(request):
 @login_required
 def projects(request):
     if request.method == "GET":
-        dashboards = Dashboards.objects.filter(user=request.user)
-
-        chart_previews = []
-
-        for d in dashboards:
-            chart_data = []
-            chart_type = "bar"
-            axis = {}
-
-            if d.chart and d.chart.dataset and d.chart.dataset.file_path:
-                try:
-                    with d.chart.dataset.file_path.open(mode='r') as f:
-                        reader = csv.reader(f)
-                        chart_data = list(reader)
-                except Exception as e:
-                    print(f"Failed to read CSV for dashboard {d.id}: {e}")
-                    chart_data = []
-
-                selected_columns = Selected_Columns.objects.filter(chart=d.chart)
-                for sel in selected_columns:
-                    axis[sel.axis_type] = sel.column.column_name
-
-            if d.chart and d.chart.chart_type and d.chart.chart_type.chart_type:
-                if d.chart.chart_type.chart_type == "Bar Chart":
-                    chart_type = "bar"
-                elif d.chart.chart_type.chart_type == "Line Chart":
-                    chart_type = "line"
-
-            chart_previews.append({
-                "id": d.id,
-                "type": chart_type,
-                "data": chart_data,
-                "axis": axis,
-            })
+        dashboards, chart_previews = previews.load_previews(Dashboards.objects.filter(user=request.user))
 
-            
         return render(request, "projects.html", {
             "projects": dashboards,
             "chart_previews_json": json.dumps(chart_previews),
@@ -154,12 +126,19 @@ def create_dashboard(request):
 
 
 @login_required
+@etags.dashboard_condition(owner=True, forms=True)
 def dashboard(request, pk):
     dashboard = get_object_or_404(Dashboards, pk=pk, user=request.user)
     dataset = Datasets.objects.filter(user=request.user, dashboard=dashboard).first()
-    selected_columns = Selected_Columns.objects.filter(chart=dashboard.chart) if dashboard.chart else None
+    selected_columns = Selected_Columns.objects.filter(chart=dashboard.chart).select_related("column").defer("column__sketch") if dashboard.chart else None
+    ingest_job = jobs.latest_job(dataset)
 
+    store = None
+    dataset_header = []
     csv_data = []
+    row_count = 0
+    chart_series = {}
+    chart_groups = None
     axis = []
     axis_letter = []
 
@@ -168,12 +147,13 @@ def dashboard(request, pk):
             axis.append({sel.axis_type: sel.column.column_name})
 
     if dataset and dataset.file_path:
-        with dataset.file_path.open(mode='r') as f:
-            reader = csv.reader(f)
-            csv_data = list(reader)
-            colname_to_letter = {col_name: chr(ord('A') + idx) for idx, col_name in enumerate(csv_data[0])}
-    else:
-        colname_to_letter = {}
+        if jobs.store_ready(ingest_job):
+            store = datastore.store_for(dataset)
+            dataset_header = store.header
+        else:
+            # The ingest worker has not built the store yet; the page polls it
+            dataset_header = datastore.read_header(dataset.file_path.path)
+    colname_to_letter = {col_name: chr(ord('A') + idx) for idx, col_name in enumerate(dataset_header)}
 
     if selected_columns:
         for sel in selected_columns:
@@ -192,9 +172,12 @@ def dashboard(request, pk):
                 csv_string = request.body.decode('utf-8')
                 csv_rows = list(csv.reader(csv_string.splitlines()))
                 if dataset:
-                    with dataset.file_path.open(mode='w') as f:
-                        writer = csv.writer(f)
-                        writer.writerows(csv_rows)
+                    # Saved as a new upload: the current file may be shared (see uploads.py)
+                    content = io.StringIO()
+                    csv.writer(content).writerows(csv_rows)
+                    dataset.file_path.save(os.path.basename(dataset.file_path.name), ContentFile(content.getvalue().encode("utf-8")))
+                    jobs.enqueue_upload(dataset)
+                    previews.invalidate_preview(dashboard.id)
                     return JsonResponse({'success': True})
                 else:
                     return JsonResponse({'success': False, 'error': 'No dataset found.'})
@@ -216,18 +199,9 @@ def dashboard(request, pk):
                 new_dataset.dashboard = dashboard
                 new_dataset.save()
 
-                # Extract header and create Dataset_Columns
-                if (new_dataset.file_path):
-                    with new_dataset.file_path.open(mode='r') as f:
-                        reader = csv.reader(f)
-                        header = next(reader)
-                        if header:
-                            for idx, col_name in enumerate(header):
-                                Dataset_Columns.objects.create(
-                                    column_name=col_name,
-                                    data_type="string",
-                                    dataset=new_dataset
-                                )
+                # Register the new upload's columns; the ingest worker builds its store
+                if new_dataset.file_path and "file_path" in request.FILES:
+                    jobs.enqueue_upload(new_dataset, request.FILES["file_path"])
 
                 chart_type = dashboard_form.cleaned_data.get("chart_type")
                 if dashboard.chart:
@@ -247,6 +221,7 @@ def dashboard(request, pk):
                 status = dashboard_form.cleaned_data.get("status")
                 dashboard.status = True if status == "True" else False
                 dashboard.save()
+                previews.invalidate_preview(dashboard.id)
 
                 return redirect("dashboard", pk=dashboard.pk)
             
@@ -276,31 +251,23 @@ def dashboard(request, pk):
             #                 )
 
 
+            header = []
             if dataset_form.is_valid():
                 new_dataset = dataset_form.save()
                 new_dataset.user = request.user
                 new_dataset.dashboard = dashboard
                 new_dataset.save()
-                header = []
 
-                # Only extract header and create Dataset_Columns if file exists
+                # Only ingest and register Dataset_Columns if file exists
                 if new_dataset.file_path:
-                    with new_dataset.file_path.open(mode='r') as f:
-                        reader = csv.reader(f)
-                        header = next(reader)
-                        if header:
-                            for idx, col_name in enumerate(header):
-                                Dataset_Columns.objects.create(
-                                    column_name=col_name,
-                                    data_type="string",
-                                    dataset=new_dataset
-                                )
-                else:
-                    # Optionally, you can delete Dataset_Columns if file is cleared
-                    Dataset_Columns.objects.filter(dataset=new_dataset) .delete()
+                    if "file_path" in request.FILES:
+                        header = jobs.enqueue_upload(new_dataset, request.FILES["file_path"])
+                    else:
+                        header = dataset_header
+                # A cleared file's Dataset_Columns go with it (signals.py)
+                previews.invalidate_preview(dashboard.id)
             
             if selected_columns_form.is_valid():
-                selected_columns = selected_columns_form.save(commit=False)
                 x_letter = selected_columns_form.cleaned_data['x_axis']
                 y_letter = selected_columns_form.cleaned_data['y_axis']
                 category_letter = selected_columns_form.cleaned_data['category']
@@ -311,64 +278,28 @@ def dashboard(request, pk):
                 category_index = col_letter_to_index(category_letter)
                 series_index = col_letter_to_index(series_letter)
 
-                if dataset_form.is_valid():
-                    new_dataset = dataset_form.save()
-                    new_dataset.user = request.user
-                    new_dataset.dashboard = dashboard
-                    new_dataset.save()
-
-                    if new_dataset.file_path:
-                        with new_dataset.file_path.open(mode='r') as f:
-                            reader = csv.reader(f)
-                            header = next(reader, [])
-
-                    if 0 <= x_index < len(header):
-                        x_col_name = header[x_index]
-                        x_col = Dataset_Columns.objects.filter(dataset=dataset, column_name=x_col_name).first()
-                        if x_col:
-                            Selected_Columns.objects.update_or_create(
-                                chart=dashboard.chart,
-                                axis_type='x',
-                                defaults={'column': x_col}
-                            )
-
-                    if 0 <= y_index < len(header):
-                        y_col_name = header[y_index]
-                        y_col = Dataset_Columns.objects.filter(dataset=dataset, column_name=y_col_name).first()
-                        if y_col:
-                            Selected_Columns.objects.update_or_create(
-                                chart=dashboard.chart,
-                                axis_type='y',
-                                defaults={'column': y_col}
-                            )
-
-                    if 0 <= category_index < len(header):
-                        category_col_name = header[category_index]
-                        category_col = Dataset_Columns.objects.filter(dataset=dataset, column_name=category_col_name).first()
-                        if category_col:
-                            Selected_Columns.objects.update_or_create(
-                                chart=dashboard.chart,
-                                axis_type='category',
-                                defaults={'column': category_col}
-                            )
-                    
-                    if 0 <= series_index < len(header):
-                        series_col_name = header[series_index]
-                        series_col = Dataset_Columns.objects.filter(dataset=dataset, column_name=series_col_name).first()
-                        if series_col:
-                            Selected_Columns.objects.update_or_create(
+                if dataset_form.is_valid() and dashboard.chart:
+                    columns = {c.column_name: c for c in Dataset_Columns.objects.filter(dataset=new_dataset).defer("sketch")}
+
+                    selections = []
+                    for axis_type, index in (("x", x_index), ("y", y_index), ("category", category_index), ("series", series_index)):
+                        if 0 <= index < len(header) and header[index] in columns:
+                            selections.append(Selected_Columns(
                                 chart=dashboard.chart,
-                                axis_type='series',
-                                defaults={'column': series_col}
-                            )
-                selected_columns_form.save()
+                                axis_type=axis_type,
+                                column=columns[header[index]]
+                            ))
+                    save_selected_columns(selections)
+
+                    # Bump the chart's updated_at so cached previews keyed on it go stale
+                    dashboard.chart.save(update_fields=["updated_at"])
+                    previews.invalidate_preview(dashboard.id)
                 return redirect("dashboard", pk=dashboard.pk)
     else:
         dataset_form = DatasetForm(instance=dataset)
         if dataset_form.is_valid():
-            print("post dataset_form")
             new_dataset = dataset_form.save(user=request.user, dashboard=dashboard)
-        selected_columns_qs = Selected_Columns.objects.filter(chart=dashboard.chart) if dashboard.chart else []
+        selected_columns_qs = selected_columns or []
         initial = {
             'chart_type': dashboard.chart.chart_type if dashboard.chart else None,
         }
@@ -385,17 +316,215 @@ def dashboard(request, pk):
                 initial['series'] = col_letter
         selected_columns_form = SelectedColumnsForm(initial=initial)
 
+    # Only the header and the first window of rows go into the page; the
+    # spreadsheet fetches the rest from dashboard_rows as the user scrolls
+    if store:
+        csv_data = [store.header] + store.rows(stop=spreadsheet_row_window())
+        row_count = store.row_count
+        chart_axis = {key: value for a in axis for key, value in a.items()}
+        # Both read every row, so they come from the preview cache until the
+        # data or the chart changes
+        chart_series = previews.editor_payload(dashboard, dataset, store, ("series", chart_point_budget()), lambda: previews.project_series(
+            store, editor_chart_axis(chart_axis), chart_point_budget(), previews.series_mode(dashboard.chart)
+        ))
+        try:
+            chart_groups = previews.editor_payload(
+                dashboard, dataset, store, ("aggregate",), lambda: aggregate.chart_aggregate(store, chart_axis)
+            )
+        except ValueError as e:
+            logger.warning("Failed to aggregate dashboard %s: %s", dashboard.id, e)
+
     return render(request, "dashboard.html", {
         "dashboard_form": dashboard_form,
         "dataset_form": dataset_form,
         "selected_columns_form": selected_columns_form,
         "dashboard": dashboard,
         "csv_data": json.dumps(csv_data),
+        "row_count": row_count,
+        "row_window": spreadsheet_row_window(),
+        "data_version": dataset.data_version if dataset else 0,
+        "ingest_job": None if jobs.store_ready(ingest_job) else jobs.describe(ingest_job),
+        "chart_series": json.dumps(chart_series),
+        "chart_groups": json.dumps(chart_groups),
+        "aggregates": aggregate.AGGREGATES,
         "axis": json.dumps(axis),
         "axis_letter": json.dumps(axis_letter),
         "show_header": True,
         "show_footer": True
     })
+
+
+# Status of the latest ingest job for the dashboard's dataset, polled by the
+# editor while an upload is being processed
+@login_required
+def dashboard_ingest(request, pk):
+    job = Ingest_Jobs.objects.filter(dataset__user=request.user, dataset__dashboard_id=pk).order_by("-id").first()
+    if job is None:
+        return JsonResponse({'success': False, 'error': 'No ingest job found.'}, status=404)
+    return JsonResponse({'success': True, 'job': jobs.describe(job)})
+
+
+# Profiles of the dashboard dataset's columns (see profiles.py), in sheet
+# order, for axis scaling, axis picker hints and data-quality badges
+@login_required
+@etags.dashboard_condition(owner=True)
+def dashboard_columns(request, pk):
+    dataset = Datasets.objects.filter(user=request.user, dashboard_id=pk).annotate(ingest_status=jobs.latest_status()).first()
+    if dataset is None or not dataset.file_path:
+        return JsonResponse({'success': False, 'error': 'Dashboard has no dataset.'}, status=404)
+    if not jobs.status_ready(dataset.ingest_status):
+        return not_ready_response(dataset.ingest_status)
+
+    store = datastore.store_for(dataset)
+    position = {}
+    for idx, name in enumerate(store.header):
+        position.setdefault(name, idx)
+    limit = profiles.distinct_limit()
+    columns = []
+    profiled = Dataset_Columns.objects.filter(dataset=dataset, column_name__in=position).defer("sketch")
+    for col in sorted(profiled, key=lambda col: position[col.column_name]):
+        columns.append({
+            "letter": chr(ord('A') + position[col.column_name]),
+            "name": col.column_name,
+            "type": col.data_type,
+            "null_count": col.null_count,
+            "distinct_count": col.distinct_count,
+            "distinct_exact": col.distinct_count <= limit,
+            "min": col.min_value,
+            "max": col.max_value,
+            "histogram": col.histogram,
+        })
+    return JsonResponse({'success': True, 'row_count': store.row_count, 'columns': columns})
+
+
+# Window of spreadsheet rows [offset, offset + limit) as JSON
+@login_required
+@etags.dashboard_condition(owner=True)
+def dashboard_rows(request, pk):
+    dashboard = get_object_or_404(Dashboards, pk=pk, user=request.user)
+    dataset = Datasets.objects.filter(user=request.user, dashboard=dashboard).annotate(ingest_status=jobs.latest_status()).first()
+    if dataset and not jobs.status_ready(dataset.ingest_status):
+        return not_ready_response(dataset.ingest_status)
+
+    try:
+        offset = max(int(request.GET.get("offset", 0)), 0)
+        limit = int(request.GET.get("limit", spreadsheet_row_window()))
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'offset and limit must be integers.'}, status=400)
+    limit = min(max(limit, 0), getattr(settings, "SPREADSHEET_MAX_ROW_WINDOW", 5000))
+
+    store = datastore.store_for(dataset)
+    rows = store.rows(start=offset, stop=offset + limit) if store else []
+    row_count = store.row_count if store else 0
+
+    response = JsonResponse({'success': True, 'offset': offset, 'rows': rows, 'row_count': row_count})
+    response["X-Row-Count"] = row_count
+    return response
+
+
+# y aggregated per category (and series) group of the chart's selected axes
+@login_required
+@etags.dashboard_condition(owner=True)
+def dashboard_aggregate(request, pk):
+    dashboard = get_object_or_404(previews.with_preview_relations(Dashboards.objects), pk=pk, user=request.user)
+    dataset = Datasets.objects.filter(user=request.user, dashboard=dashboard).annotate(ingest_status=jobs.latest_status()).first()
+    if dataset and not jobs.status_ready(dataset.ingest_status):
+        return not_ready_response(dataset.ingest_status)
+    store = datastore.store_for(dataset)
+    if store is None:
+        return JsonResponse({'success': False, 'error': 'No dataset found.'}, status=404)
+
+    axis = previews.selected_axis(dashboard.chart)
+    if not axis.get("category"):
+        return JsonResponse({'success': False, 'error': 'Select a category column first.'}, status=400)
+
+    try:
+        result = aggregate.chart_aggregate(store, axis, request.GET.get("agg", aggregate.DEFAULT_AGGREGATE))
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    return JsonResponse({'success': True, **result})
+
+
+# Approximate chart modes answered from the column sketches alone, whatever
+# the dataset's size: ?mode=percentiles (&q=0.05,0.5,0.95) for bands of the
+# y column, ?mode=topk (&k=10) for the heaviest category (or x) cells
+@login_required
+@etags.dashboard_condition(owner=True)
+def dashboard_approx(request, pk):
+    dashboard = get_object_or_404(previews.with_preview_relations(Dashboards.objects), pk=pk, user=request.user)
+    mode = request.GET.get("mode")
+    if mode not in sketches.APPROX_MODES:
+        return JsonResponse({'success': False, 'error': f"mode must be one of {', '.join(sketches.APPROX_MODES)}."}, status=400)
+
+    axis = previews.selected_axis(dashboard.chart)
+    name = axis.get("y") if mode == "percentiles" else axis.get("category") or axis.get("x")
+    if not name:
+        return JsonResponse({'success': False, 'error': 'Select the chart axes first.'}, status=400)
+    data = Dataset_Columns.objects.filter(
+        dataset_id=dashboard.chart.dataset_id, column_name=name
+    ).values_list("sketch", flat=True).first()
+    if not data:
+        return JsonResponse({'success': False, 'error': 'The column has not been profiled yet.'}, status=409)
+
+    sketch = sketches.ColumnSketch.load(data)
+    try:
+        if mode == "percentiles":
+            result = sketches.chart_percentiles(sketch, name, request.GET.get("q"))
+        else:
+            result = sketches.chart_top_k(sketch, name, request.GET.get("k"))
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    return JsonResponse({'success': True, **result})
+
+
+# Editor chart series downsampled to the canvas width (?width=px&mode=lttb|minmax)
+@login_required
+@etags.dashboard_condition(owner=True)
+def dashboard_series(request, pk):
+    dashboard = get_object_or_404(previews.with_preview_relations(Dashboards.objects), pk=pk, user=request.user)
+    dataset = Datasets.objects.filter(user=request.user, dashboard=dashboard).annotate(ingest_status=jobs.latest_status()).first()
+    if dataset and not jobs.status_ready(dataset.ingest_status):
+        return not_ready_response(dataset.ingest_status)
+    axis = editor_chart_axis(previews.selected_axis(dashboard.chart))
+    return series_response(request, dashboard.chart, datastore.store_for(dataset), axis)
+
+
+# Zoomed editor chart buckets for ?x_from=&x_to=&width= (see range_response)
+@login_required
+@etags.dashboard_condition(owner=True)
+def dashboard_range(request, pk):
+    dashboard = get_object_or_404(previews.with_preview_relations(Dashboards.objects), pk=pk, user=request.user)
+    dataset = Datasets.objects.filter(user=request.user, dashboard=dashboard).annotate(ingest_status=jobs.latest_status()).first()
+    if dataset and not jobs.status_ready(dataset.ingest_status):
+        return not_ready_response(dataset.ingest_status)
+    axis = editor_chart_axis(previews.selected_axis(dashboard.chart))
+    return range_response(request, datastore.store_for(dataset), axis)
+
+
+# Apply a batch of cell / row-insert / row-delete ops to the stored dataset
+@login_required
+def dashboard_patch(request, pk):
+    if request.method != "POST":
+        return JsonResponse({'success': False, 'error': 'POST required.'}, status=405)
+
+    dashboard = get_object_or_404(Dashboards, pk=pk, user=request.user)
+    dataset = Datasets.objects.filter(user=request.user, dashboard=dashboard).first()
+    if not dataset or not dataset.file_path:
+        return JsonResponse({'success': False, 'error': 'No dataset found.'}, status=404)
+
+    try:
+        payload = json.loads(request.body)
+        version, row_count = edits.apply_patch(dataset, payload.get("ops"), payload.get("base_version"))
+    except edits.VersionConflict as e:
+        return JsonResponse({'success': False, 'error': str(e), 'version': e.version}, status=409)
+    except edits.IngestPending as e:
+        return not_ready_response(e.status)
+    except (ValueError, AttributeError) as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    previews.invalidate_preview(dashboard.id)
+    return JsonResponse({'success': True, 'version': version, 'row_count': row_count})
+
     
 @login_required
 def delete_dashboard(request, pk):
@@ -410,83 +539,69 @@ def delete_dashboard(request, pk):
 @login_required
 def publicProjects(request):
     if request.method == "GET":
-        publicProjects = Dashboards.objects.filter(status=0).annotate(
-            like_count=Count('social_like'),
-            comment_count=Count('social_comment')
-        )  # join social_like and dashboard tables
-        chart_previews = []
-        for pd in publicProjects:
-            chart_data = []
-            chart_type = "bar"
-            axis = {}
-
-            if pd.chart and pd.chart.dataset and pd.chart.dataset.file_path:
-                try:
-                    with pd.chart.dataset.file_path.open(mode='r') as f:
-                        reader = csv.reader(f)
-                        chart_data = list(reader)
-                except Exception as e:
-                    print(f"Failed to read CSV for dashboard {pd.id}: {e}")
-                    chart_data = []
-
-            selected_columns = Selected_Columns.objects.filter(chart=pd.chart)
-            for sel in selected_columns:
-                axis[sel.axis_type] = sel.column.column_name
-
-            if pd.chart and pd.chart.chart_type and pd.chart.chart_type.chart_type:
-                if pd.chart.chart_type.chart_type == "Bar Chart":
-                    chart_type = "bar"
-                elif pd.chart.chart_type.chart_type == "Line Chart":
-                    chart_type = "line"
-            chart_previews.append({
-                "id": pd.id,
-                "type": chart_type,
-                "data": chart_data,
-                "axis": axis,
-                "like_count": pd.like_count,
-                "comment_count": pd.comment_count,
-            })
+        sort = request.GET.get("sort") if request.GET.get("sort") in gallery.SORTS else gallery.DEFAULT_SORT
+        publicProjects, next_cursor, chart_previews = public_gallery_page(sort)
 
         return render(request, "publicProjects.html", {
             "projects": publicProjects,
             "chart_preview_json": json.dumps(chart_previews),
+            "sort": sort,
+            "next_cursor": next_cursor,
+            "card_cache_timeout": pagecache.timeout(),
             "show_header": True,
             "show_footer": True
         })
     return redirect("index")
 
 
+# Next page of gallery cards (rendered) and their previews for infinite scroll
+@login_required
+def publicProjects_page(request):
+    try:
+        publicProjects, next_cursor, chart_previews = public_gallery_page(
+            request.GET.get("sort", gallery.DEFAULT_SORT), request.GET.get("cursor")
+        )
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+
+    return JsonResponse({
+        'success': True,
+        'html': render_to_string("publicProjectCards.html", {
+            "projects": publicProjects, "card_cache_timeout": pagecache.timeout(),
+        }, request=request),
+        'previews': chart_previews,
+        'next': next_cursor,
+    })
+
+
+@pagecache.cache_public(per_user=True)
+@etags.dashboard_condition(per_user=True, forms=True)
 def publicDashboard(request, pk):
-    dashboard = get_object_or_404(Dashboards, pk=pk)
+    dashboard = get_object_or_404(previews.with_preview_relations(Dashboards.objects), pk=pk, status=False)
     chart = dashboard.chart
     dataset = chart.dataset if chart else None
-    chart_data = []
+    chart_data = {}
     chart_type = "bar"
-    axis = {}
+    axis = previews.selected_axis(chart)
+    chart_pending = not jobs.status_ready(dashboard.ingest_status)
 
-    if dataset and dataset.file_path:
-        file_path = os.path.join(settings.MEDIA_ROOT, dataset.file_path.name)
+    if dataset and dataset.file_path and not chart_pending:
         try:
-            with open(file_path, mode='r') as f:
-                reader = csv.reader(f)
-                chart_data = list(reader)
-        except Exception as e:
-            print(f"Failed to read CSV for dashboard {dashboard.id}: {e}")
-            chart_data = []
-
-    if chart:
-        selected_columns = Selected_Columns.objects.filter(chart=chart)
-        for sel in selected_columns:
-            axis[sel.axis_type] = sel.column.column_name
+            chart_data = previews.project_series(
+                datastore.store_for(dataset), axis, chart_point_budget(), previews.series_mode(chart)
+            )
+        except Exception:
+            logger.warning("Failed to read CSV for dashboard %s", dashboard.id, exc_info=True)
+            chart_data = {}
 
     if chart.chart_type.chart_type == "Bar Chart":
         chart_type = "bar"
     elif chart.chart_type.chart_type == "Line Chart":
         chart_type = "line"
 
-    comments = Social_Comment.objects.filter(dashboard=dashboard)
-    like = Social_Like.objects.filter(dashboard=dashboard, user=request.user).exists()
-    like_count = Social_Like.objects.filter(dashboard=dashboard).count()
+    comments, comments_next = social.comment_page(dashboard.pk)
+    like = request.user.is_authenticated and Social_Like.objects.filter(dashboard=dashboard, user=request.user).exists()
+    like_count = dashboard.like_count
 
     form = CommentForm()
 
@@ -494,9 +609,11 @@ def publicDashboard(request, pk):
         "publicDashboard": dashboard,
         "comment_form": form,
         "social_comments": comments,
+        "comments_next": comments_next,
         "social_likes": like_count,
         "like": like,
         "chart_data": json.dumps(chart_data),
+        "chart_pending": chart_pending,
         "chart_type": chart_type,
         "axis": json.dumps(axis),
         "show_header": True,
@@ -504,8 +621,54 @@ def publicDashboard(request, pk):
     })
 
 
+# Public chart series downsampled to the canvas width; public dashboards only
+@pagecache.cache_public()
+@etags.dashboard_condition()
+def publicDashboard_series(request, pk):
+    dashboard = get_object_or_404(previews.with_preview_relations(Dashboards.objects), pk=pk, status=False)
+    if not jobs.status_ready(dashboard.ingest_status):
+        return not_ready_response(dashboard.ingest_status)
+    chart = dashboard.chart
+    store = datastore.store_for(chart.dataset) if chart else None
+    return series_response(request, chart, store, previews.selected_axis(chart))
+
+
+# Zoomed public chart buckets; public dashboards only
+@pagecache.cache_public()
+@etags.dashboard_condition()
+def publicDashboard_range(request, pk):
+    dashboard = get_object_or_404(previews.with_preview_relations(Dashboards.objects), pk=pk, status=False)
+    if not jobs.status_ready(dashboard.ingest_status):
+        return not_ready_response(dashboard.ingest_status)
+    chart = dashboard.chart
+    store = datastore.store_for(chart.dataset) if chart else None
+    return range_response(request, store, previews.selected_axis(chart))
+
+
+# One page of a dashboard's comments (?cursor=<id> from the previous page),
+# as a rendered fragment plus the cursor for the next page
+def publicDashboard_comments(request, pk):
+    try:
+        before = int(request.GET["cursor"]) if request.GET.get("cursor") else None
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'Invalid cursor.'}, status=400)
+
+    comments, comments_next = social.comment_page(pk, before)
+    if not comments and not Dashboards.objects.filter(pk=pk).exists():
+        raise Http404("No dashboard found.")
+
+    return JsonResponse({
+        'success': True,
+        'html': render_to_string("publicDashboardComments.html", {"comments": comments}, request=request),
+        'next': comments_next,
+    })
+
+
+# Posted from the page's script (Accept: application/json) the new comment
+# comes back as a fragment; a plain form post redirects back to the dashboard
 @login_required
 def create_publicDashboard_comment(request, pk):
+    wants_json = "application/json" in request.headers.get("Accept", "")
     dashboard = get_object_or_404(Dashboards, pk=pk)
 
     if request.method == "POST":
@@ -514,8 +677,14 @@ def create_publicDashboard_comment(request, pk):
             comment = form.save(commit=False)
             comment.user = request.user
             comment.dashboard = dashboard
-            comment.save()
-            return redirect('publicDashboard', pk=pk)
+            social.add_comment(comment)
+            if wants_json:
+                return JsonResponse({
+                    'success': True,
+                    'html': render_to_string("publicDashboardComments.html", {"comments": [comment]}, request=request),
+                })
+        elif wants_json:
+            return JsonResponse({'success': False, 'error': form.errors.get_json_data()}, status=400)
     else:
         form = CommentForm()
 
@@ -524,23 +693,123 @@ def create_publicDashboard_comment(request, pk):
 
 @login_required
 def create_publicDashboard_like(request, pk):
-    if request.method == 'POST':
-        dashboard = get_object_or_404(Dashboards, pk=pk)
-        user = request.user
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'POST required.'}, status=405)
+
+    # The page sends the state it wants ({"liked": true|false}), so a repeated
+    # request cannot flip it back; without one the like is toggled
+    liked = None
+    if request.content_type == "application/json" and request.body:
+        try:
+            liked = json.loads(request.body).get("liked")
+        except (ValueError, AttributeError):
+            return JsonResponse({'success': False, 'error': 'Invalid JSON body.'}, status=400)
+        if liked is not None and not isinstance(liked, bool):
+            return JsonResponse({'success': False, 'error': 'liked must be true or false.'}, status=400)
 
-        existing_like = Social_Like.objects.filter(user=user, dashboard=dashboard)
+    try:
+        like, like_count = social.toggle_like(pk, request.user, liked)
+    except Dashboards.DoesNotExist:
+        raise Http404("No dashboard found.")
+    return JsonResponse({'liked': like, 'like_count': like_count})
 
-        if existing_like.exists():
-            # delete
-            existing_like.delete()
-            like = False
-        else:
-            # add
-            Social_Like.objects.create(user=user, dashboard=dashboard)
-            like = True
 
-        like_count = Social_Like.objects.filter(dashboard=dashboard).count()
-        return JsonResponse({'liked': like, 'like_count': like_count})
+# Whether the current user liked each dashboard of a gallery page (?ids=1,2,3)
+@login_required
+def publicProjects_likes(request):
+    try:
+        ids = [int(pk) for pk in request.GET.get("ids", "").split(",") if pk]
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'ids must be a comma-separated list of integers.'}, status=400)
+    if len(ids) > gallery.page_size() * 4:
+        return JsonResponse({'success': False, 'error': 'Too many ids.'}, status=400)
+
+    return JsonResponse({'success': True, 'liked': social.liked_state(request.user, ids)})
+
+
+def spreadsheet_row_window():
+    return getattr(settings, "SPREADSHEET_ROW_WINDOW", 500)
+
+
+def chart_point_budget():
+    return getattr(settings, "CHART_MAX_POINTS", 2000)
+
+
+# Upsert a chart's axis selections in one INSERT ... ON CONFLICT / ON DUPLICATE
+# KEY UPDATE, relying on the (chart, axis_type) unique constraint
+def save_selected_columns(selections):
+    if not selections:
+        return
+    unique_fields = ["chart", "axis_type"] if connection.features.supports_update_conflicts_with_target else None
+    Selected_Columns.objects.bulk_create(
+        selections, update_conflicts=True, unique_fields=unique_fields, update_fields=["column"]
+    )
+
+
+# One keyset page of public dashboards with their previews and social counts
+def public_gallery_page(sort, cursor=None):
+    queryset = previews.with_preview_relations(Dashboards.objects.filter(status=False))
+    dashboards, next_cursor = gallery.page(queryset, sort, cursor)
+    chart_previews = []
+    versions = pagecache.dashboard_versions([pd.pk for pd in dashboards])
+    for pd, preview in zip(dashboards, previews.build_previews(dashboards)):
+        pd.cache_version = versions[pd.pk]
+        preview["like_count"] = pd.like_count
+        preview["comment_count"] = pd.comment_count
+        chart_previews.append(preview)
+    return dashboards, next_cursor, chart_previews
+
+
+# 409 for data read from a dataset whose latest ingest job is not done, so the
+# request never builds the store the worker is building
+def not_ready_response(ingest_status):
+    if ingest_status == jobs.FAILED:
+        return JsonResponse({'success': False, 'error': 'The dataset could not be processed.'}, status=409)
+    return JsonResponse({'success': False, 'error': 'The dataset is still being processed.'}, status=409)
+
+
+# The editor chart plots the x column against the "Value" (series) column
+def editor_chart_axis(axis):
+    return {"x": axis.get("x"), "y": axis.get("series")}
+
+
+# JSON series for a chart, one point per pixel of the requested canvas width
+def series_response(request, chart, store, axis):
+    if store is None:
+        return JsonResponse({'success': False, 'error': 'No dataset found.'}, status=404)
+
+    mode = request.GET.get("mode") or previews.series_mode(chart)
+    if mode and mode not in downsample.DOWNSAMPLE_MODES:
+        return JsonResponse({'success': False, 'error': f'Unknown mode {mode!r}.'}, status=400)
+
+    points = downsample.points_for_width(request.GET.get("width"))
+    series = previews.project_series(store, axis, points, mode)
+    return JsonResponse({'success': True, 'mode': mode, **series})
+
+
+# Pyramid buckets of the y axis for an x range. x_from / x_to are x values when
+# the x column is numeric and sorted (epoch seconds for dates), row positions
+# otherwise or with ?by=row; width is the canvas width in pixels.
+def range_response(request, store, axis):
+    if store is None or not store.header:
+        return JsonResponse({'success': False, 'error': 'No dataset found.'}, status=404)
+
+    x, y = previews.axis_columns(store.header, axis)
+    try:
+        x_from = float(request.GET["x_from"]) if request.GET.get("x_from") else None
+        x_to = float(request.GET["x_to"]) if request.GET.get("x_to") else None
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'x_from and x_to must be numbers.'}, status=400)
+
+    try:
+        result = pyramid.query_range(
+            store, x, y, x_from, x_to,
+            width=downsample.points_for_width(request.GET.get("width")),
+            by_row=request.GET.get("by") == "row",
+        )
+    except ValueError as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=400)
+    return JsonResponse({'success': True, **result})
 
 
 # Convert columns letter to zero-based index
@@ -49,6 +49,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'insighthubapp.middleware.QueryBudgetMiddleware',
 ]
 
 ROOT_URLCONF = 'insighthubproject.urls'
@@ -127,6 +128,58 @@ STATIC_ROOT = "/var/www/htdocs/insighthub_static/"    # Wen 12-04-2025 Add stati
 MEDIA_URL = "/media/"    # Wen 13-04-2025 Add media URL
 MEDIA_ROOT = BASE_DIR / "media"    # Wen 13-04-2025 Add media Root
 
+# Spool uploads to disk reading only the CSV header and hashing them (they
+# are stored once per content, see insighthubapp/uploads.py); the ingest
+# worker (manage.py ingest_worker) parses the rest and builds the columnar store
+FILE_UPLOAD_HANDLERS = ["insighthubapp.ingest.CsvIngestUploadHandler"]
+INGEST_JOB_TIMEOUT = 30 * 60    # seconds before a running job counts as abandoned
+UPLOAD_GRACE_SECONDS = 15 * 60    # unreferenced uploads younger than this are kept (manage.py collect_uploads)
+
+# Most points a gallery card preview plots, however large its dataset
+PREVIEW_MAX_POINTS = 200
+PREVIEW_CACHE_SIZE = 512    # finished previews kept per worker process (LRU)
+PREVIEW_WORKERS = 8    # threads reading uncached previews, per worker process
+PREVIEW_DEADLINE = 2.0    # seconds a page waits before showing a placeholder card
+
+# Spreadsheet rows embedded in the editor page / served per scroll fetch, and
+# the most points the editor chart plots
+SPREADSHEET_ROW_WINDOW = 500
+SPREADSHEET_MAX_ROW_WINDOW = 5000
+CHART_MAX_POINTS = 2000
+
+# Spreadsheet patches journaled before the CSV is rewritten in one go
+DATASET_JOURNAL_LIMIT = 1000
+
+# Most (category, series) groups a chart aggregate returns
+AGGREGATE_MAX_GROUPS = 1000
+
+# Column profiles computed at ingest: histogram bins per value column, and the
+# distinct cells counted exactly before the HyperLogLog estimate is used
+PROFILE_HISTOGRAM_BINS = 20
+PROFILE_DISTINCT_LIMIT = 100_000
+
+# Column sketches (HyperLogLog precision, KLL compactor size, heavy cells kept)
+SKETCH_HLL_PRECISION = 12
+SKETCH_KLL_K = 128
+SKETCH_TOP_ITEMS = 100
+
+# Shared by the gunicorn workers on a host, so a signal handled in one of
+# them retires cached public pages for all of them
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / "cache",
+    }
+}
+
+# Seconds an anonymous public page or gallery card stays cached
+PUBLIC_PAGE_CACHE_TIMEOUT = 300
+
+# Per-request SQL query counting: debug headers on every response, and a
+# warning in the log for requests that run more queries than the budget
+QUERY_DEBUG_HEADERS = DEBUG
+QUERY_BUDGET = 30
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 